@@ -1,83 +1,814 @@
+import asyncio
+import json
 import os
-from typing import Optional
+import threading
+import time
+from importlib.util import find_spec
+from typing import Any, AsyncIterator, Awaitable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 import httpx
 
-ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .llm_cache import cache_key, get_cache
+from .llm_hedge import Hedger
+from .llm_limiter import CoolingDown, LLMLimiter, estimate_tokens, parse_retry_after
+from .llm_metrics import current_endpoint, metrics, reset_endpoint, set_endpoint
+from . import llm_router
+from .llm_router import BACKGROUND, INTERACTIVE, MIN_ATTEMPT_SECONDS, DeadlineExceeded
+from .singleflight import SingleFlight
+
+# Point ANTHROPIC_API_URL at a local stand-in (see api/mock_llm.py) for tests.
+ANTHROPIC_API_URL = os.getenv("ANTHROPIC_API_URL", "https://api.anthropic.com/v1/messages")
 ANTHROPIC_VERSION = "2023-06-01"
+DEFAULT_MODEL = "claude-3-haiku-20240307"
 
+# Shortest prefix, in tokens, the Messages API caches; below it a cache
+# breakpoint is ignored. Haiku models need 2048, the others 1024.
+CACHE_MIN_TOKENS_HAIKU = 2048
+CACHE_MIN_TOKENS = 1024
 
-def call_claude(prompt: str, max_tokens: int = 1024, model: str = "claude-3-haiku-20240307") -> str:
-    """Call Anthropic Claude Messages API.
+# Connection pool / timeout settings for the shared client. All of these can be
+# overridden through the environment without touching code.
+MAX_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ANTHROPIC_MAX_KEEPALIVE_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = float(os.getenv("ANTHROPIC_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("ANTHROPIC_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("ANTHROPIC_READ_TIMEOUT", "30"))
+POOL_TIMEOUT = float(os.getenv("ANTHROPIC_POOL_TIMEOUT", "10"))
 
-    Uses the modern Messages API (v1/messages) with Claude 3 models.
+# HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1 keep-alive without it.
+HTTP2_ENABLED = os.getenv("ANTHROPIC_HTTP2", "1") != "0" and find_spec("h2") is not None
 
-    If `ANTHROPIC_API_KEY` is not set, this returns a short mocked response so
-    the server can be run without credentials during development.
+# The shared client belongs to one event loop: the app's loop once
+# `open_client()` has run, otherwise a background loop started on demand for
+# synchronous callers (scripts).
+_client: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
 
-    Args:
-        prompt: The user prompt/question to send to Claude
-        max_tokens: Maximum tokens in the response (default: 1024)
-        model: Claude model to use (default: claude-3-haiku-20240307)
+# Identical prompts in flight at the same time share one upstream request.
+_inflight = SingleFlight()
 
-    Returns:
-        The text content from Claude's response
+# Every upstream request goes through one rate/concurrency limiter.
+_limiter = LLMLimiter()
+
+# Duplicates attempts that are slower than usual to get headers (LLM_HEDGE=1).
+_hedger = Hedger()
+
+# Stops calling a failing upstream; callers fall back to cached or template output.
+_breaker = CircuitBreaker()
+
+# Token usage across all calls, including prompt-cache writes and reads.
+_usage_totals = {
+    "input_tokens": 0,
+    "output_tokens": 0,
+    "cache_creation_input_tokens": 0,
+    "cache_read_input_tokens": 0,
+}
+
+
+class Prompt(NamedTuple):
+    """A prompt split into a stable, cacheable `prefix` and a variable `text`.
+
+    Accepted anywhere a plain prompt string is, e.g. `acall_claude(Prompt(...))`.
     """
-    # Read the API key at call time so changes to environment or .env are picked up
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        return "(mocked Claude response) " + prompt[:200]
 
-    headers = {
+    text: str
+    prefix: Optional[str] = None
+
+
+class Fallback(NamedTuple):
+    """Degraded-mode output for a Claude call.
+
+    `label` identifies the output across prompt changes (e.g. "handoff:12");
+    the latest response stored under it is served when the upstream is
+    unavailable, and `text` (a deterministic summary built from the
+    structural data) when nothing has been stored yet. Labels must come from
+    a bounded set (entity ids, not free text); with no label only `text` is
+    served.
+    """
+
+    label: Optional[str]
+    text: str
+
+
+def _split_prompt(prompt: Union[str, Prompt], prefix: Optional[str]) -> Any:
+    if isinstance(prompt, Prompt):
+        return prompt.text, prompt.prefix
+    return prompt, prefix
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            READ_TIMEOUT,
+            connect=CONNECT_TIMEOUT,
+            pool=POOL_TIMEOUT,
+        ),
+    )
+
+
+def _attempt_timeout(deadline: Optional[float]) -> Dict[str, Any]:
+    """Request kwargs shortening the client timeouts to what is left before `deadline`."""
+    if deadline is None:
+        return {}
+    remaining = max(0.001, deadline - time.monotonic())
+    return {"timeout": httpx.Timeout(
+        min(READ_TIMEOUT, remaining),
+        connect=min(CONNECT_TIMEOUT, remaining),
+        pool=min(POOL_TIMEOUT, remaining),
+    )}
+
+
+def get_client() -> httpx.AsyncClient:
+    """Return the process-wide pooled async client for the running event loop."""
+    global _client, _loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop:
+        with _lock:
+            if _client is None or _loop is not loop:
+                if _loop is not None and _loop is not loop and _loop.is_running():
+                    raise RuntimeError("the Claude client is bound to another event loop; use call_claude()")
+                _client = _new_client()
+                _loop = loop
+    return _client
+
+
+async def open_client() -> httpx.AsyncClient:
+    """Bind the shared client to the running loop (call from app startup)."""
+    global _client, _loop
+    loop = asyncio.get_running_loop()
+    with _lock:
+        old_client, old_loop = _client, _loop
+        _client, _loop = _new_client(), loop
+    if old_client is not None and old_loop is not loop and old_loop.is_running():
+        asyncio.run_coroutine_threadsafe(old_client.aclose(), old_loop)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared client and release its pooled connections."""
+    global _client, _loop
+    with _lock:
+        client, _client, _loop = _client, None, None
+    if client is not None:
+        await client.aclose()
+
+
+def _owner_loop() -> asyncio.AbstractEventLoop:
+    """Return the loop owning the shared client, starting a background one if needed."""
+    global _loop
+    with _lock:
+        if _loop is not None and _loop.is_running():
+            return _loop
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="claude-client-loop", daemon=True).start()
+        _loop = loop
+        return loop
+
+
+def extract_text(data: Any) -> str:
+    # Response expected to have a "content" list with text fragments
+    if isinstance(data, dict) and "content" in data and len(data["content"]) > 0:
+        # Many responses use 'text' inside the content item
+        first = data["content"][0]
+        if isinstance(first, dict):
+            return first.get("text") or first.get("content") or str(data)
+        return str(first)
+    return str(data)
+
+
+async def _as_endpoint(endpoint: str, coro: Awaitable[Any]) -> Any:
+    token = set_endpoint(endpoint)
+    try:
+        return await coro
+    finally:
+        reset_endpoint(token)
+
+
+def _run_blocking(coro: Awaitable[Any]) -> Any:
+    """Run `coro` on the client's loop from synchronous code and wait for it.
+
+    The caller's endpoint is carried over so metrics are attributed to it.
+    """
+    loop = _owner_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coro.close()
+        raise RuntimeError("blocking Claude call from the event loop; use the async API instead")
+    return asyncio.run_coroutine_threadsafe(_as_endpoint(current_endpoint(), coro), loop).result()
+
+
+def anthropic_headers(api_key: str) -> Dict[str, str]:
+    return {
         "x-api-key": api_key,
         "anthropic-version": ANTHROPIC_VERSION,
         "Content-Type": "application/json",
     }
 
-    payload = {
+
+def prefix_cacheable(prefix: str, model: str) -> bool:
+    """Whether `prefix` likely reaches `model`'s minimum cacheable length (~4 characters per token)."""
+    minimum = CACHE_MIN_TOKENS_HAIKU if "haiku" in model else CACHE_MIN_TOKENS
+    return estimate_tokens(prefix, 0) >= minimum
+
+
+def message_params(prompt: str, max_tokens: int, model: str, temperature: float, prefix: Optional[str] = None) -> Dict[str, Any]:
+    """Return the Messages API request body for a single-turn prompt.
+
+    A `prefix` is sent as its own content block ahead of the prompt. When it
+    is long enough for the model to cache (see `prefix_cacheable`) it is
+    marked with a prompt-caching breakpoint, so repeated requests sharing it
+    are billed and processed as cache reads; shorter prefixes are sent
+    uncached.
+    """
+    if prefix:
+        prefix_block: Dict[str, Any] = {"type": "text", "text": prefix}
+        if prefix_cacheable(prefix, model):
+            prefix_block["cache_control"] = {"type": "ephemeral"}
+        content: Any = [prefix_block, {"type": "text", "text": prompt}]
+    else:
+        content = prompt
+    return {
         "model": model,
         "max_tokens": max_tokens,
-        "temperature": 0.2,
+        "temperature": temperature,
         "messages": [
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": content}
         ],
     }
 
-    # Simple retry/backoff for transient errors (5xx, 429).
+
+def _build_request(api_key: str, prompt: str, max_tokens: int, model: str, temperature: float, prefix: Optional[str] = None, stream: bool = False) -> Dict[str, Any]:
+    payload = message_params(prompt, max_tokens, model, temperature, prefix)
+    if stream:
+        payload["stream"] = True
+    return {"headers": anthropic_headers(api_key), "json": payload}
+
+
+def _mocked_response(prompt: str, prefix: Optional[str]) -> str:
+    return "(mocked Claude response) " + ((prefix + "\n\n" + prompt) if prefix else prompt)[:200]
+
+
+def _is_outage(error: BaseException) -> bool:
+    """Whether a failed call says the upstream is down or overloaded (vs. a bad request)."""
+    if isinstance(error, CoolingDown):
+        # Refused by the limiter while it backs off from earlier 429/5xx/timeouts.
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+async def _fallback_text(fallback: Fallback) -> Tuple[str, str]:
+    """Return the degraded output and whether it came from the cache or the template."""
+    cache = get_cache()
+    if cache is not None and fallback.label:
+        last = await asyncio.to_thread(cache.latest, fallback.label)
+        if last is not None:
+            return last, "cached"
+    return fallback.text, "template"
+
+
+def _record_usage(usage: Any) -> Optional[int]:
+    """Add a response's `usage` to the running totals; return tokens billed."""
+    if not isinstance(usage, dict):
+        return None
+    for field in _usage_totals:
+        _usage_totals[field] += usage.get(field) or 0
+    return sum(usage.get(field) or 0 for field in _usage_totals)
+
+
+async def _post_with_retries(request: Dict[str, Any], cost: int, priority: str = INTERACTIVE) -> str:
+    """POST to the Messages API through the shared limiter; raises the last error.
+
+    429, 5xx and transport errors (including timeouts) are retried. Instead
+    of sleeping on its own timer, a retry re-enters the front of the limiter
+    queue, which applies `retry-after` or a shared back-off. Any other error
+    is raised at once and its permit is returned without counting against
+    the upstream.
+
+    The call is recorded in `llm_metrics`: latency covers queueing and
+    retries, time to first byte is measured to the successful response's
+    headers.
+    """
     retries = 3
-    backoff = 1.0
-    last_exc = None
+    client = get_client()
+    model = request["json"]["model"]
+    started = time.monotonic()
     for attempt in range(1, retries + 1):
+        await _limiter.acquire(cost, retry=attempt > 1, priority=priority)
+        ok = overloaded = False
+        retry_after = tokens_used = None
         try:
-            resp = httpx.post(ANTHROPIC_API_URL, json=payload, headers=headers, timeout=30)
-            # If status indicates transient issue, raise to trigger retry
-            if resp.status_code >= 500 or resp.status_code == 429:
-                resp.raise_for_status()
+            resp = await _hedger.send(
+                lambda: client.send(client.build_request("POST", ANTHROPIC_API_URL, **request), stream=True),
+                _limiter,
+                cost,
+                priority,
+            )
+            ttfb = time.monotonic() - started
+            try:
+                await resp.aread()
+            finally:
+                await resp.aclose()
+            if resp.is_success:
+                data = resp.json()
+                usage = data.get("usage") if isinstance(data, dict) else None
+                tokens_used = _record_usage(usage)
+                ok = True
+            else:
+                overloaded = resp.status_code == 429 or resp.status_code >= 500
+                if overloaded:
+                    retry_after = parse_retry_after(resp.headers.get("retry-after"))
+        except httpx.TransportError:
+            overloaded = True
+            if attempt == retries:
+                metrics.record_call(model, time.monotonic() - started, retries=attempt - 1, ok=False)
+                raise
+            continue
+        finally:
+            # Also on cancellation or a bug here: anything but an upstream
+            # signal releases the permit without a verdict on the upstream.
+            _limiter.release(cost, ok=ok, overloaded=overloaded, retry_after=retry_after, tokens_used=tokens_used, priority=priority)
 
+        if ok:
+            metrics.record_call(model, time.monotonic() - started, ttfb, attempt - 1, usage)
+            return extract_text(data)
+        if not overloaded or attempt == retries:
+            metrics.record_call(model, time.monotonic() - started, retries=attempt - 1, ok=False)
             resp.raise_for_status()
-            data = resp.json()
-
-            # Response expected to have a "content" list with text fragments
-            if isinstance(data, dict) and "content" in data and len(data["content"]) > 0:
-                # Many responses use 'text' inside the content item
-                first = data["content"][0]
-                if isinstance(first, dict):
-                    return first.get("text") or first.get("content") or str(data)
-                return str(first)
-
-            return str(data)
-        except Exception as e:
-            last_exc = e
-            # If last attempt, return a helpful error string
-            if attempt == retries:
-                return f"(anthropic call failed: {e})"
-            # Otherwise wait and retry
-            try:
-                import time
 
-                time.sleep(backoff)
-                backoff *= 2
-            except Exception:
+
+async def acall_claude(
+    prompt: Union[str, Prompt],
+    max_tokens: int = 1024,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.2,
+    use_cache: bool = True,
+    prefix: Optional[str] = None,
+    budget: Optional[float] = None,
+    priority: str = INTERACTIVE,
+) -> str:
+    """Call Anthropic Claude Messages API without blocking the event loop.
+
+    Uses the modern Messages API (v1/messages) with Claude 3 models.
+
+    If `ANTHROPIC_API_KEY` is not set, this returns a short mocked response so
+    the server can be run without credentials during development.
+
+    Args:
+        prompt: The user prompt/question to send to Claude, or a `Prompt`
+        max_tokens: Maximum tokens in the response (default: 1024)
+        model: Claude model to use (default: claude-3-haiku-20240307)
+        temperature: Sampling temperature (default: 0.2)
+        use_cache: Set to False to bypass the persistent response cache
+        prefix: Stable leading context (instructions, documents) shared by
+            many prompts; sent ahead of `prompt` with a prompt-caching
+            breakpoint
+        budget: Latency budget in seconds. The model and `max_tokens` are
+            routed to fit it (see `llm_router`), timeouts and retries are cut
+            to the remaining time, and whatever text has arrived when it runs
+            out is returned
+        priority: "interactive" or "background". Interactive calls are
+            admitted well ahead of background ones by the limiter's weighted
+            fair queues; with a budget, background calls may be routed to a
+            slower, stronger model
+
+    Returns:
+        The text content from Claude's response
+    """
+    try:
+        if budget is not None:
+            return await ClaudeStream(prompt, max_tokens, model, temperature, use_cache, prefix, budget=budget, priority=priority).read()
+        return await _acall(prompt, max_tokens, model, temperature, use_cache, prefix, priority=priority)
+    except Exception as e:
+        # Return a helpful error string rather than failing the endpoint
+        return f"(anthropic call failed: {e})"
+
+
+async def acall_claude_with_fallback(
+    prompt: Union[str, Prompt],
+    fallback: Fallback,
+    max_tokens: int = 1024,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.2,
+    use_cache: bool = True,
+    prefix: Optional[str] = None,
+    budget: Optional[float] = None,
+    priority: str = INTERACTIVE,
+) -> Tuple[str, Optional[str]]:
+    """Like `acall_claude`, but degrade to `fallback` when Claude is unavailable.
+
+    While the circuit breaker is open this returns immediately without
+    touching the upstream.
+
+    Returns:
+        The text, and None for a real response, "cached"/"template" for a
+        degraded one or "partial" when the budget cut the response short
+    """
+    if budget is not None:
+        stream = ClaudeStream(prompt, max_tokens, model, temperature, use_cache, prefix, fallback, budget, priority)
+        text = await stream.read()
+        return text, stream.degraded or ("partial" if stream.truncated else None)
+    try:
+        return await _acall(prompt, max_tokens, model, temperature, use_cache, prefix, fallback.label, priority), None
+    except Exception:
+        return await _fallback_text(fallback)
+
+
+async def _acall(
+    prompt: Union[str, Prompt],
+    max_tokens: int,
+    model: str,
+    temperature: float,
+    use_cache: bool,
+    prefix: Optional[str],
+    label: Optional[str] = None,
+    priority: str = INTERACTIVE,
+) -> str:
+    """Cache, coalescing and circuit-breaker logic shared by the `acall_claude*` variants."""
+    prompt, prefix = _split_prompt(prompt, prefix)
+
+    # Read the API key at call time so changes to environment or .env are picked up
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        return _mocked_response(prompt, prefix)
+
+    # The cache is SQLite: its calls run in a worker thread, off the event loop.
+    cache = get_cache() if use_cache else None
+    key = cache_key(model, max_tokens, temperature, prompt, prefix)
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            metrics.record_cache_hit()
+            if label:
+                await asyncio.to_thread(cache.remember, label, key)
+            return cached
+
+    request = _build_request(api_key, prompt, max_tokens, model, temperature, prefix)
+
+    async def fetch() -> str:
+        if not _breaker.allow():
+            raise CircuitOpenError(f"circuit open, retrying upstream in {_breaker.retry_in():.0f}s")
+        try:
+            text = await _post_with_retries(request, estimate_tokens((prefix or "") + prompt, max_tokens), priority)
+        except BaseException as e:
+            if _is_outage(e):
+                _breaker.record_failure()
+            else:
+                _breaker.release()
+            raise
+        _breaker.record_success()
+        if cache is not None:
+            await asyncio.to_thread(cache.put, key, text)
+        return text
+
+    text = await _inflight.do(key, fetch)
+    if label and cache is not None:
+        await asyncio.to_thread(cache.remember, label, key)
+    return text
+
+
+def llm_stats() -> Dict[str, Any]:
+    """Return cache (with its most reused entries), coalescing, rate-limiter, circuit-breaker, routing, hedging and token usage counters for the Claude client."""
+    cache = get_cache()
+    return {
+        "cache": cache.stats() if cache is not None else None,
+        "cache_top_entries": cache.top_entries() if cache is not None else None,
+        "coalescing": _inflight.stats(),
+        "limiter": _limiter.stats(),
+        "breaker": _breaker.stats(),
+        "routing": llm_router.stats(),
+        "hedging": _hedger.stats(),
+        "usage": dict(_usage_totals),
+    }
+
+
+def call_claude(
+    prompt: Union[str, Prompt],
+    max_tokens: int = 1024,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.2,
+    use_cache: bool = True,
+    prefix: Optional[str] = None,
+    budget: Optional[float] = None,
+    priority: str = BACKGROUND,
+) -> str:
+    """Blocking wrapper around `acall_claude` for scripts and worker threads.
+
+    The call runs on the loop that owns the shared client, so connections are
+    reused across calls. Do not call this from async code; await
+    `acall_claude` instead. Calls default to background priority.
+    """
+    return _run_blocking(acall_claude(prompt, max_tokens, model, temperature, use_cache, prefix, budget, priority))
+
+
+def call_claude_with_fallback(
+    prompt: Union[str, Prompt],
+    fallback: Fallback,
+    max_tokens: int = 1024,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.2,
+    use_cache: bool = True,
+    prefix: Optional[str] = None,
+    budget: Optional[float] = None,
+    priority: str = BACKGROUND,
+) -> Tuple[str, Optional[str]]:
+    """Blocking wrapper around `acall_claude_with_fallback`; defaults to background priority."""
+    return _run_blocking(acall_claude_with_fallback(prompt, fallback, max_tokens, model, temperature, use_cache, prefix, budget, priority))
+
+
+class ClaudeStream:
+    """Incremental text from a streamed Messages API response.
+
+    Iterate with `async for` (or plain `for` outside the event loop) to get
+    text deltas as they arrive. Once the stream is exhausted, `usage`,
+    `stop_reason` and `text` describe the complete response. A finished
+    stream is written to the response cache, and a cache hit is replayed as a
+    single delta.
+
+    With a `fallback`, a stream that cannot reach Claude (circuit open, or
+    failing before any text was sent) yields the fallback text instead and
+    sets `degraded` to "cached" or "template".
+
+    With a `budget` (seconds from construction), the model and `max_tokens`
+    are routed to fit it. When it runs out the stream ends early with the
+    text received so far, `truncated` set and `stop_reason` "deadline"; if
+    nothing arrived yet it fails with `DeadlineExceeded` (or falls back), and
+    a request already sent counts as an upstream failure for the circuit
+    breaker and the limiter. So does a call the limiter refuses because its
+    cool-down after earlier failures outlasts the budget, so a failing
+    upstream still opens the breaker.
+    """
+
+    def __init__(
+        self,
+        prompt: Union[str, Prompt],
+        max_tokens: int = 1024,
+        model: str = DEFAULT_MODEL,
+        temperature: float = 0.2,
+        use_cache: bool = True,
+        prefix: Optional[str] = None,
+        fallback: Optional[Fallback] = None,
+        budget: Optional[float] = None,
+        priority: str = INTERACTIVE,
+    ):
+        self.prompt, self.prefix = _split_prompt(prompt, prefix)
+        self.max_tokens = max_tokens
+        self.model = model
+        self.temperature = temperature
+        self.use_cache = use_cache
+        self.fallback = fallback
+        self.priority = priority
+        self.deadline: Optional[float] = None
+        if budget is not None:
+            self.deadline = time.monotonic() + budget
+            prompt_tokens = len((self.prefix or "") + self.prompt) // 4
+            self.model, self.max_tokens = llm_router.route(
+                prompt_tokens, max_tokens, budget, priority, None if model == DEFAULT_MODEL else model
+            )
+        self.usage: Dict[str, int] = {}
+        self.stop_reason: Optional[str] = None
+        self.cached = False
+        self.truncated = False
+        self.degraded: Optional[str] = None
+        # Requests sent upstream (admitted by the limiter), including retries.
+        self.attempts = 0
+        self._chunks: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def _out_of_time(self) -> bool:
+        """Whether the budget ran out before any output arrived."""
+        return self.deadline is not None and not self._chunks and time.monotonic() >= self.deadline
+
+    def _is_upstream_timeout(self, error: BaseException) -> bool:
+        """Whether `error` ended a call that reached the upstream but got no output within the budget.
+
+        That is a hung or failing upstream, and counts against the circuit
+        breaker like any other outage.
+        """
+        if not self.attempts or self._chunks:
+            return False
+        if isinstance(error, DeadlineExceeded):
+            return True
+        # `_within_deadline` cancels the pending attempt when the deadline passes.
+        return isinstance(error, asyncio.CancelledError) and self._out_of_time()
+
+    async def read(self) -> str:
+        """Consume the whole stream and return its text.
+
+        Concurrent identical reads share one upstream stream (the first
+        reader's budget applies to all of them).
+        """
+        async def consume() -> "ClaudeStream":
+            async for _ in self:
                 pass
+            return self
+
+        key = cache_key(self.model, self.max_tokens, self.temperature, self.prompt, self.prefix)
+        leader = await _inflight.do("read:" + key, consume)
+        if leader is not self:
+            self._chunks = list(leader._chunks)
+            self.usage, self.stop_reason = leader.usage, leader.stop_reason
+            self.cached, self.truncated, self.degraded = leader.cached, leader.truncated, leader.degraded
+        return self.text
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        try:
+            async for delta in self._within_deadline(self._stream()):
+                yield delta
+        except Exception:
+            if self.fallback is None or self._chunks:
+                raise
+            text, self.degraded = await _fallback_text(self.fallback)
+            self._chunks.append(text)
+            yield text
+
+    async def _within_deadline(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass `deltas` through, ending the stream when the deadline passes."""
+        if self.deadline is None:
+            async for delta in deltas:
+                yield delta
+            return
+        try:
+            while True:
+                try:
+                    delta = await asyncio.wait_for(deltas.__anext__(), max(0.0, self.deadline - time.monotonic()))
+                except StopAsyncIteration:
+                    return
+                except DeadlineExceeded:
+                    raise
+                except asyncio.TimeoutError:
+                    if not self._chunks:
+                        raise DeadlineExceeded("latency budget exhausted before Claude responded")
+                    self.truncated = True
+                    self.stop_reason = "deadline"
+                    return
+                yield delta
+        finally:
+            await deltas.aclose()
+
+    async def _stream(self) -> AsyncIterator[str]:
+        api_key = os.getenv("ANTHROPIC_API_KEY")
+        if not api_key:
+            text = _mocked_response(self.prompt, self.prefix)
+            self._chunks.append(text)
+            yield text
+            return
+
+        cache = get_cache() if self.use_cache else None
+        key = cache_key(self.model, self.max_tokens, self.temperature, self.prompt, self.prefix)
+        if cache is not None:
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                self.cached = True
+                metrics.record_cache_hit()
+                if self.fallback is not None and self.fallback.label:
+                    await asyncio.to_thread(cache.remember, self.fallback.label, key)
+                self._chunks.append(cached)
+                yield cached
+                return
+
+        if not _breaker.allow():
+            raise CircuitOpenError(f"circuit open, retrying upstream in {_breaker.retry_in():.0f}s")
+        try:
+            async for delta in self._stream_upstream(api_key, cache, key):
+                yield delta
+        except BaseException as e:
+            if _is_outage(e) or self._is_upstream_timeout(e):
+                _breaker.record_failure()
+            else:
+                _breaker.release()
+            raise
+        _breaker.record_success()
+
+    async def _stream_upstream(self, api_key: str, cache: Any, key: str) -> AsyncIterator[str]:
+        request = _build_request(api_key, self.prompt, self.max_tokens, self.model, self.temperature, self.prefix, stream=True)
+        cost = estimate_tokens((self.prefix or "") + self.prompt, self.max_tokens)
+        client = get_client()
+        retries = 3
+        started = time.monotonic()
+        ttfb: Optional[float] = None
+        for attempt in range(1, retries + 1):
+            if attempt > 1 and self.deadline is not None and self.deadline - time.monotonic() < MIN_ATTEMPT_SECONDS:
+                # Not enough budget left for another attempt to produce anything.
+                raise DeadlineExceeded(f"latency budget exhausted after {attempt - 1} attempts")
+            await _limiter.acquire(cost, retry=attempt > 1, priority=self.priority, deadline=self.deadline)
+            self.attempts += 1
+            ok = overloaded = timed_out = False
+            retry_after = None
+            failed: Optional[httpx.Response] = None
+            try:
+                timeout = _attempt_timeout(self.deadline)
+                resp = await _hedger.send(
+                    lambda: client.send(client.build_request("POST", ANTHROPIC_API_URL, **request, **timeout), stream=True),
+                    _limiter,
+                    cost,
+                    self.priority,
+                )
+                try:
+                    if resp.is_success:
+                        ttfb = time.monotonic() - started
+                        async for delta in self._deltas(resp):
+                            yield delta
+                        ok = True
+                    else:
+                        await resp.aread()
+                        failed = resp
+                        overloaded = resp.status_code == 429 or resp.status_code >= 500
+                        if overloaded:
+                            retry_after = parse_retry_after(resp.headers.get("retry-after"))
+                finally:
+                    await resp.aclose()
+            except httpx.TransportError:
+                overloaded = True
+                # Text already sent to the caller cannot be retried.
+                if self._chunks or attempt == retries:
+                    raise
+                continue
+            except asyncio.CancelledError:
+                # Cut off by the deadline with nothing received: back off like on a timeout.
+                overloaded = timed_out = self._out_of_time()
+                raise
+            finally:
+                tokens_used = _record_usage(self.usage) if ok else None
+                _limiter.release(cost, ok=ok, overloaded=overloaded, retry_after=retry_after, tokens_used=tokens_used, priority=self.priority)
+                if ok or timed_out or self._chunks or attempt == retries or not overloaded:
+                    metrics.record_call(self.model, time.monotonic() - started, ttfb, attempt - 1, self.usage, ok=ok)
+
+            if ok:
+                if cache is not None:
+                    await asyncio.to_thread(cache.put, key, self.text)
+                    if self.fallback is not None and self.fallback.label:
+                        await asyncio.to_thread(cache.remember, self.fallback.label, key)
+                return
+            if not overloaded or attempt == retries:
+                failed.raise_for_status()
+
+    async def _deltas(self, resp: httpx.Response) -> AsyncIterator[str]:
+        """Parse Messages SSE events, yielding text deltas and recording usage."""
+        async for line in resp.aiter_lines():
+            # `event:` lines repeat the type carried in the data payload.
+            if not line.startswith("data:"):
+                continue
+            event = json.loads(line[5:])
+            kind = event.get("type")
+            if kind == "content_block_delta":
+                text = event["delta"].get("text")
+                if text:
+                    self._chunks.append(text)
+                    yield text
+            elif kind == "message_start":
+                message = event.get("message") or {}
+                self.model = message.get("model") or self.model
+                self.usage.update(message.get("usage") or {})
+            elif kind == "message_delta":
+                self.usage.update(event.get("usage") or {})
+                self.stop_reason = (event.get("delta") or {}).get("stop_reason")
+            elif kind == "error":
+                error = event.get("error") or {}
+                raise RuntimeError(f"anthropic stream error: {error.get('type')}: {error.get('message')}")
+
+    def __iter__(self) -> Iterator[str]:
+        """Blocking iteration for scripts; runs the stream on the client's loop."""
+        deltas = self.__aiter__()
+
+        async def next_delta() -> Optional[str]:
+            try:
+                return await deltas.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        while True:
+            delta = _run_blocking(next_delta())
+            if delta is None:
+                return
+            yield delta
+
 
-    # Fallback
-    return f"(anthropic call failed: {last_exc})"
+def stream_claude(
+    prompt: Union[str, Prompt],
+    max_tokens: int = 1024,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.2,
+    use_cache: bool = True,
+    prefix: Optional[str] = None,
+    fallback: Optional[Fallback] = None,
+    budget: Optional[float] = None,
+    priority: str = INTERACTIVE,
+) -> ClaudeStream:
+    """Start a streamed Claude call; see `ClaudeStream` for usage."""
+    return ClaudeStream(prompt, max_tokens, model, temperature, use_cache, prefix, fallback, budget, priority)
@@ -0,0 +1,113 @@
+"""Circuit breaker for the Claude upstream.
+
+After `LLM_BREAKER_FAILURES` consecutive outage-type failures (timeouts,
+connection errors, 429/5xx after retries) the circuit opens and calls are
+rejected immediately instead of queueing behind a dead upstream. After
+`LLM_BREAKER_RESET` seconds it turns half-open and lets up to
+`LLM_BREAKER_PROBES` calls through: a success closes the circuit, a failure
+opens it again with the reset time doubled (up to `LLM_BREAKER_MAX_RESET`).
+"""
+
+import os
+import time
+from typing import Any, Dict
+
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+LLM_BREAKER_MAX_RESET = float(os.getenv("LLM_BREAKER_MAX_RESET", "300"))
+LLM_BREAKER_PROBES = int(os.getenv("LLM_BREAKER_PROBES", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the upstream while the circuit is open."""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker counting consecutive failures.
+
+    Not thread-safe: it is only used from the event loop owning the Claude client.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = LLM_BREAKER_FAILURES,
+        reset_timeout: float = LLM_BREAKER_RESET,
+        max_reset_timeout: float = LLM_BREAKER_MAX_RESET,
+        half_open_probes: int = LLM_BREAKER_PROBES,
+    ):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CLOSED
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Return True if a call may go upstream now.
+
+        Every allowed call must be followed by exactly one of
+        `record_success`, `record_failure` or `release`.
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = HALF_OPEN
+            self.probes_in_flight = 0
+        if self.state == HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self.probes_in_flight += 1
+        return True
+
+    def record_success(self) -> None:
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self.probes_in_flight = 0
+            self.reset_timeout = self.base_reset_timeout
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            # The probe failed: back off further before the next one.
+            self._open(min(self.max_reset_timeout, self.reset_timeout * 2))
+        elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open(self.base_reset_timeout)
+
+    def release(self) -> None:
+        """End an allowed call whose outcome says nothing about upstream health."""
+        if self.state == HALF_OPEN and self.probes_in_flight > 0:
+            self.probes_in_flight -= 1
+
+    def _open(self, reset_timeout: float) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.reset_timeout = reset_timeout
+        self.probes_in_flight = 0
+        self.trips += 1
+
+    def retry_in(self) -> float:
+        """Seconds until the next probe is allowed (0 unless open)."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": round(self.retry_in(), 2),
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
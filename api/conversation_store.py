@@ -0,0 +1,213 @@
+"""Server-side chat history for `/api/chat`, keyed by conversation ID.
+
+Conversation IDs are issued by the server (`create`) and unguessable; unknown
+IDs are rejected rather than created, so a client cannot read or extend
+another client's conversation by picking its ID.
+
+Clients that send a `conversationId` only need to send the new message: the
+earlier turns, already converted to OpenAI chat messages, are kept here. They
+are stored as one row per message in a local SQLite file (`CONVERSATION_DB_PATH`)
+and the converted lists of recently active conversations are kept in memory
+(`CONVERSATION_CACHE_SIZE` conversations), so a turn appends the new messages
+instead of re-reading or re-converting the history. Conversations idle for
+longer than `CONVERSATION_MAX_AGE` seconds are deleted.
+"""
+
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "256"))
+CONVERSATION_MAX_AGE = float(os.getenv("CONVERSATION_MAX_AGE", str(30 * 24 * 3600)))
+CONVERSATION_STORE_ENABLED = os.getenv("CONVERSATION_STORE_ENABLED", "1") != "0"
+
+# Run cleanup at most this often (seconds) rather than on every write.
+EVICT_INTERVAL = 3600.0
+
+
+class ConversationStore:
+    """SQLite-backed message log per conversation with an in-memory LRU of converted histories."""
+
+    def __init__(self, path: str = CONVERSATION_DB_PATH, cache_size: int = CONVERSATION_CACHE_SIZE, max_age: float = CONVERSATION_MAX_AGE):
+        self.path = path
+        self.cache_size = cache_size
+        self.max_age = max_age
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._histories: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS conversation_messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_conversations_updated_at ON conversations (updated_at)")
+
+    def _cached(self, conversation_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Return the conversation's messages, loading them into the LRU; caller holds the lock."""
+        history = self._histories.get(conversation_id)
+        if history is not None:
+            self.cache_hits += 1
+            self._histories.move_to_end(conversation_id)
+            return history
+        self.cache_misses += 1
+        exists = self._conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        if exists is None:
+            return None
+        rows = self._conn.execute(
+            "SELECT message FROM conversation_messages WHERE conversation_id = ? ORDER BY seq", (conversation_id,)
+        ).fetchall()
+        history = [json.loads(row[0]) for row in rows]
+        self._histories[conversation_id] = history
+        while len(self._histories) > self.cache_size:
+            self._histories.popitem(last=False)
+        return history
+
+    def create(self) -> str:
+        """Start an empty conversation and return its new, unguessable ID."""
+        conversation_id = secrets.token_urlsafe(24)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversations (id, created_at, updated_at, message_count) VALUES (?, ?, ?, 0)",
+                (conversation_id, now, now),
+            )
+            self._histories[conversation_id] = []
+            while len(self._histories) > self.cache_size:
+                self._histories.popitem(last=False)
+        return conversation_id
+
+    def get(self, conversation_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Return a copy of the conversation's OpenAI messages, or None if it is unknown."""
+        with self._lock:
+            history = self._cached(conversation_id)
+            return list(history) if history is not None else None
+
+    def append(self, conversation_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """Add `messages` to the end of the conversation; False if it does not exist (any more)."""
+        now = time.time()
+        with self._lock:
+            history = self._cached(conversation_id)
+            if history is None:
+                return False
+            start = len(history)
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO conversation_messages (conversation_id, seq, message) VALUES (?, ?, ?)",
+                    [(conversation_id, start + i, json.dumps(message, separators=(",", ":"))) for i, message in enumerate(messages)],
+                )
+                self._conn.execute(
+                    "UPDATE conversations SET updated_at = ?, message_count = ? WHERE id = ?",
+                    (now, start + len(messages), conversation_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._histories.pop(conversation_id, None)
+                raise
+            history.extend(messages)
+            if now - self._last_evict >= EVICT_INTERVAL:
+                self._evict_locked(now)
+        return True
+
+    def replace(self, conversation_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """Make `messages` the whole conversation (e.g. when the client resends its full history)."""
+        now = time.time()
+        with self._lock:
+            if self._cached(conversation_id) is None:
+                return False
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+                self._conn.executemany(
+                    "INSERT INTO conversation_messages (conversation_id, seq, message) VALUES (?, ?, ?)",
+                    [(conversation_id, i, json.dumps(message, separators=(",", ":"))) for i, message in enumerate(messages)],
+                )
+                self._conn.execute(
+                    "UPDATE conversations SET updated_at = ?, message_count = ? WHERE id = ?",
+                    (now, len(messages), conversation_id),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                self._histories.pop(conversation_id, None)
+                raise
+            self._histories[conversation_id] = list(messages)
+        return True
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self._histories.pop(conversation_id, None)
+            self._conn.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def evict(self) -> int:
+        """Delete conversations idle for longer than `max_age`."""
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def _evict_locked(self, now: float) -> int:
+        self._last_evict = now
+        stale = [row[0] for row in self._conn.execute(
+            "SELECT id FROM conversations WHERE updated_at < ?", (now - self.max_age,)
+        ).fetchall()]
+        for conversation_id in stale:
+            self._histories.pop(conversation_id, None)
+            self._conn.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conversations, messages = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(message_count), 0) FROM conversations"
+            ).fetchone()
+        return {
+            "conversations": conversations,
+            "messages": messages,
+            "cached_conversations": len(self._histories),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+_store: Optional[ConversationStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> Optional[ConversationStore]:
+    """Return the shared store, or None when server-side history is disabled."""
+    global _store
+    if not CONVERSATION_STORE_ENABLED:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ConversationStore()
+    return _store
@@ -1,15 +1,20 @@
-from typing import List
+import os
+import uuid
+from typing import AsyncIterator, List, Optional
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from fastapi import FastAPI, Query, Request as FastAPIRequest
+from fastapi import FastAPI, Header, HTTPException, Query, Request as FastAPIRequest
 from fastapi.responses import StreamingResponse
-from openai import OpenAI
+from starlette.concurrency import run_in_threadpool
 from .utils.prompt import ClientMessage, convert_to_openai_messages
 from .utils.stream import patch_response_with_headers, stream_text
-from .utils.tools import AVAILABLE_TOOLS, TOOL_DEFINITIONS
-from vercel import oidc
+from .utils.tools import TOOL_DEFINITIONS, ToolContext, registry
+from .utils import compaction, disconnect, replay, weather
 from vercel.headers import set_headers
 from . import db as _db
+from . import anthropic_client, openai_client
+from .conversation_store import get_store
+from .llm_metrics import LLMMetricsMiddleware
 from .routes import router as api_router
 
 
@@ -19,15 +24,35 @@ from .routes import router as api_router
 load_dotenv(".env", override=True)
 load_dotenv(".env.local", override=False)
 
+# Completions per /api/chat turn when the client does not pass `maxSteps`;
+# above 1, tool results are sent back to the model server-side.
+CHAT_MAX_STEPS = int(os.getenv("CHAT_MAX_STEPS", "1"))
+CHAT_MAX_STEPS_LIMIT = 10
+
 app = FastAPI()
 
 # initialize DB (creates sqlite file / tables when using default)
 _db.init_db()
 
+# attribute LLM calls to endpoints and time requests for /api/llm/metrics
+app.add_middleware(LLMMetricsMiddleware)
+
 # include our new API routes (Continuum endpoints)
 app.include_router(api_router, prefix="/api")
 
 
+@app.on_event("startup")
+async def _open_llm_client():
+    await anthropic_client.open_client()
+
+
+@app.on_event("shutdown")
+async def _close_llm_client():
+    await anthropic_client.close_client()
+    await weather.close_client()
+    await openai_client.close_client()
+
+
 @app.middleware("http")
 async def _vercel_set_headers(request: FastAPIRequest, call_next):
     set_headers(dict(request.headers))
@@ -35,17 +60,116 @@ async def _vercel_set_headers(request: FastAPIRequest, call_next):
 
 
 class Request(BaseModel):
-    messages: List[ClientMessage]
+    # Either the full history (`messages`), or only the new `message`: the
+    # rest of the history is then kept server-side under a `conversationId`
+    # the server issues (x-conversation-id) on the first such request.
+    messages: Optional[List[ClientMessage]] = None
+    conversationId: Optional[str] = None
+    message: Optional[ClientMessage] = None
+
+
+async def _closing(frames: AsyncIterator[str], tool_context: ToolContext) -> AsyncIterator[str]:
+    try:
+        async for frame in frames:
+            yield frame
+    finally:
+        tool_context.close()
 
 
 @app.post("/api/chat")
-async def handle_chat_data(request: Request, protocol: str = Query('data')):
-    messages = request.messages
-    openai_messages = convert_to_openai_messages(messages)
+async def handle_chat_data(
+    request: Request,
+    http_request: FastAPIRequest,
+    protocol: str = Query('data'),
+    max_steps: int = Query(CHAT_MAX_STEPS, alias="maxSteps", ge=1, le=CHAT_MAX_STEPS_LIMIT),
+):
+    conversation_id = request.conversationId
+    store = get_store() if conversation_id or request.messages is None else None
+    if store is None:
+        if request.messages is None:
+            raise HTTPException(status_code=400, detail="messages is required without server-side conversations")
+        conversation_id = None
+    history: Optional[List[dict]] = None
+    if conversation_id is not None:
+        # Only IDs issued below exist; anything else is rejected, never created.
+        history = await run_in_threadpool(store.get, conversation_id)
+        if history is None:
+            raise HTTPException(status_code=404, detail="Unknown conversation")
 
-    client = OpenAI(api_key=oidc.get_vercel_oidc_token(), base_url="https://ai-gateway.vercel.sh/v1")
+    if request.messages is not None:
+        openai_messages = convert_to_openai_messages(request.messages)
+        if conversation_id is not None:
+            # A resent full history replaces the stored one once the turn completes.
+            async def on_finish(produced):
+                await run_in_threadpool(store.replace, conversation_id, openai_messages + produced)
+        else:
+            on_finish = None
+    else:
+        # Only the new message is validated and converted.
+        new_messages = convert_to_openai_messages([request.message]) if request.message is not None else []
+        if conversation_id is None:
+            if not new_messages:
+                raise HTTPException(status_code=400, detail="message is required to start a conversation")
+            conversation_id = await run_in_threadpool(store.create)
+        openai_messages = (history or []) + new_messages
+
+        # The new message is stored with the answer, so a failed or cancelled
+        # turn leaves the history unchanged and can simply be retried.
+        async def on_finish(produced):
+            await run_in_threadpool(store.append, conversation_id, new_messages + produced)
+    # The stored history stays complete; only the request is compacted.
+    if compaction.uses_tokenizer():
+        request_messages = await run_in_threadpool(compaction.compact_messages, openai_messages)
+    else:
+        request_messages = compaction.compact_messages(openai_messages)
+
+    client = await openai_client.get_openai_client()
+    # Tools called during this request share one DB session and result cache.
+    tool_context = ToolContext()
+    tools = registry.bind(tool_context)
+    message_id = f"msg-{uuid.uuid4().hex}"
+    frames = _closing(
+        stream_text(client, request_messages, TOOL_DEFINITIONS, tools, protocol, max_steps=max_steps, on_finish=on_finish, message_id=message_id),
+        tool_context,
+    )
+    if replay.REPLAY_ENABLED:
+        # Generated in the background so a dropped client can resume it.
+        frames = replay.replay_buffer.start(message_id, frames).follow()
+    response = StreamingResponse(disconnect.cancel_on_disconnect(http_request, frames), media_type="text/event-stream")
+    response.headers["x-message-id"] = message_id
+    if conversation_id:
+        response.headers["x-conversation-id"] = conversation_id
+    return patch_response_with_headers(response, protocol)
+
+
+@app.get("/api/chat/{message_id}/stream")
+async def resume_chat_stream(
+    message_id: str,
+    http_request: FastAPIRequest,
+    protocol: str = Query('data'),
+    last_event_id: int = Header(0, alias="last-event-id", ge=0),
+):
+    """Replay a recent /api/chat stream after `Last-Event-ID` and follow it until it ends."""
+    log = replay.replay_buffer.get(message_id) if replay.REPLAY_ENABLED else None
+    if log is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired stream")
+    if not log.retains(last_event_id):
+        raise HTTPException(status_code=410, detail="Stream history no longer available")
     response = StreamingResponse(
-        stream_text(client, openai_messages, TOOL_DEFINITIONS, AVAILABLE_TOOLS, protocol),
+        disconnect.cancel_on_disconnect(http_request, log.follow(last_event_id)),
         media_type="text/event-stream",
     )
     return patch_response_with_headers(response, protocol)
+
+
+@app.get("/api/chat/stats")
+def get_chat_client_stats():
+    """Return shared gateway client counters (requests, token refreshes, pooled connections), conversation store, history compaction, client disconnect and stream replay counters."""
+    store = get_store()
+    return {
+        **openai_client.stats(),
+        "conversations": store.stats() if store is not None else None,
+        "compaction": compaction.stats(),
+        "disconnects": disconnect.stats(),
+        "replay": replay.replay_buffer.stats(),
+    }
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Bulk Claude jobs submitted through the Message Batches API.
+
+Regenerating handoff summaries for every person, or onboarding plans for
+every team x role, one `call_claude` at a time is slow and ties up web
+workers. This module collects the prompts into a batch job, submits it,
+polls with back-off and writes each result into the LLM response cache so
+the regular endpoints are served from cache afterwards. Job and item state is
+stored in the `llm_batch_jobs` / `llm_batch_items` tables, so an interrupted
+run can be resumed.
+
+Prompts that are already cached are skipped.
+
+Usage:
+    python -m api.llm_batch handoffs [--no-wait]
+    python -m api.llm_batch onboarding [--no-wait]
+    python -m api.llm_batch resume
+
+Point ANTHROPIC_API_URL at the local stand-in to try it without credentials:
+    python -m uvicorn api.mock_llm:app --port 8001
+    ANTHROPIC_API_URL=http://localhost:8001/v1/messages ANTHROPIC_API_KEY=test python -m api.llm_batch handoffs
+"""
+
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple, Union
+
+import httpx
+from sqlalchemy.orm import Session
+
+from api import models, services
+from api.anthropic_client import (
+    ANTHROPIC_API_URL,
+    DEFAULT_MODEL,
+    Prompt,
+    anthropic_headers,
+    extract_text,
+    message_params,
+)
+from api.db import SessionLocal, init_db
+from api.llm_cache import cache_key, get_cache
+
+ANTHROPIC_BATCH_URL = os.getenv("ANTHROPIC_BATCH_URL", ANTHROPIC_API_URL.rstrip("/") + "/batches")
+
+# Poll interval grows from POLL_INITIAL by POLL_FACTOR up to POLL_MAX seconds.
+POLL_INITIAL = float(os.getenv("LLM_BATCH_POLL_INITIAL", "2"))
+POLL_MAX = float(os.getenv("LLM_BATCH_POLL_MAX", "60"))
+POLL_FACTOR = 1.5
+BATCH_TIMEOUT = float(os.getenv("LLM_BATCH_TIMEOUT", str(24 * 3600)))
+
+
+def _client() -> httpx.Client:
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        raise RuntimeError("ANTHROPIC_API_KEY is required to submit batch jobs")
+    return httpx.Client(headers=anthropic_headers(api_key), timeout=httpx.Timeout(60, connect=5))
+
+
+def handoff_prompts(db: Session) -> List[Tuple[str, Union[str, Prompt]]]:
+    """(custom_id, prompt) for the departure handoff summary of every person."""
+    out = []
+    for person in db.query(models.Person).order_by(models.Person.id).all():
+        _, prompt = services.prepare_simulate_departure(db, person.id)
+        if prompt is not None:
+            out.append((f"handoff-{person.id}", prompt))
+    return out
+
+
+def onboarding_prompts(db: Session) -> List[Tuple[str, Union[str, Prompt]]]:
+    """(custom_id, prompt) for the personalized onboarding plan of every team x role."""
+    out = []
+    for team in db.query(models.Team).order_by(models.Team.id).all():
+        role_names = [None] + [r.name for r in db.query(models.Role).filter(models.Role.team_id == team.id).order_by(models.Role.id)]
+        for role_name in role_names:
+            _, prompt = services.prepare_personalized_onboarding(db, team.name, role_name)
+            if prompt is not None:
+                out.append((f"onboarding-{team.id}-{role_name or 'any'}", prompt))
+    return out
+
+
+PROMPT_BUILDERS = {
+    "handoffs": handoff_prompts,
+    "onboarding": onboarding_prompts,
+}
+
+
+def create_job(
+    db: Session,
+    kind: str,
+    prompts: Iterable[Tuple[str, Union[str, Prompt]]],
+    max_tokens: int = 1024,
+    model: str = DEFAULT_MODEL,
+    temperature: float = 0.2,
+) -> Optional[models.LLMBatchJob]:
+    """Persist a job for every prompt not already in the response cache.
+
+    Returns None when there is nothing left to generate.
+    """
+    cache = get_cache()
+    job = models.LLMBatchJob(kind=kind, status="pending")
+    for custom_id, prompt in prompts:
+        if not isinstance(prompt, Prompt):
+            prompt = Prompt(prompt)
+        key = cache_key(model, max_tokens, temperature, prompt.text, prompt.prefix)
+        if cache is not None and cache.get(key) is not None:
+            continue
+        job.items.append(models.LLMBatchItem(
+            custom_id=custom_id,
+            cache_key=key,
+            prefix=prompt.prefix,
+            prompt=prompt.text,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        ))
+    if not job.items:
+        return None
+    job.request_count = len(job.items)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def submit_job(db: Session, job: models.LLMBatchJob, client: httpx.Client) -> None:
+    """Send a pending job's requests to the batch endpoint."""
+    requests = [
+        {
+            "custom_id": item.custom_id,
+            "params": message_params(item.prompt, item.max_tokens, item.model, item.temperature, item.prefix),
+        }
+        for item in job.items
+    ]
+    resp = client.post(ANTHROPIC_BATCH_URL, json={"requests": requests})
+    resp.raise_for_status()
+    job.provider_batch_id = resp.json()["id"]
+    job.status = "submitted"
+    job.submitted_at = datetime.utcnow()
+    db.commit()
+
+
+def poll_job(db: Session, job: models.LLMBatchJob, client: httpx.Client) -> bool:
+    """Check a submitted job once; collect its results when it has ended.
+
+    Returns True when the job is finished.
+    """
+    resp = client.get(f"{ANTHROPIC_BATCH_URL}/{job.provider_batch_id}")
+    resp.raise_for_status()
+    batch = resp.json()
+    job.poll_count = (job.poll_count or 0) + 1
+    db.commit()
+    if batch.get("processing_status") != "ended":
+        return False
+    collect_results(db, job, client, batch.get("results_url"))
+    return True
+
+
+def collect_results(db: Session, job: models.LLMBatchJob, client: httpx.Client, results_url: Optional[str] = None) -> None:
+    """Download the JSONL results and write successful ones to the response cache."""
+    url = results_url or f"{ANTHROPIC_BATCH_URL}/{job.provider_batch_id}/results"
+    items = {item.custom_id: item for item in job.items}
+    cache = get_cache()
+    succeeded = errored = 0
+    with client.stream("GET", url) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            item = items.get(entry.get("custom_id"))
+            if item is None:
+                continue
+            result = entry.get("result") or {}
+            item.status = result.get("type", "errored")
+            if item.status == "succeeded":
+                succeeded += 1
+                if cache is not None:
+                    cache.put(item.cache_key, extract_text(result.get("message")))
+            else:
+                errored += 1
+                item.error = json.dumps(result.get("error")) if result.get("error") else item.status
+    job.succeeded_count = succeeded
+    job.errored_count = errored
+    job.status = "completed"
+    job.completed_at = datetime.utcnow()
+    db.commit()
+
+
+def wait_for_job(db: Session, job: models.LLMBatchJob, client: httpx.Client, timeout: float = BATCH_TIMEOUT) -> bool:
+    """Poll with exponential back-off until the job ends or `timeout` passes."""
+    deadline = time.monotonic() + timeout
+    interval = POLL_INITIAL
+    while True:
+        try:
+            if poll_job(db, job, client):
+                return True
+        except httpx.HTTPError as e:
+            # Transient polling failures just extend the back-off.
+            print(f"⚠️  Poll failed for job {job.id}: {e}")
+        if time.monotonic() + interval > deadline:
+            return False
+        time.sleep(interval)
+        interval = min(POLL_MAX, interval * POLL_FACTOR)
+
+
+def run(kind: str, wait: bool = True) -> Optional[int]:
+    """Build, submit and (optionally) wait for a job of the given kind."""
+    init_db()
+    db = SessionLocal()
+    job = None
+    try:
+        job = create_job(db, kind, PROMPT_BUILDERS[kind](db))
+        if job is None:
+            print("✅ Everything is already cached; nothing to submit")
+            return None
+        print(f"📦 Job {job.id}: {job.request_count} {kind} prompts")
+        with _client() as client:
+            submit_job(db, job, client)
+            print(f"🚀 Submitted as {job.provider_batch_id}")
+            if wait and wait_for_job(db, job, client):
+                print(f"✅ Job {job.id} complete ({job.succeeded_count} succeeded, {job.errored_count} errored)")
+        return job.id
+    except Exception as e:
+        db.rollback()
+        if job is not None:
+            job.status = "failed"
+            job.error = str(e)
+            db.commit()
+        raise
+    finally:
+        db.close()
+
+
+def resume() -> None:
+    """Submit pending jobs and finish polling submitted ones."""
+    init_db()
+    db = SessionLocal()
+    try:
+        jobs = db.query(models.LLMBatchJob).filter(models.LLMBatchJob.status.in_(["pending", "submitted"])).all()
+        if not jobs:
+            print("✅ No unfinished jobs")
+            return
+        with _client() as client:
+            for job in jobs:
+                if job.status == "pending":
+                    submit_job(db, job, client)
+                if wait_for_job(db, job, client):
+                    print(f"✅ Job {job.id} complete ({job.succeeded_count} succeeded, {job.errored_count} errored)")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0] not in list(PROMPT_BUILDERS) + ["resume"]:
+        print(__doc__)
+        sys.exit(1)
+    if args[0] == "resume":
+        resume()
+    else:
+        run(args[0], wait="--no-wait" not in args)
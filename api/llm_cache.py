@@ -0,0 +1,195 @@
+"""Persistent, content-addressed cache for Claude responses.
+
+Responses are stored zlib-compressed in a local SQLite file keyed on a hash of
+everything that determines the output (model, max_tokens, temperature, the
+prompt and any cacheable prefix). Entries expire after `LLM_CACHE_MAX_AGE`
+seconds and the least recently used ones are evicted once the file holds more
+than `LLM_CACHE_MAX_BYTES` of payload.
+
+Callers can also tag entries with a stable label (e.g. "handoff:12") so the
+most recent response for that label can be served, even once expired or after
+the prompt changed, while the upstream is unavailable. Labelled entries are
+kept past `LLM_CACHE_MAX_AGE` for this, up to `LLM_CACHE_FALLBACK_MAX_AGE`.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.db")
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+LLM_CACHE_MAX_AGE = float(os.getenv("LLM_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+LLM_CACHE_FALLBACK_MAX_AGE = float(os.getenv("LLM_CACHE_FALLBACK_MAX_AGE", str(30 * 24 * 3600)))
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") != "0"
+
+# Run eviction at most this often (seconds) rather than on every write.
+EVICT_INTERVAL = 60.0
+
+
+def cache_key(model: str, max_tokens: int, temperature: float, prompt: str, prefix: Optional[str] = None) -> str:
+    """Return the content address for a Claude request."""
+    parts: List[Any] = [model, max_tokens, temperature, prompt]
+    if prefix:
+        parts.append(prefix)
+    raw = json.dumps(parts, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed response cache with age and size based LRU eviction."""
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+        max_age: float = LLM_CACHE_MAX_AGE,
+        fallback_max_age: float = LLM_CACHE_FALLBACK_MAX_AGE,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.fallback_max_age = max(fallback_max_age, max_age)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._last_evict = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS llm_cache_labels (label TEXT PRIMARY KEY, key TEXT NOT NULL)")
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached text for `key`, or None when missing or expired."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE llm_cache SET hits = hits + 1, last_access = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key: str, text: str) -> None:
+        """Store `text` under `key`, replacing any previous entry."""
+        value = zlib.compress(text.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, value, len(value), now, now),
+            )
+            if now - self._last_evict >= EVICT_INTERVAL:
+                self._evict_locked(now)
+
+    def remember(self, label: str, key: str) -> None:
+        """Record `key` as the latest entry for `label`."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO llm_cache_labels (label, key) VALUES (?, ?)", (label, key))
+
+    def latest(self, label: str) -> Optional[str]:
+        """Return the latest text stored for `label`, ignoring its age."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT c.value FROM llm_cache_labels l JOIN llm_cache c ON c.key = l.key WHERE l.label = ?",
+                (label,),
+            ).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def evict(self) -> int:
+        """Drop expired entries, then LRU entries until under the size cap."""
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def _evict_locked(self, now: float) -> int:
+        self._last_evict = now
+        # Expired entries that are the latest for a label are kept as fallbacks
+        # until `fallback_max_age` or until the size cap pushes them out.
+        removed = self._conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ? AND (created_at < ? OR key NOT IN (SELECT key FROM llm_cache_labels))",
+            (now - self.max_age, now - self.fallback_max_age),
+        ).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        stale = []
+        if total > self.max_bytes:
+            for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access"):
+                if total <= self.max_bytes:
+                    break
+                stale.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+        # Labels whose entry is gone have nothing left to serve.
+        self._conn.execute("DELETE FROM llm_cache_labels WHERE key NOT IN (SELECT key FROM llm_cache)")
+        return removed + len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.execute("DELETE FROM llm_cache_labels")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return cache-wide counters."""
+        with self._lock:
+            entries, size, hits = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM llm_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "stored_hits": hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def top_entries(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Return per-entry hit stats for the most frequently reused entries."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, size, created_at, last_access, hits FROM llm_cache ORDER BY hits DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [
+            {"key": key, "bytes": size, "created_at": created, "last_access": accessed, "hits": hits}
+            for key, size, created, accessed, hits in rows
+        ]
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[LLMCache]:
+    """Return the shared cache, or None when caching is disabled."""
+    global _cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LLMCache()
+    return _cache
@@ -0,0 +1,138 @@
+"""Hedged requests for Claude calls.
+
+When `LLM_HEDGE` is on and an attempt has not received response headers
+after the `LLM_HEDGE_PERCENTILE` of recently observed per-attempt time to
+first byte, a duplicate request is sent. Whichever gets a successful
+response first is used and the other is cancelled.
+
+Hedges only go out when the shared limiter has a permit free right now (they
+never queue), and at most `LLM_HEDGE_MAX_FRACTION` of calls are hedged, so a
+slow upstream is not hit with twice the traffic.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+
+from .llm_limiter import LLMLimiter
+from .llm_metrics import current_endpoint, metrics
+from .llm_router import INTERACTIVE
+
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.25"))
+LLM_HEDGE_MAX_FRACTION = float(os.getenv("LLM_HEDGE_MAX_FRACTION", "0.1"))
+# Percentiles from fewer samples than this are too noisy to hedge on.
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+# Look at this much recent history (seconds) for the percentile.
+HEDGE_WINDOW = 300.0
+
+
+class Hedger:
+    """Decides when to hedge an attempt and races the duplicate against it."""
+
+    def __init__(
+        self,
+        enabled: bool = LLM_HEDGE,
+        percentile: float = LLM_HEDGE_PERCENTILE,
+        min_delay: float = LLM_HEDGE_MIN_DELAY,
+        max_fraction: float = LLM_HEDGE_MAX_FRACTION,
+        min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_fraction = max_fraction
+        self.min_samples = min_samples
+        self.attempts = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.skipped = 0
+
+    def delay(self, endpoint: str) -> Optional[float]:
+        """Seconds to wait for headers before hedging, or None to not hedge."""
+        if not self.enabled:
+            return None
+        windows = metrics.window(HEDGE_WINDOW)
+        stats = windows.get(endpoint)
+        if stats is not None and stats.attempt_ttfb.count >= self.min_samples:
+            value = stats.attempt_ttfb.percentile(self.percentile)
+        elif sum(s.attempt_ttfb.count for s in windows.values()) >= self.min_samples:
+            # Too little data for this endpoint: use all endpoints together.
+            value = metrics.percentile("attempt_ttfb", self.percentile, HEDGE_WINDOW)
+        else:
+            return None
+        return max(self.min_delay, value) if value is not None else None
+
+    async def send(self, send: Callable[[], Awaitable[httpx.Response]], limiter: LLMLimiter, cost: int, priority: str = INTERACTIVE) -> httpx.Response:
+        """Run `send` (whose permit the caller holds), hedging it if it is slow.
+
+        Returns the winning response with its body unread. The extra permit
+        taken for a hedge is released here; the caller releases its own
+        permit for the winner as usual.
+        """
+        endpoint = current_endpoint()
+        started = time.monotonic()
+        self.attempts += 1
+        primary = asyncio.ensure_future(send())
+        try:
+            delay = self.delay(endpoint)
+            if delay is not None:
+                done, _ = await asyncio.wait({primary}, timeout=delay)
+                if not done:
+                    if self.hedged < self.max_fraction * self.attempts and limiter.try_acquire(cost, priority):
+                        return await self._race(primary, send, limiter, cost, priority, started, endpoint)
+                    self.skipped += 1
+            resp = await primary
+        except BaseException:
+            primary.cancel()
+            raise
+        metrics.record_attempt(time.monotonic() - started, endpoint)
+        return resp
+
+    async def _race(self, primary: asyncio.Future, send: Callable[[], Awaitable[httpx.Response]], limiter: LLMLimiter, cost: int, priority: str, started: float, endpoint: str) -> httpx.Response:
+        self.hedged += 1
+        hedge = asyncio.ensure_future(send())
+        pending = {primary, hedge}
+        winner: Optional[asyncio.Future] = None
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None and task.exception() is None and task.result().is_success:
+                        winner = task
+            if winner is None:
+                # Neither succeeded: report the primary's outcome.
+                winner = primary
+            else:
+                metrics.record_attempt(time.monotonic() - started, endpoint)
+                if winner is hedge:
+                    self.hedge_wins += 1
+                else:
+                    self.primary_wins += 1
+            return winner.result()
+        finally:
+            for task in (primary, hedge):
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    await task.result().aclose()
+            limiter.release(cost, ok=False, priority=priority)
+
+    def stats(self) -> Dict[str, Any]:
+        decided = self.hedge_wins + self.primary_wins
+        return {
+            "enabled": self.enabled,
+            "attempts": self.attempts,
+            "hedged": self.hedged,
+            "skipped": self.skipped,
+            "hedge_wins": self.hedge_wins,
+            "primary_wins": self.primary_wins,
+            "hedge_win_rate": round(self.hedge_wins / decided, 3) if decided else None,
+        }
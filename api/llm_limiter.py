@@ -0,0 +1,313 @@
+"""Shared admission control for Anthropic API calls.
+
+Every upstream request takes a permit from one `LLMLimiter`, which combines:
+
+* token buckets for requests/minute and tokens/minute,
+* an AIMD concurrency limit that halves on 429/5xx/timeouts and grows by
+  roughly one slot per window of successful calls,
+* a shared cool-down that honours `retry-after` and otherwise backs off
+  exponentially with consecutive failures.
+
+Waiting callers sit in per-priority queues instead of sleeping on their own
+timers, so throttling is fair and retries do not arrive in waves. Retries are
+queued at the front of their class because they have already waited once.
+
+Between classes, permits are handed out by weighted fair queuing: each
+request gets a virtual finish tag of its estimated token cost divided by its
+class weight, and the smallest tag goes first. Interactive traffic is
+weighted well above background traffic, so it is admitted ahead of batch
+work without starving it, and each class is capped at a share of the
+concurrency limit so background jobs never occupy every slot.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from .llm_metrics import Histogram
+from .llm_router import BACKGROUND, INTERACTIVE, PRIORITIES, DeadlineExceeded
+
+ANTHROPIC_RPM = float(os.getenv("ANTHROPIC_RPM", "50"))
+ANTHROPIC_TPM = float(os.getenv("ANTHROPIC_TPM", "50000"))
+ANTHROPIC_MIN_CONCURRENCY = int(os.getenv("ANTHROPIC_MIN_CONCURRENCY", "1"))
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "16"))
+ANTHROPIC_INITIAL_CONCURRENCY = int(os.getenv("ANTHROPIC_INITIAL_CONCURRENCY", "4"))
+
+# Weighted fair queuing between priority classes, and each class's cap as a
+# share of the (adaptive) concurrency limit.
+CLASS_WEIGHTS = {
+    INTERACTIVE: float(os.getenv("LLM_INTERACTIVE_WEIGHT", "8")),
+    BACKGROUND: float(os.getenv("LLM_BACKGROUND_WEIGHT", "1")),
+}
+CLASS_MAX_SHARE = {
+    INTERACTIVE: float(os.getenv("LLM_INTERACTIVE_MAX_SHARE", "1.0")),
+    BACKGROUND: float(os.getenv("LLM_BACKGROUND_MAX_SHARE", "0.5")),
+}
+
+# Cool-down after an overload signal without `retry-after`: BASE * 2**(n-1), capped.
+BASE_COOLDOWN = 0.5
+MAX_COOLDOWN = 30.0
+
+
+class CoolingDown(DeadlineExceeded):
+    """`acquire` refused a call because the cool-down after upstream failures lasts past its deadline."""
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """Rough token cost of a request: ~4 characters per input token plus the output cap."""
+    return len(prompt) // 4 + max_tokens
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the `retry-after` header as seconds, if it is a number."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `per_minute / 60` per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 when available now)."""
+        self._refill(now)
+        # Requests larger than the bucket are admitted once it is full.
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        # May go negative when a request turns out to cost more than estimated.
+        self.tokens -= amount
+
+
+class _PriorityClass:
+    """Wait queue, in-flight count and wait-time stats for one priority class."""
+
+    def __init__(self, weight: float, max_share: float):
+        self.weight = weight
+        self.max_share = max_share
+        self.waiters: Deque[Tuple[asyncio.Future, int, float]] = deque()
+        self.last_finish = 0.0
+        self.in_flight = 0
+        self.admitted = 0
+        self.total_wait = 0.0
+        self.waits = Histogram()
+
+    def head(self) -> Optional[Tuple[asyncio.Future, int, float]]:
+        """First waiter that has not been cancelled, dropping cancelled ones."""
+        while self.waiters and self.waiters[0][0].done():
+            self.waiters.popleft()
+        return self.waiters[0] if self.waiters else None
+
+    def cap(self, limit: float) -> int:
+        return max(1, int(limit * self.max_share))
+
+    def stats(self, limit: float) -> Dict[str, Any]:
+        waits = self.waits.summary()
+        return {
+            "queued": len(self.waiters),
+            "in_flight": self.in_flight,
+            "cap": self.cap(limit),
+            "admitted": self.admitted,
+            "avg_wait_ms": round(1000 * self.total_wait / self.admitted, 1) if self.admitted else 0.0,
+            "p95_wait_ms": waits["p95_ms"],
+            "p99_wait_ms": waits["p99_ms"],
+        }
+
+
+class LLMLimiter:
+    """Token-bucket rate limiter with AIMD concurrency and weighted fair priority queues."""
+
+    def __init__(
+        self,
+        rpm: float = ANTHROPIC_RPM,
+        tpm: float = ANTHROPIC_TPM,
+        min_concurrency: int = ANTHROPIC_MIN_CONCURRENCY,
+        max_concurrency: int = ANTHROPIC_MAX_CONCURRENCY,
+        initial_concurrency: int = ANTHROPIC_INITIAL_CONCURRENCY,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(initial_concurrency)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.consecutive_failures = 0
+        self.classes = {name: _PriorityClass(CLASS_WEIGHTS[name], CLASS_MAX_SHARE[name]) for name in PRIORITIES}
+        self._vtime = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0
+        self.throttled = 0
+        self.rejected_past_deadline = 0
+        self.total_wait = 0.0
+
+    async def acquire(self, cost: int, retry: bool = False, priority: str = INTERACTIVE, deadline: Optional[float] = None) -> int:
+        """Wait for a permit to send a request estimated at `cost` tokens.
+
+        Returns the charged cost, which must be passed back to `release`
+        together with the same `priority`. With a `deadline` (monotonic
+        time), raises `CoolingDown` right away instead of queueing when the
+        cool-down lasts past it; the cool-down only follows upstream
+        failures, so callers count that as one.
+        """
+        if deadline is not None and self.blocked_until >= deadline:
+            self.rejected_past_deadline += 1
+            raise CoolingDown(f"rate limiter cooling down for {self.blocked_until - time.monotonic():.1f}s, past the latency budget")
+        klass = self.classes[priority]
+        fut = asyncio.get_running_loop().create_future()
+        if retry:
+            # Retries go first in their class and are not charged again.
+            entry = (fut, cost, self._vtime)
+            klass.waiters.appendleft(entry)
+        else:
+            start = max(self._vtime, klass.last_finish)
+            klass.last_finish = start + cost / klass.weight
+            entry = (fut, cost, klass.last_finish)
+            klass.waiters.append(entry)
+        started = time.monotonic()
+        self._dispatch()
+        if not fut.done():
+            self.throttled += 1
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Granted just as we were cancelled: hand the slot back.
+                self.release(cost, ok=True, priority=priority)
+            else:
+                try:
+                    klass.waiters.remove(entry)
+                except ValueError:
+                    pass
+            raise
+        waited = time.monotonic() - started
+        self.total_wait += waited
+        klass.total_wait += waited
+        klass.waits.add(waited)
+        return cost
+
+    def try_acquire(self, cost: int, priority: str = INTERACTIVE) -> bool:
+        """Take a permit only if one is free right now and nobody is waiting.
+
+        For optional extra requests (hedges) that should never queue.
+        """
+        klass = self.classes[priority]
+        now = time.monotonic()
+        if any(c.head() for c in self.classes.values()) or self.in_flight >= int(self.limit) or self.blocked_until > now:
+            return False
+        if klass.in_flight >= klass.cap(self.limit):
+            return False
+        if self.requests.wait_time(1, now) > 0 or self.tokens.wait_time(cost, now) > 0:
+            return False
+        self._admit(klass, cost)
+        return True
+
+    def release(
+        self,
+        cost: int,
+        ok: bool,
+        overloaded: bool = False,
+        retry_after: Optional[float] = None,
+        tokens_used: Optional[int] = None,
+        priority: str = INTERACTIVE,
+    ) -> None:
+        """Return a permit and feed the outcome back into the limiter.
+
+        Args:
+            cost: The value returned by `acquire`
+            ok: Whether the request succeeded
+            overloaded: True for 429/5xx/timeouts; shrinks the concurrency limit
+            retry_after: Seconds the upstream asked us to wait, if any
+            tokens_used: Actual tokens from `usage`, to correct the estimate
+            priority: The class the permit was acquired for
+        """
+        self.in_flight -= 1
+        self.classes[priority].in_flight -= 1
+        now = time.monotonic()
+        if tokens_used is not None:
+            self.tokens.take(tokens_used - cost)
+        if overloaded:
+            self.limit = max(self.min_concurrency, self.limit / 2)
+            self.consecutive_failures += 1
+            if retry_after is None:
+                retry_after = min(MAX_COOLDOWN, BASE_COOLDOWN * 2 ** (self.consecutive_failures - 1))
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+        elif ok:
+            self.consecutive_failures = 0
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Admit queued requests by fair-queuing order while capacity allows."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.in_flight < int(self.limit):
+            # Smallest finish tag among classes that are under their cap;
+            # a release() will dispatch again for capped ones.
+            best = None
+            for klass in self.classes.values():
+                head = klass.head()
+                if head is not None and klass.in_flight < klass.cap(self.limit):
+                    if best is None or head[2] < best[1][2]:
+                        best = (klass, head)
+            if best is None:
+                return
+            klass, (fut, cost, finish) = best
+            now = time.monotonic()
+            delay = max(
+                self.blocked_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(cost, now),
+            )
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            klass.waiters.popleft()
+            self._vtime = max(self._vtime, finish - cost / klass.weight)
+            self._admit(klass, cost)
+            fut.set_result(None)
+
+    def _admit(self, klass: _PriorityClass, cost: int) -> None:
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self.in_flight += 1
+        self.admitted += 1
+        klass.in_flight += 1
+        klass.admitted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self.requests._refill(now)
+        self.tokens._refill(now)
+        return {
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": sum(len(klass.waiters) for klass in self.classes.values()),
+            "requests_available": round(self.requests.tokens, 1),
+            "tokens_available": round(self.tokens.tokens),
+            "cooldown_remaining": round(max(0.0, self.blocked_until - now), 2),
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "rejected_past_deadline": self.rejected_past_deadline,
+            "avg_wait_ms": round(1000 * self.total_wait / self.admitted, 1) if self.admitted else 0.0,
+            "classes": {name: klass.stats(self.limit) for name, klass in self.classes.items()},
+        }
@@ -0,0 +1,296 @@
+"""Per-call latency, token and cost metrics for LLM calls.
+
+Every upstream call (Anthropic via `anthropic_client`, OpenAI via
+`stream_text`) is recorded with its time to first byte, total latency,
+retries, token usage and model, attributed to the HTTP endpoint that made it.
+`LLMMetricsMiddleware` also records each request's total duration, so the
+share of endpoint time spent waiting on the LLM can be compared with the rest
+(database work, serialization).
+
+Samples go into sparse log-bucketed histograms (~7% relative error) kept in
+`METRICS_SLOT`-second slots; `summary()` merges the slots of the last
+`window` seconds to report p50/p95/p99 per endpoint. Nothing per-call is
+retained, so recording is O(1) and memory is bounded by
+endpoints x slots x occupied buckets.
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+METRICS_SLOT = float(os.getenv("LLM_METRICS_SLOT", "10"))
+METRICS_WINDOW = float(os.getenv("LLM_METRICS_WINDOW", "900"))
+
+# Bucket i covers (BASE * GROWTH**(i-1), BASE * GROWTH**i] seconds.
+BUCKET_BASE = 0.001
+BUCKET_GROWTH = 1.15
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+
+# USD per million tokens: input, output, cache write, cache read.
+MODEL_PRICES: Dict[str, Tuple[float, float, float, float]] = {
+    "claude-3-haiku-20240307": (0.25, 1.25, 0.30, 0.03),
+    "claude-3-5-haiku-20241022": (0.80, 4.00, 1.00, 0.08),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-opus-20240229": (15.00, 75.00, 18.75, 1.50),
+    "gpt-4o": (2.50, 10.00, 0.0, 1.25),
+}
+
+_endpoint: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("llm_endpoint", default=None)
+
+
+def current_endpoint() -> str:
+    """Return the endpoint LLM calls in this context are attributed to."""
+    return _endpoint.get() or "(background)"
+
+
+def set_endpoint(name: Optional[str]) -> contextvars.Token:
+    return _endpoint.set(name)
+
+
+def reset_endpoint(token: contextvars.Token) -> None:
+    _endpoint.reset(token)
+
+
+def call_cost(model: str, usage: Dict[str, Any]) -> float:
+    """Dollar cost of one call's `usage` (0 for models without a price)."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    tokens = (
+        usage.get("input_tokens") or 0,
+        usage.get("output_tokens") or 0,
+        usage.get("cache_creation_input_tokens") or 0,
+        usage.get("cache_read_input_tokens") or 0,
+    )
+    return sum(count * price for count, price in zip(tokens, prices)) / 1_000_000
+
+
+class Histogram:
+    """Sparse histogram with logarithmic buckets."""
+
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float) -> None:
+        index = 0 if value <= BUCKET_BASE else math.ceil(math.log(value / BUCKET_BASE) / _LOG_GROWTH)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: "Histogram") -> None:
+        for index, count in other.counts.items():
+            self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the `q` quantile (0 < q <= 1)."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return BUCKET_BASE * BUCKET_GROWTH ** index
+        return None
+
+    def summary(self) -> Dict[str, Any]:
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 1) if value is not None else None
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else None,
+            "p50_ms": ms(self.percentile(0.50)),
+            "p95_ms": ms(self.percentile(0.95)),
+            "p99_ms": ms(self.percentile(0.99)),
+        }
+
+
+class EndpointStats:
+    """Counters and histograms for one endpoint over one slot (or a merged window)."""
+
+    def __init__(self):
+        self.ttfb = Histogram()
+        self.attempt_ttfb = Histogram()
+        self.latency = Histogram()
+        self.request = Histogram()
+        self.counters: Counter = Counter()
+        self.models: Counter = Counter()
+        self.cost = 0.0
+
+    def merge(self, other: "EndpointStats") -> None:
+        self.ttfb.merge(other.ttfb)
+        self.attempt_ttfb.merge(other.attempt_ttfb)
+        self.latency.merge(other.latency)
+        self.request.merge(other.request)
+        self.counters.update(other.counters)
+        self.models.update(other.models)
+        self.cost += other.cost
+
+    def summary(self) -> Dict[str, Any]:
+        counters = self.counters
+        request_time = self.request.total
+        return {
+            "calls": counters["calls"],
+            "errors": counters["errors"],
+            "retries": counters["retries"],
+            "cache_hits": counters["cache_hits"],
+            "models": dict(self.models),
+            "ttfb": self.ttfb.summary(),
+            "attempt_ttfb": self.attempt_ttfb.summary(),
+            "latency": self.latency.summary(),
+            "request": self.request.summary(),
+            # Share of request time spent waiting on the LLM; the rest is
+            # database work, serialization and queueing.
+            "llm_time_share": round(min(1.0, self.latency.total / request_time), 3) if request_time else None,
+            "tokens": {
+                "input": counters["input_tokens"],
+                "output": counters["output_tokens"],
+                "cache_write": counters["cache_creation_input_tokens"],
+                "cache_read": counters["cache_read_input_tokens"],
+            },
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class LLMMetrics:
+    """Sliding window of per-endpoint `EndpointStats` slots. Thread-safe."""
+
+    def __init__(self, slot: float = METRICS_SLOT, window: float = METRICS_WINDOW, clock: Callable[[], float] = time.time):
+        self.slot = slot
+        self.max_slots = max(1, int(math.ceil(window / slot)))
+        self.clock = clock
+        self._slots: Deque[Tuple[int, Dict[str, EndpointStats]]] = deque()
+        self._lock = threading.Lock()
+
+    def _current(self, endpoint: str) -> EndpointStats:
+        """Return the current slot's stats for `endpoint`; caller holds the lock."""
+        slot_id = int(self.clock() // self.slot)
+        if not self._slots or self._slots[-1][0] != slot_id:
+            self._slots.append((slot_id, {}))
+            while self._slots[0][0] <= slot_id - self.max_slots:
+                self._slots.popleft()
+        slot = self._slots[-1][1]
+        stats = slot.get(endpoint)
+        if stats is None:
+            stats = slot[endpoint] = EndpointStats()
+        return stats
+
+    def record_call(
+        self,
+        model: str,
+        latency: float,
+        ttfb: Optional[float] = None,
+        retries: int = 0,
+        usage: Optional[Dict[str, Any]] = None,
+        ok: bool = True,
+        endpoint: Optional[str] = None,
+    ) -> None:
+        """Record one upstream LLM call (including its retries)."""
+        usage = usage or {}
+        with self._lock:
+            stats = self._current(endpoint or current_endpoint())
+            stats.counters["calls"] += 1
+            stats.counters["retries"] += retries
+            stats.models[model] += 1
+            if not ok:
+                stats.counters["errors"] += 1
+            stats.latency.add(latency)
+            if ttfb is not None:
+                stats.ttfb.add(ttfb)
+            for field in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+                stats.counters[field] += usage.get(field) or 0
+            stats.cost += call_cost(model, usage)
+
+    def record_attempt(self, ttfb: float, endpoint: Optional[str] = None) -> None:
+        """Record one upstream attempt's time to response headers (no queueing or retries)."""
+        with self._lock:
+            self._current(endpoint or current_endpoint()).attempt_ttfb.add(ttfb)
+
+    def record_cache_hit(self, endpoint: Optional[str] = None) -> None:
+        with self._lock:
+            self._current(endpoint or current_endpoint()).counters["cache_hits"] += 1
+
+    def record_request(self, endpoint: str, duration: float) -> None:
+        """Record a request's total duration; only kept for endpoints that call the LLM."""
+        with self._lock:
+            if not any(endpoint in slot for _, slot in self._slots):
+                return
+            self._current(endpoint).request.add(duration)
+
+    def window(self, seconds: Optional[float] = None) -> Dict[str, EndpointStats]:
+        """Merged stats per endpoint over the last `seconds` (default: whole window)."""
+        oldest = int((self.clock() - (seconds or self.max_slots * self.slot)) // self.slot)
+        merged: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+        with self._lock:
+            for slot_id, slot in self._slots:
+                if slot_id <= oldest:
+                    continue
+                for endpoint, stats in slot.items():
+                    merged[endpoint].merge(stats)
+        return merged
+
+    def percentile(self, metric: str, q: float, seconds: Optional[float] = None, endpoint: Optional[str] = None) -> Optional[float]:
+        """Quantile in seconds of "ttfb", "attempt_ttfb", "latency" or "request" for one or all endpoints."""
+        combined = Histogram()
+        for name, stats in self.window(seconds).items():
+            if endpoint is None or name == endpoint:
+                combined.merge(getattr(stats, metric))
+        return combined.percentile(q)
+
+    def summary(self, seconds: Optional[float] = None) -> Dict[str, Any]:
+        seconds = seconds or self.max_slots * self.slot
+        endpoints = self.window(seconds)
+        total = EndpointStats()
+        for stats in endpoints.values():
+            total.merge(stats)
+        return {
+            "window_seconds": seconds,
+            "total": total.summary(),
+            "endpoints": {name: stats.summary() for name, stats in sorted(endpoints.items())},
+        }
+
+
+metrics = LLMMetrics()
+
+
+class LLMMetricsMiddleware:
+    """ASGI middleware attributing LLM calls to "METHOD /path" and timing requests.
+
+    Request time runs until the last body chunk is sent, so streamed
+    responses are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = f"{scope['method']} {scope['path']}"
+        token = set_endpoint(endpoint)
+        started = time.monotonic()
+        recorded = False
+
+        async def send_wrapper(message):
+            nonlocal recorded
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body") and not recorded:
+                recorded = True
+                metrics.record_request(endpoint, time.monotonic() - started)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            reset_endpoint(token)
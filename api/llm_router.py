@@ -0,0 +1,105 @@
+"""Choose a Claude model and output size for a latency budget.
+
+Callers that declare a budget (seconds) and a priority get the best model
+whose expected completion time fits, estimated from a static speed profile
+per model: a fixed time to first token, prompt processing rate and output
+rate. When even the fastest model cannot produce `max_tokens` in time, the
+output cap is shrunk to what fits, down to `MIN_OUTPUT_TOKENS`.
+
+Interactive calls stay on the default (fast) model and only have their
+output trimmed; background calls may use the slower, stronger model when
+the budget allows it.
+"""
+
+import os
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = (INTERACTIVE, BACKGROUND)
+
+ANTHROPIC_FAST_MODEL = os.getenv("ANTHROPIC_FAST_MODEL", "claude-3-haiku-20240307")
+ANTHROPIC_QUALITY_MODEL = os.getenv("ANTHROPIC_QUALITY_MODEL", "claude-3-5-sonnet-20241022")
+
+# Default budgets for request handlers: a blocking JSON response, and a
+# streamed one where the user already sees progress.
+LLM_INTERACTIVE_BUDGET = float(os.getenv("LLM_INTERACTIVE_BUDGET", "20"))
+LLM_STREAM_BUDGET = float(os.getenv("LLM_STREAM_BUDGET", "60"))
+
+# Plan to finish within this fraction of the budget, leaving room for jitter.
+BUDGET_SAFETY = 0.8
+MIN_OUTPUT_TOKENS = 128
+# Don't start (or retry) an attempt with less than this many seconds left.
+MIN_ATTEMPT_SECONDS = float(os.getenv("LLM_MIN_ATTEMPT_SECONDS", "1"))
+
+
+class ModelProfile(NamedTuple):
+    """Rough speed of a model: seconds to first token plus token rates per second."""
+
+    ttft: float
+    input_rate: float
+    output_rate: float
+
+
+MODEL_PROFILES: Dict[str, ModelProfile] = {
+    "claude-3-haiku-20240307": ModelProfile(ttft=0.5, input_rate=20000, output_rate=120),
+    "claude-3-5-haiku-20241022": ModelProfile(ttft=0.7, input_rate=15000, output_rate=65),
+    "claude-3-5-sonnet-20241022": ModelProfile(ttft=1.0, input_rate=8000, output_rate=55),
+    "claude-3-opus-20240229": ModelProfile(ttft=2.0, input_rate=4000, output_rate=25),
+}
+_UNKNOWN_PROFILE = ModelProfile(ttft=1.0, input_rate=8000, output_rate=50)
+
+
+class Route(NamedTuple):
+    model: str
+    max_tokens: int
+
+
+class DeadlineExceeded(TimeoutError):
+    """The latency budget ran out before any output arrived."""
+
+
+routes_taken: Counter = Counter()
+
+
+def expected_seconds(model: str, prompt_tokens: int, max_tokens: int) -> float:
+    profile = MODEL_PROFILES.get(model, _UNKNOWN_PROFILE)
+    return profile.ttft + prompt_tokens / profile.input_rate + max_tokens / profile.output_rate
+
+
+def route(prompt_tokens: int, max_tokens: int, budget: Optional[float], priority: str = INTERACTIVE, model: Optional[str] = None) -> Route:
+    """Pick the model and output cap for a call with `budget` seconds to spare.
+
+    An explicit `model` is kept; only its output cap is fitted to the budget.
+    """
+    if model is not None:
+        candidates: List[str] = [model]
+    elif priority == BACKGROUND:
+        candidates = [ANTHROPIC_QUALITY_MODEL, ANTHROPIC_FAST_MODEL]
+    else:
+        candidates = [ANTHROPIC_FAST_MODEL]
+
+    chosen = Route(candidates[0], max_tokens)
+    if budget is not None:
+        usable = budget * BUDGET_SAFETY
+        fitting = [m for m in candidates if expected_seconds(m, prompt_tokens, max_tokens) <= usable]
+        if fitting:
+            chosen = Route(fitting[0], max_tokens)
+        else:
+            fastest = min(candidates, key=lambda m: expected_seconds(m, prompt_tokens, max_tokens))
+            profile = MODEL_PROFILES.get(fastest, _UNKNOWN_PROFILE)
+            room = usable - profile.ttft - prompt_tokens / profile.input_rate
+            chosen = Route(fastest, max(MIN_OUTPUT_TOKENS, min(max_tokens, int(room * profile.output_rate))))
+    routes_taken[(chosen.model, priority, chosen.max_tokens < max_tokens)] += 1
+    return chosen
+
+
+def stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for (model, priority, trimmed), count in routes_taken.items():
+        entry = out.setdefault(model, {"interactive": 0, "background": 0, "trimmed": 0})
+        entry[priority] += count
+        if trimmed:
+            entry["trimmed"] += count
+    return out
@@ -30,6 +30,8 @@ if env_file.exists():
         os.environ.pop('DATABASE_URL', None)
 
 from . import db as _db
+from . import anthropic_client
+from .llm_metrics import LLMMetricsMiddleware
 from .routes import router as api_router
 
 # Create FastAPI app
@@ -53,6 +55,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Attribute LLM calls to endpoints and time requests for /api/llm/metrics
+app.add_middleware(LLMMetricsMiddleware)
+
 # Initialize database (creates tables if they don't exist)
 _db.init_db()
 
@@ -60,6 +65,18 @@ _db.init_db()
 app.include_router(api_router, prefix="/api")
 
 
+@app.on_event("startup")
+async def open_llm_client():
+    """Warm up the pooled Anthropic client so the first request skips setup."""
+    await anthropic_client.open_client()
+
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    """Release pooled Anthropic connections on shutdown."""
+    await anthropic_client.close_client()
+
+
 @app.get("/health")
 def health_check():
     """Health check endpoint."""
@@ -0,0 +1,408 @@
+"""Local stand-in for the Anthropic and OpenAI APIs, for tests and load tests.
+
+Serves:
+    POST /v1/messages                       Anthropic Messages (JSON or SSE stream)
+    POST /v1/messages/batches               Anthropic Message Batches
+    GET  /v1/messages/batches/{id}[/results]
+    POST /v1/chat/completions               OpenAI Chat Completions (JSON or SSE stream)
+    GET  /v1/forecast                       open-meteo forecast (for the chat weather tool)
+    GET/POST /mock/config                   inspect or change the settings below at runtime
+    GET  /mock/stats                        request / error counters
+
+Responses are canned text, but latency is realistic and configurable: a
+time-to-first-byte drawn from a distribution, then output tokens at a fixed
+rate, plus optional 429 (with `retry-after`) and 5xx injection. State is kept
+in memory.
+
+Usage:
+    python -m uvicorn api.mock_llm:app --port 8001
+    export ANTHROPIC_API_URL=http://localhost:8001/v1/messages ANTHROPIC_API_KEY=test
+    export AI_GATEWAY_BASE_URL=http://localhost:8001/v1 AI_GATEWAY_API_KEY=test
+    export WEATHER_API_URL=http://localhost:8001/v1/forecast
+
+Environment (all also settable through POST /mock/config):
+    MOCK_TTFB_DIST       fixed | uniform | normal | lognormal | exponential (default lognormal)
+    MOCK_TTFB_MS         median time to first byte in ms (default 300)
+    MOCK_TTFB_SPREAD     spread: sigma for lognormal, fraction of the median otherwise (default 0.5)
+    MOCK_TOKENS_PER_SEC  output token rate (default 80)
+    MOCK_OUTPUT_TOKENS   tokens per response, capped by max_tokens (default 60)
+    MOCK_RATE_429        probability of answering 429 (default 0)
+    MOCK_RATE_5XX        probability of answering 500/529 (default 0)
+    MOCK_RETRY_AFTER     retry-after seconds sent with 429/529 (default 1)
+    MOCK_TOOL_CALL_RATE  probability a chat completion calls the first tool (default 0)
+    MOCK_BATCH_DELAY     seconds before a submitted batch reports "ended" (default 1)
+    MOCK_WEATHER_MS      latency of a forecast request in ms (default 100)
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+config: Dict[str, Any] = {
+    "ttfb_dist": os.getenv("MOCK_TTFB_DIST", "lognormal"),
+    "ttfb_ms": float(os.getenv("MOCK_TTFB_MS", "300")),
+    "ttfb_spread": float(os.getenv("MOCK_TTFB_SPREAD", "0.5")),
+    "tokens_per_sec": float(os.getenv("MOCK_TOKENS_PER_SEC", "80")),
+    "output_tokens": int(os.getenv("MOCK_OUTPUT_TOKENS", "60")),
+    "rate_429": float(os.getenv("MOCK_RATE_429", "0")),
+    "rate_5xx": float(os.getenv("MOCK_RATE_5XX", "0")),
+    "retry_after": float(os.getenv("MOCK_RETRY_AFTER", "1")),
+    "tool_call_rate": float(os.getenv("MOCK_TOOL_CALL_RATE", "0")),
+    "batch_delay": float(os.getenv("MOCK_BATCH_DELAY", "1")),
+    "weather_ms": float(os.getenv("MOCK_WEATHER_MS", "100")),
+}
+
+app = FastAPI(title="Mock LLM API")
+
+stats: Counter = Counter()
+_batches: Dict[str, Dict[str, Any]] = {}
+# Prompt-cache prefixes seen so far, to report cache writes vs. reads in `usage`.
+_cached_prefixes: set = set()
+
+
+def _ttfb() -> float:
+    """Draw a time-to-first-byte in seconds from the configured distribution."""
+    median = config["ttfb_ms"] / 1000.0
+    spread = config["ttfb_spread"]
+    dist = config["ttfb_dist"]
+    if dist == "fixed":
+        value = median
+    elif dist == "uniform":
+        value = random.uniform(median * (1 - spread), median * (1 + spread))
+    elif dist == "normal":
+        value = random.gauss(median, median * spread)
+    elif dist == "exponential":
+        value = random.expovariate(1 / median) if median > 0 else 0.0
+    else:
+        value = random.lognormvariate(0, spread) * median
+    return max(0.0, value)
+
+
+def _token_delay() -> float:
+    rate = config["tokens_per_sec"]
+    return 1.0 / rate if rate > 0 else 0.0
+
+
+def _injected_error(api: str) -> Optional[JSONResponse]:
+    """Maybe return a 429 or 5xx in the given API's error format."""
+    roll = random.random()
+    if roll < config["rate_429"]:
+        status, kind, message = 429, "rate_limit_error", "mock rate limit"
+    elif roll < config["rate_429"] + config["rate_5xx"]:
+        status = random.choice([500, 529]) if api == "anthropic" else random.choice([500, 503])
+        kind, message = ("overloaded_error" if status == 529 else "api_error"), "mock upstream failure"
+    else:
+        return None
+    stats[f"{api}_{status}"] += 1
+    if api == "anthropic":
+        body = {"type": "error", "error": {"type": kind, "message": message}}
+    else:
+        body = {"error": {"message": message, "type": kind, "code": status}}
+    headers = {"retry-after": str(config["retry_after"])} if status in (429, 503, 529) else {}
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def _words(prompt: str, count: int) -> List[str]:
+    """`count` output "tokens": words echoed from the prompt, one per token."""
+    source = prompt.split() or ["ok"]
+    return [source[i % len(source)] + " " for i in range(count)]
+
+
+def _prompt_text(params: Dict[str, Any]) -> str:
+    parts = []
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+    return "\n".join(parts)
+
+
+def _sse(payload: Dict[str, Any], event: Optional[str] = None) -> str:
+    data = json.dumps(payload, separators=(",", ":"))
+    return f"event: {event}\ndata: {data}\n\n" if event else f"data: {data}\n\n"
+
+
+# --- Anthropic Messages -----------------------------------------------------
+
+
+def _cache_usage(params: Dict[str, Any]) -> Dict[str, int]:
+    """Simulate prompt caching for blocks marked with `cache_control`."""
+    usage = {"cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for block in content:
+            if isinstance(block, dict) and block.get("cache_control"):
+                text = block.get("text", "")
+                field = "cache_read_input_tokens" if text in _cached_prefixes else "cache_creation_input_tokens"
+                usage[field] += len(text) // 4
+                _cached_prefixes.add(text)
+    return usage
+
+
+def _input_usage(params: Dict[str, Any], prompt: str) -> Dict[str, int]:
+    cache_usage = _cache_usage(params)
+    cached = cache_usage["cache_creation_input_tokens"] + cache_usage["cache_read_input_tokens"]
+    return {"input_tokens": max(0, len(prompt) // 4 - cached), **cache_usage}
+
+
+def _output_tokens(params: Dict[str, Any]) -> int:
+    return max(1, min(config["output_tokens"], params.get("max_tokens") or config["output_tokens"]))
+
+
+def _message(params: Dict[str, Any]) -> Dict[str, Any]:
+    prompt = _prompt_text(params)
+    words = _words(prompt, _output_tokens(params))
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model"),
+        "content": [{"type": "text", "text": "".join(words).rstrip()}],
+        "stop_reason": "end_turn",
+        "usage": {**_input_usage(params, prompt), "output_tokens": len(words)},
+    }
+
+
+async def _message_events(params: Dict[str, Any]) -> AsyncIterator[str]:
+    prompt = _prompt_text(params)
+    words = _words(prompt, _output_tokens(params))
+    message = {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model"),
+        "content": [],
+        "stop_reason": None,
+        "usage": {**_input_usage(params, prompt), "output_tokens": 1},
+    }
+    yield _sse({"type": "message_start", "message": message}, "message_start")
+    yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, "content_block_start")
+    yield _sse({"type": "ping"}, "ping")
+    delay = _token_delay()
+    for word in words:
+        await asyncio.sleep(delay)
+        yield _sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": word}}, "content_block_delta")
+    yield _sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+    yield _sse({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None}, "usage": {"output_tokens": len(words)}}, "message_delta")
+    yield _sse({"type": "message_stop"}, "message_stop")
+
+
+@app.post("/v1/messages")
+async def create_message(request: Request):
+    params = await request.json()
+    stats["anthropic_requests"] += 1
+    error = _injected_error("anthropic")
+    if error is not None:
+        return error
+    await asyncio.sleep(_ttfb())
+    if params.get("stream"):
+        return StreamingResponse(_message_events(params), media_type="text/event-stream")
+    await asyncio.sleep(_output_tokens(params) * _token_delay())
+    return _message(params)
+
+
+# --- Anthropic Message Batches ----------------------------------------------
+
+
+def _batch_view(batch: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    ended = time.time() - batch["created"] >= config["batch_delay"]
+    count = len(batch["requests"])
+    return {
+        "id": batch["id"],
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {
+            "processing": 0 if ended else count,
+            "succeeded": count if ended else 0,
+            "errored": 0,
+            "canceled": 0,
+            "expired": 0,
+        },
+        "created_at": datetime.utcfromtimestamp(batch["created"]).isoformat() + "Z",
+        "results_url": f"{base_url}v1/messages/batches/{batch['id']}/results" if ended else None,
+    }
+
+
+@app.post("/v1/messages/batches")
+async def create_batch(request: Request):
+    body = await request.json()
+    batch = {"id": f"msgbatch_{uuid.uuid4().hex[:24]}", "created": time.time(), "requests": body.get("requests", [])}
+    _batches[batch["id"]] = batch
+    stats["batches"] += 1
+    return _batch_view(batch, str(request.base_url))
+
+
+@app.get("/v1/messages/batches/{batch_id}")
+def get_batch(batch_id: str, request: Request):
+    batch = _batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    return _batch_view(batch, str(request.base_url))
+
+
+@app.get("/v1/messages/batches/{batch_id}/results")
+def get_batch_results(batch_id: str):
+    batch = _batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="batch not found")
+    lines = [
+        json.dumps({"custom_id": r["custom_id"], "result": {"type": "succeeded", "message": _message(r["params"])}})
+        for r in batch["requests"]
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="application/x-jsonl")
+
+
+# --- OpenAI Chat Completions ------------------------------------------------
+
+
+def _tool_call(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Maybe call the first declared tool with placeholder arguments."""
+    tools = params.get("tools") or []
+    messages = params.get("messages") or []
+    if not tools or not messages or messages[-1].get("role") == "tool":
+        return None
+    if random.random() >= config["tool_call_rate"]:
+        return None
+    function = tools[0].get("function", {})
+    placeholders = {"number": 0, "integer": 0, "boolean": False, "string": "mock"}
+    properties = (function.get("parameters") or {}).get("properties") or {}
+    arguments = {name: placeholders.get(spec.get("type"), None) for name, spec in properties.items()}
+    return {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function", "function": {"name": function.get("name"), "arguments": json.dumps(arguments)}}
+
+
+def _chat_usage(prompt: str, completion_tokens: int) -> Dict[str, int]:
+    prompt_tokens = len(prompt) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+async def _chat_events(params: Dict[str, Any], completion_id: str, tool_call: Optional[Dict[str, Any]]) -> AsyncIterator[str]:
+    prompt = _prompt_text(params)
+    base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": params.get("model")}
+
+    def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> str:
+        return _sse({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]})
+
+    yield chunk({"role": "assistant", "content": ""})
+    delay = _token_delay()
+    if tool_call is not None:
+        arguments = tool_call["function"]["arguments"]
+        yield chunk({"tool_calls": [{"index": 0, "id": tool_call["id"], "type": "function", "function": {"name": tool_call["function"]["name"], "arguments": ""}}]})
+        for start in range(0, len(arguments), 8):
+            await asyncio.sleep(delay)
+            yield chunk({"tool_calls": [{"index": 0, "function": {"arguments": arguments[start:start + 8]}}]})
+        completion_tokens = len(arguments) // 4 + 1
+        yield chunk({}, "tool_calls")
+    else:
+        words = _words(prompt, _output_tokens(params))
+        for word in words:
+            await asyncio.sleep(delay)
+            yield chunk({"content": word})
+        completion_tokens = len(words)
+        yield chunk({}, "stop")
+    if (params.get("stream_options") or {}).get("include_usage"):
+        yield _sse({**base, "choices": [], "usage": _chat_usage(prompt, completion_tokens)})
+    yield "data: [DONE]\n\n"
+    # Compared with openai_requests to see streams the caller abandoned.
+    stats["openai_streams_completed"] += 1
+
+
+@app.post("/v1/chat/completions")
+async def create_chat_completion(request: Request):
+    params = await request.json()
+    stats["openai_requests"] += 1
+    error = _injected_error("openai")
+    if error is not None:
+        return error
+    await asyncio.sleep(_ttfb())
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    tool_call = _tool_call(params)
+    if params.get("stream"):
+        return StreamingResponse(_chat_events(params, completion_id, tool_call), media_type="text/event-stream")
+
+    prompt = _prompt_text(params)
+    if tool_call is not None:
+        message: Dict[str, Any] = {"role": "assistant", "content": None, "tool_calls": [tool_call]}
+        finish_reason, completion_tokens = "tool_calls", 1
+    else:
+        words = _words(prompt, _output_tokens(params))
+        await asyncio.sleep(len(words) * _token_delay())
+        message = {"role": "assistant", "content": "".join(words).rstrip()}
+        finish_reason, completion_tokens = "stop", len(words)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": params.get("model"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": _chat_usage(prompt, completion_tokens),
+    }
+
+
+# --- open-meteo -------------------------------------------------------------
+
+
+@app.get("/v1/forecast")
+async def get_forecast(latitude: float, longitude: float):
+    """Forecast in open-meteo's shape: current and hourly temperature, daily sunrise/sunset."""
+    stats["weather_requests"] += 1
+    await asyncio.sleep(config["weather_ms"] / 1000.0)
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    # Deterministic per location so cached and fresh answers can be compared.
+    base = round(25 - abs(latitude) / 3 + (longitude % 7), 1)
+    hours = [now.replace(hour=h) for h in range(24)]
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "timezone": "GMT",
+        "current_units": {"time": "iso8601", "interval": "seconds", "temperature_2m": "°C"},
+        "current": {"time": now.strftime("%Y-%m-%dT%H:%M"), "interval": 900, "temperature_2m": base},
+        "hourly_units": {"time": "iso8601", "temperature_2m": "°C"},
+        "hourly": {
+            "time": [h.strftime("%Y-%m-%dT%H:%M") for h in hours],
+            "temperature_2m": [round(base + 4 - 8 * abs(14 - h.hour) / 14, 1) for h in hours],
+        },
+        "daily_units": {"time": "iso8601", "sunrise": "iso8601", "sunset": "iso8601"},
+        "daily": {
+            "time": [now.strftime("%Y-%m-%d")],
+            "sunrise": [now.strftime("%Y-%m-%dT06:30")],
+            "sunset": [now.strftime("%Y-%m-%dT18:45")],
+        },
+    }
+
+
+# --- Control ----------------------------------------------------------------
+
+
+@app.get("/mock/config")
+def get_config():
+    return config
+
+
+@app.post("/mock/config")
+async def update_config(request: Request):
+    """Change settings mid-run, e.g. {"rate_429": 0.2, "ttfb_ms": 800}."""
+    updates = await request.json()
+    unknown = set(updates) - set(config)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown settings: {', '.join(sorted(unknown))}")
+    for key, value in updates.items():
+        config[key] = type(config[key])(value)
+    return config
+
+
+@app.get("/mock/stats")
+def get_stats():
+    return dict(stats)
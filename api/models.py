@@ -2,6 +2,7 @@ from datetime import datetime
 from sqlalchemy import (
     Column,
     Integer,
+    Float,
     String,
     Text,
     Boolean,
@@ -207,3 +208,45 @@ class ContactInfo(Base):
     document = relationship("Document", back_populates="contacts")
     team = relationship("Team", back_populates="contacts")
     person = relationship("Person", back_populates="contact_for")
+
+
+class LLMBatchJob(Base):
+    """A bulk Claude job submitted through the Message Batches API."""
+
+    __tablename__ = "llm_batch_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # e.g. "handoffs", "onboarding"
+    status = Column(String, nullable=False, default="pending")  # pending, submitted, completed, failed
+    provider_batch_id = Column(String, nullable=True)
+    request_count = Column(Integer, default=0)
+    succeeded_count = Column(Integer, default=0)
+    errored_count = Column(Integer, default=0)
+    error = Column(Text, nullable=True)
+    poll_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    submitted_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    items = relationship("LLMBatchItem", back_populates="job", cascade="all, delete-orphan")
+
+
+class LLMBatchItem(Base):
+    """One prompt inside an LLMBatchJob; its result is written to the LLM response cache."""
+
+    __tablename__ = "llm_batch_items"
+    __table_args__ = (UniqueConstraint("job_id", "custom_id", name="uq_llm_batch_item"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("llm_batch_jobs.id"), nullable=False)
+    custom_id = Column(String, nullable=False)
+    cache_key = Column(String, nullable=False)
+    prefix = Column(Text, nullable=True)  # cacheable prompt prefix, if any
+    prompt = Column(Text, nullable=False)
+    model = Column(String, nullable=False)
+    max_tokens = Column(Integer, nullable=False)
+    temperature = Column(Float, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, succeeded, errored, canceled, expired
+    error = Column(Text, nullable=True)
+
+    job = relationship("LLMBatchJob", back_populates="items")
@@ -0,0 +1,138 @@
+"""Shared OpenAI-compatible client for `/api/chat` (Vercel AI Gateway).
+
+One `AsyncOpenAI` client and its pooled `httpx.AsyncClient` serve every chat
+request, so connections to the gateway are reused instead of being set up per
+request. Authentication is `AI_GATEWAY_API_KEY` when set, otherwise the Vercel
+OIDC token, which is fetched once and only re-read from
+`oidc.get_vercel_oidc_token()` when it is within `OIDC_REFRESH_MARGIN`
+seconds of its `exp` claim.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
+from vercel import oidc
+
+# OpenAI-compatible gateway for /api/chat (AI_GATEWAY_BASE_URL, read when the
+# client is built so `.env` applies); point it at api/mock_llm.py for load tests.
+DEFAULT_GATEWAY_BASE_URL = "https://ai-gateway.vercel.sh/v1"
+
+MAX_CONNECTIONS = int(os.getenv("AI_GATEWAY_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("AI_GATEWAY_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("AI_GATEWAY_KEEPALIVE_EXPIRY", "60"))
+CONNECT_TIMEOUT = float(os.getenv("AI_GATEWAY_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("AI_GATEWAY_READ_TIMEOUT", "60"))
+POOL_TIMEOUT = float(os.getenv("AI_GATEWAY_POOL_TIMEOUT", "10"))
+
+# Re-read the OIDC token when it expires within this many seconds (the vercel
+# SDK itself treats tokens within 15 minutes of expiry as expired).
+OIDC_REFRESH_MARGIN = float(os.getenv("OIDC_REFRESH_MARGIN", "900"))
+# Tokens without a readable `exp` claim are re-read after this many seconds.
+OIDC_FALLBACK_LIFETIME = 300.0
+
+# Bound to the loop it was created on (see `anthropic_client.get_client`).
+_http: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[AsyncOpenAI] = None
+_token: Optional[str] = None
+_token_expires_at = 0.0
+_refresh_lock: Optional[asyncio.Lock] = None
+_counters: Dict[str, int] = {"clients_handed_out": 0, "token_refreshes": 0, "requests": 0, "responses_5xx": 0}
+
+
+async def _count_request(request: httpx.Request) -> None:
+    _counters["requests"] += 1
+
+
+async def _count_response(response: httpx.Response) -> None:
+    if response.status_code >= 500:
+        _counters["responses_5xx"] += 1
+
+
+def _new_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT),
+        event_hooks={"request": [_count_request], "response": [_count_response]},
+    )
+
+
+def _token_expiry(token: str) -> float:
+    """Wall-clock expiry of an OIDC token, from its `exp` claim."""
+    try:
+        exp = oidc.decode_oidc_payload(token).get("exp")
+    except Exception:
+        exp = None
+    if isinstance(exp, (int, float)):
+        return float(exp)
+    return time.time() + OIDC_FALLBACK_LIFETIME
+
+
+async def _current_token() -> str:
+    global _token, _token_expires_at, _refresh_lock
+    api_key = os.getenv("AI_GATEWAY_API_KEY")
+    if api_key:
+        return api_key
+    if _token is not None and time.time() < _token_expires_at - OIDC_REFRESH_MARGIN:
+        return _token
+    if _refresh_lock is None:
+        _refresh_lock = asyncio.Lock()
+    async with _refresh_lock:
+        if _token is None or time.time() >= _token_expires_at - OIDC_REFRESH_MARGIN:
+            # May refresh over the network in local development.
+            token = await run_in_threadpool(oidc.get_vercel_oidc_token)
+            _token, _token_expires_at = token, _token_expiry(token)
+            _counters["token_refreshes"] += 1
+    return _token
+
+
+async def get_openai_client() -> AsyncOpenAI:
+    """Return the shared client for the running loop, authenticated with a fresh-enough token."""
+    global _http, _loop, _client
+    loop = asyncio.get_running_loop()
+    if _http is None or _loop is not loop:
+        _http, _loop, _client = _new_http_client(), loop, None
+    token = await _current_token()
+    if _client is None or _client.api_key != token:
+        # Wrapping the same httpx client keeps its pooled connections.
+        base_url = os.getenv("AI_GATEWAY_BASE_URL", DEFAULT_GATEWAY_BASE_URL)
+        _client = AsyncOpenAI(api_key=token, base_url=base_url, http_client=_http)
+    _counters["clients_handed_out"] += 1
+    return _client
+
+
+async def close_client() -> None:
+    global _http, _loop, _client
+    http, _http, _loop, _client = _http, None, None, None
+    if http is not None:
+        await http.aclose()
+
+
+def _pool_stats() -> Dict[str, Any]:
+    # httpcore's pool is not public API; report what it exposes, if anything.
+    pool = getattr(getattr(_http, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {}
+    return {
+        "connections": len(connections),
+        "idle": sum(1 for connection in connections if connection.is_idle()),
+    }
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        **_counters,
+        "token_expires_in": round(_token_expires_at - time.time(), 1) if _token is not None else None,
+        "max_connections": MAX_CONNECTIONS,
+        **_pool_stats(),
+    }
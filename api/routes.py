@@ -1,7 +1,15 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from . import db, services
+from .anthropic_client import Fallback, llm_stats, stream_claude
+from .llm_metrics import metrics
+from .llm_router import LLM_STREAM_BUDGET
+from .utils import disconnect
+from .utils.sse import sse_stats
+from .utils.stream import patch_response_with_headers, stream_llm_result
 from .schemas import (
     SimulateRequest, 
     QueryRequest, 
@@ -24,9 +32,29 @@ def get_db():
         db_session.close()
 
 
+def stream_llm_response(request: Request, result: Dict[str, Any], prompt: str, fallback: Optional[Fallback] = None) -> StreamingResponse:
+    """Stream `result` followed by Claude's output for `prompt` (or `fallback`) as SSE.
+
+    The Claude stream is cancelled if the client disconnects.
+    """
+    response = StreamingResponse(
+        disconnect.cancel_on_disconnect(
+            request,
+            stream_llm_result(result, stream_claude(prompt, fallback=fallback, budget=LLM_STREAM_BUDGET)),
+        ),
+        media_type="text/event-stream",
+    )
+    return patch_response_with_headers(response)
+
+
 @router.post("/simulate-departure")
-def simulate_departure(req: SimulateRequest, dbs: Session = Depends(get_db)):
-    res = services.simulate_departure(dbs, req.person_id)
+async def simulate_departure(req: SimulateRequest, request: Request, stream: bool = Query(False), dbs: Session = Depends(get_db)):
+    if stream:
+        res, prompt = await run_in_threadpool(services.prepare_simulate_departure, dbs, req.person_id)
+        if prompt is None:
+            raise HTTPException(status_code=404, detail=res["error"])
+        return stream_llm_response(request, res, prompt, services.departure_fallback(res))
+    res = await services.asimulate_departure(dbs, req.person_id)
     if "error" in res:
         raise HTTPException(status_code=404, detail=res["error"])
     return res
@@ -41,17 +69,43 @@ def documents_at_risk(recommend: bool = Query(False), dbs: Session = Depends(get
 
 
 @router.post("/query")
-def rag_query(req: QueryRequest, dbs: Session = Depends(get_db)):
-    res = services.rag_answer(dbs, req.question)
+async def rag_query(req: QueryRequest, request: Request, stream: bool = Query(False), dbs: Session = Depends(get_db)):
+    if stream:
+        res, prompt = await run_in_threadpool(services.prepare_rag_answer, dbs, req.question)
+        return stream_llm_response(request, res, prompt, services.rag_fallback(res, req.question))
+    res = await services.arag_answer(dbs, req.question)
     return res
 
 
 @router.post("/recommend-onboarding")
-def recommend_onboarding(req: OnboardingRequest, dbs: Session = Depends(get_db)):
-    out = services.recommend_onboarding(dbs, req.mode, team=req.team, person_leaving=req.person_leaving, person_joining=req.person_joining)
+async def recommend_onboarding(req: OnboardingRequest, request: Request, stream: bool = Query(False), dbs: Session = Depends(get_db)):
+    if stream:
+        prompt, fallback = await run_in_threadpool(services.prepare_recommend_onboarding, dbs, req.mode, req.team, req.person_leaving, req.person_joining)
+        if prompt is None:
+            raise HTTPException(status_code=400, detail="invalid mode")
+        return stream_llm_response(request, {"plan": None}, prompt, fallback)
+    out = await services.arecommend_onboarding(dbs, req.mode, team=req.team, person_leaving=req.person_leaving, person_joining=req.person_joining)
     return {"plan": out}
 
 
+@router.get("/llm/stats")
+def get_llm_stats():
+    """Return Claude response-cache, request-coalescing, rate-limiter and circuit-breaker counters."""
+    return llm_stats()
+
+
+@router.get("/llm/metrics")
+def get_llm_metrics(window: float = Query(300, gt=0)):
+    """Return per-endpoint LLM latency percentiles, token spend and cost over the last `window` seconds."""
+    return metrics.summary(window)
+
+
+@router.get("/llm/streams")
+def get_stream_stats():
+    """Return SSE stream counters, frames/writes/bytes per second and client disconnects for streamed responses."""
+    return {**sse_stats.summary(), "disconnects": disconnect.stats()}
+
+
 @router.get("/topics")
 def list_topics(dbs: Session = Depends(get_db)):
     """List all topics with summary stats."""
@@ -111,9 +165,14 @@ def get_team_contacts(team_name: str, dbs: Session = Depends(get_db)):
 
 
 @router.post("/onboarding/personalized")
-def personalized_onboarding(req: PersonalizedOnboardingRequest, dbs: Session = Depends(get_db)):
+async def personalized_onboarding(req: PersonalizedOnboardingRequest, request: Request, stream: bool = Query(False), dbs: Session = Depends(get_db)):
     """Generate personalized onboarding materials based on team and role."""
-    result = services.personalized_onboarding(dbs, req.team, req.role)
+    if stream:
+        result, prompt = await run_in_threadpool(services.prepare_personalized_onboarding, dbs, req.team, req.role)
+        if prompt is None:
+            raise HTTPException(status_code=404, detail=result["error"])
+        return stream_llm_response(request, result, prompt, services.personalized_onboarding_fallback(result))
+    result = await services.apersonalized_onboarding(dbs, req.team, req.role)
     if isinstance(result, dict) and "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
     return result
@@ -1,9 +1,14 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from starlette.concurrency import run_in_threadpool
 from . import models
-from .anthropic_client import call_claude
+from .anthropic_client import Fallback, Prompt, acall_claude_with_fallback
+from .llm_router import LLM_INTERACTIVE_BUDGET
+
+# Prepended to template output served while Claude is unreachable.
+DEGRADED_NOTE = "Claude is temporarily unavailable, so this was generated from Continuum's data without AI."
 
 
 def compute_topic_stats(db: Session) -> List[Dict[str, Any]]:
@@ -27,14 +32,15 @@ def compute_topic_stats(db: Session) -> List[Dict[str, Any]]:
     return results
 
 
-def simulate_departure(db: Session, person_id: int) -> Dict[str, Any]:
-    """Simulate a person leaving and return affected topics/docs/systems.
+def prepare_simulate_departure(db: Session, person_id: int) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Collect the structural departure impact and build the handoff prompt.
 
-    This is a simplified version suitable for a hackathon prototype.
+    Returns the response dict (with `claude_handoff` still empty) and the
+    prompt to send, or an error dict and None.
     """
     person = db.query(models.Person).filter(models.Person.id == person_id).first()
     if not person:
-        return {"error": "person not found"}
+        return {"error": "person not found"}, None
 
     # Orphaned docs: documents owned only by that person (owner_id == person_id)
     orphaned = db.query(models.Document).filter(models.Document.owner_id == person_id).all()
@@ -62,15 +68,48 @@ def simulate_departure(db: Session, person_id: int) -> Dict[str, Any]:
         f"Orphaned docs:\n{doc_summaries}\n\n"
         "Please produce:\n1) a short handoff summary for the team\n2) cross-training suggestions listing roles/topics to train\n"
     )
-    claude_out = call_claude(prompt)
 
     return {
         "person": {"id": person.id, "name": person.name},
         "orphaned_docs": [{"id": d.id, "title": d.title} for d in orphaned],
         "impacted_topics": impacted_topics,
         "under_documented_systems": under_documented,
-        "claude_handoff": claude_out,
-    }
+        "claude_handoff": None,
+    }, prompt
+
+
+def departure_fallback(res: Dict[str, Any]) -> Fallback:
+    """Template handoff summary built from the structural departure impact."""
+    name = res["person"]["name"]
+    docs = res["orphaned_docs"]
+    topics = res["impacted_topics"]
+    systems = res["under_documented_systems"]
+    lines = [DEGRADED_NOTE, "", f"1) Handoff summary for {name}"]
+    lines.append(f"- {len(docs)} document(s) owned only by {name} need a new owner")
+    lines += [f"  - {d['title']}" for d in docs[:10]]
+    if topics:
+        lines.append(f"- Topics with no other owner: {', '.join(t['name'] for t in topics)}")
+    if systems:
+        lines.append(f"- Systems documented only by {name}: {', '.join(s['name'] for s in systems)}")
+    lines += ["", "2) Cross-training suggestions"]
+    if topics or systems:
+        lines += [f"- Pair a teammate with {name} on {item['name']}" for item in topics + systems]
+    else:
+        lines.append(f"- Walk a teammate through {name}'s documents before they leave")
+    return Fallback(label=f"handoff:{res['person']['id']}", text="\n".join(lines))
+
+
+async def asimulate_departure(db: Session, person_id: int) -> Dict[str, Any]:
+    """Simulate a person leaving and return affected topics/docs/systems.
+
+    This is a simplified version suitable for a hackathon prototype.
+    """
+    res, prompt = await run_in_threadpool(prepare_simulate_departure, db, person_id)
+    if prompt is not None:
+        res["claude_handoff"], degraded = await acall_claude_with_fallback(prompt, departure_fallback(res), budget=LLM_INTERACTIVE_BUDGET)
+        if degraded:
+            res["degraded"] = degraded
+    return res
 
 
 def compute_documents_at_risk(db: Session) -> Dict[str, Any]:
@@ -155,11 +194,11 @@ def select_relevant_docs(db: Session, question: str, k: int = 3):
     return selected
 
 
-def rag_answer(db: Session, question: str) -> Dict[str, Any]:
+def prepare_rag_answer(db: Session, question: str) -> Tuple[Dict[str, Any], str]:
+    """Retrieve documents for `question` and build the answer prompt."""
     docs = select_relevant_docs(db, question, k=3)
     docs_text = "\n\n".join([f"Title: {d.title}\nSummary: {d.summary}\nContent: {d.content[:1000] if d.content else ''}" for d in docs])
     prompt = f"Answer the question using the documents below. Also list people to contact and a short resilience summary.\n\nDocs:\n{docs_text}\n\nQuestion: {question}\n"
-    claude_out = call_claude(prompt)
 
     owners = set()
     for d in docs:
@@ -167,13 +206,34 @@ def rag_answer(db: Session, question: str) -> Dict[str, Any]:
             owners.add(d.owner_id)
 
     return {
-        "answer": claude_out,
+        "answer": None,
         "referenced_docs": [{"id": d.id, "title": d.title} for d in docs],
         "people_to_contact": list(owners),
-    }
+    }, prompt
+
+
+def rag_fallback(res: Dict[str, Any], question: str) -> Fallback:
+    """Template answer pointing at the retrieved documents and their owners."""
+    lines = [DEGRADED_NOTE, "", "The most relevant documents for your question are:"]
+    lines += [f"- {d['title']}" for d in res["referenced_docs"]]
+    if res["people_to_contact"]:
+        lines += ["", f"People to contact (person ids): {', '.join(str(p) for p in res['people_to_contact'])}"]
+    # Template only: questions are free text, so labelling them would keep one
+    # cache entry per distinct question forever.
+    return Fallback(label=None, text="\n".join(lines))
+
 
+async def arag_answer(db: Session, question: str) -> Dict[str, Any]:
+    """Answer a question from the most relevant documents and name who to contact."""
+    res, prompt = await run_in_threadpool(prepare_rag_answer, db, question)
+    res["answer"], degraded = await acall_claude_with_fallback(prompt, rag_fallback(res, question), budget=LLM_INTERACTIVE_BUDGET)
+    if degraded:
+        res["degraded"] = degraded
+    return res
 
-def recommend_onboarding(db: Session, mode: str, team: str = None, person_leaving: int = None, person_joining: int = None) -> str:
+
+def prepare_recommend_onboarding(db: Session, mode: str, team: str = None, person_leaving: int = None, person_joining: int = None) -> Tuple[Optional[Prompt], Optional[Fallback]]:
+    """Build the onboarding/handoff prompt and its template fallback, or (None, None) for an unknown mode."""
     if mode == "team":
         # Try to use team_id if available, otherwise fall back to string matching
         team_obj = db.query(models.Team).filter(models.Team.name == team).first()
@@ -183,20 +243,41 @@ def recommend_onboarding(db: Session, mode: str, team: str = None, person_leavin
             docs = db.query(models.Document).filter(models.Document.team == team).all() if team else db.query(models.Document).all()
         
         doc_list = "\n".join([f"- {d.title}: {d.summary or ''}" for d in docs[:20]])
-        prompt = f"Create a short onboarding plan for team {team}. Use these docs:\n{doc_list}\n"
-        return call_claude(prompt)
+        # The team's documents are identical for every request about this team,
+        # so they go in the cacheable prefix (cached only once it is long enough).
+        return Prompt(
+            prefix=f"You write short onboarding plans for team {team}. Use these docs:\n{doc_list}\n",
+            text=f"Create a short onboarding plan for team {team}.\n",
+        ), Fallback(
+            # Labels must be bounded: only known teams get one.
+            label=f"onboarding-plan:{team_obj.id}" if team_obj else None,
+            text=f"{DEGRADED_NOTE}\n\nOnboarding plan for team {team}: read these documents in order.\n{doc_list}",
+        )
 
     if mode == "handoff":
         leaving = db.query(models.Person).filter(models.Person.id == person_leaving).first()
         joining = db.query(models.Person).filter(models.Person.id == person_joining).first()
         docs = db.query(models.Document).filter(models.Document.owner_id == person_leaving).all()
         doc_list = "\n".join([f"- {d.title}: {d.summary or ''}" for d in docs[:20]])
-        prompt = (
+        return Prompt(
             f"Create a handoff plan from {leaving.name if leaving else 'UNKNOWN'} to {joining.name if joining else 'NEW'} using these docs:\n{doc_list}\n"
+        ), Fallback(
+            label=f"handoff-plan:{leaving.id}:{joining.id}" if leaving and joining else None,
+            text=(
+                f"{DEGRADED_NOTE}\n\nHandoff plan from {leaving.name if leaving else 'UNKNOWN'} to {joining.name if joining else 'NEW'}: "
+                f"walk through each of these documents together.\n{doc_list}"
+            ),
         )
-        return call_claude(prompt)
 
-    return "invalid mode"
+    return None, None
+
+
+async def arecommend_onboarding(db: Session, mode: str, team: str = None, person_leaving: int = None, person_joining: int = None) -> str:
+    """Write a team onboarding plan or a handoff plan between two people."""
+    prompt, fallback = await run_in_threadpool(prepare_recommend_onboarding, db, mode, team, person_leaving, person_joining)
+    if prompt is None:
+        return "invalid mode"
+    return (await acall_claude_with_fallback(prompt, fallback, budget=LLM_INTERACTIVE_BUDGET))[0]
 
 
 ### New read-only helpers for API endpoints
@@ -396,41 +477,8 @@ def get_role_documents(db: Session, role_name: str, team_name: str = None) -> Li
     } for d in docs]
 
 
-def personalized_onboarding(db: Session, team_name: str, role_name: str = None) -> Dict[str, Any]:
-    """Generate personalized onboarding materials based on team and role."""
-    team = db.query(models.Team).filter(models.Team.name == team_name).first()
-    if not team:
-        return {"error": "team not found"}
-    
-    role = None
-    if role_name:
-        role = db.query(models.Role).filter(
-            models.Role.name == role_name,
-            models.Role.team_id == team.id
-        ).first()
-        if not role:
-            return {"error": "role not found for this team"}
-    
-    # Get relevant documents for this team and role
-    query = db.query(models.Document)
-    team_docs = []
-    
-    # Try both team_id and legacy team field
-    team_docs_by_id = query.filter(models.Document.team_id == team.id).all()
-    team_docs_by_name = query.filter(models.Document.team == team.name).all()
-    team_docs = list({doc.id: doc for doc in team_docs_by_id + team_docs_by_name}.values())
-    
-    role_docs = []
-    if role:
-        # Get documents specifically relevant to this role
-        role_docs = db.query(models.Document).join(
-            models.DocumentRole,
-            models.Document.id == models.DocumentRole.document_id
-        ).filter(models.DocumentRole.role_id == role.id).all()
-    
-    # Combine and deduplicate
-    docs = list({doc.id: doc for doc in team_docs + role_docs}.values())
-    
+def _onboarding_contacts(db: Session, team: models.Team, team_name: str, role: Optional[models.Role], role_name: Optional[str], docs: List[models.Document]) -> List[Dict[str, Any]]:
+    """Prioritized people to contact for a team (and optionally a role)."""
     # Get specific people to contact based on team and role
     team_members = db.query(models.Person).filter(
         models.Person.team_id == team.id
@@ -449,7 +497,7 @@ def personalized_onboarding(db: Session, team_name: str, role_name: str = None)
         models.Person.team_id == team.id
     ).order_by(models.Person.id).first()
     
-    # Get document owners
+    # Get document owners (sorted so the contact order is stable between calls)
     doc_owners = set()
     for doc in docs:
         if doc.owner_id:
@@ -484,7 +532,7 @@ def personalized_onboarding(db: Session, team_name: str, role_name: str = None)
             })
     
     # Add document owners
-    for owner in doc_owners:
+    for owner in sorted(doc_owners, key=lambda o: o.id):
         if owner.id != team_lead.id and owner.id not in [e.id for e in role_experts]:  # Avoid duplicates
             contacts.append({
                 "id": len(contacts) + 1,
@@ -524,32 +572,121 @@ def personalized_onboarding(db: Session, team_name: str, role_name: str = None)
                 })
     
     # Sort contacts by priority
-    contacts = sorted(contacts, key=lambda x: x["priority"])
+    return sorted(contacts, key=lambda x: x["priority"])
+
+
+def prepare_personalized_onboarding(db: Session, team_name: str, role_name: str = None) -> Tuple[Dict[str, Any], Optional[Prompt]]:
+    """Gather documents and contacts for a team/role and build the plan prompt.
+
+    The instructions, team documents and team contacts form a cacheable
+    prefix shared by every role in the team; role-specific documents and
+    contacts go in the suffix. A small team's prefix can be shorter than the
+    model's minimum cacheable length, in which case it is sent uncached.
+
+    Returns the response dict (with `plan` still empty) and the prompt to
+    send, or an error dict and None.
+    """
+    team = db.query(models.Team).filter(models.Team.name == team_name).first()
+    if not team:
+        return {"error": "team not found"}, None
     
-    # Generate onboarding plan using Claude
-    doc_list = "\n".join([f"- {d.title}: {d.summary or ''}" for d in docs[:20]])
-    contacts_list = "\n".join([f"- {c['person_name']} ({c['person_role'] or 'N/A'}): {c['contact_reason'] or 'General contact'}" for c in contacts])
+    role = None
+    if role_name:
+        role = db.query(models.Role).filter(
+            models.Role.name == role_name,
+            models.Role.team_id == team.id
+        ).first()
+        if not role:
+            return {"error": "role not found for this team"}, None
     
-    prompt = (
-        f"Create a personalized onboarding plan for someone joining the {team_name} team"
-        f"{f' as a {role_name}' if role_name else ''}.\n\n"
-        f"Key documents:\n{doc_list}\n\n"
-        f"Key contacts:\n{contacts_list or 'No specific contacts defined.'}\n\n"
-        f"Please include:\n"
+    # Get relevant documents for this team and role
+    query = db.query(models.Document)
+    team_docs = []
+    
+    # Try both team_id and legacy team field
+    team_docs_by_id = query.filter(models.Document.team_id == team.id).all()
+    team_docs_by_name = query.filter(models.Document.team == team.name).all()
+    team_docs = list({doc.id: doc for doc in team_docs_by_id + team_docs_by_name}.values())
+    
+    role_docs = []
+    if role:
+        # Get documents specifically relevant to this role
+        role_docs = db.query(models.Document).join(
+            models.DocumentRole,
+            models.Document.id == models.DocumentRole.document_id
+        ).filter(models.DocumentRole.role_id == role.id).all()
+    
+    # Combine and deduplicate
+    docs = list({doc.id: doc for doc in team_docs + role_docs}.values())
+    
+    contacts = _onboarding_contacts(db, team, team_name, role, role_name, docs)
+    # Team-level contacts don't depend on the role, so they can be cached in the prefix
+    team_contacts = _onboarding_contacts(db, team, team_name, None, None, team_docs) if role else contacts
+    
+    # Generate onboarding plan using Claude
+    def format_docs(items):
+        return "\n".join([f"- {d.title}: {d.summary or ''}" for d in items])
+
+    def format_contacts(items):
+        return "\n".join([f"- {c['person_name']} ({c['person_role'] or 'N/A'}): {c['contact_reason'] or 'General contact'}" for c in items])
+
+    team_doc_ids = {d.id for d in team_docs}
+    prefix_docs = [d for d in docs if d.id in team_doc_ids][:20]
+    role_only_docs = [d for d in docs if d.id not in team_doc_ids][:max(0, 20 - len(prefix_docs))]
+    team_contact_ids = {c["person_id"] for c in team_contacts}
+    role_contacts = [c for c in contacts if c["person_id"] not in team_contact_ids]
+
+    prefix = (
+        f"You write personalized onboarding plans for people joining the {team_name} team.\n\n"
+        f"Key documents:\n{format_docs(prefix_docs)}\n\n"
+        f"Key contacts:\n{format_contacts(team_contacts) or 'No specific contacts defined.'}\n\n"
+        f"Every plan should include:\n"
         f"1. A prioritized reading list with rationale\n"
-        f"2. Who to contact for specific questions (use the specific people listed above)\n"
+        f"2. Who to contact for specific questions (use the specific people listed)\n"
         f"3. First week, first month, and first quarter milestones\n"
     )
-    
-    claude_out = call_claude(prompt)
+    text = f"Create a personalized onboarding plan for someone joining the {team_name} team{f' as a {role_name}' if role_name else ''}.\n"
+    if role_only_docs:
+        text += f"\nAdditional documents for this role:\n{format_docs(role_only_docs)}\n"
+    if role_contacts:
+        text += f"\nAdditional contacts for this role:\n{format_contacts(role_contacts)}\n"
+    prompt = Prompt(text=text, prefix=prefix)
     
     return {
         "team": team_name,
         "role": role_name,
-        "plan": claude_out,
+        "plan": None,
         "relevant_docs": [{
             "id": d.id,
             "title": d.title
         } for d in docs],
         "key_contacts": contacts
-    }
+    }, prompt
+
+
+def personalized_onboarding_fallback(res: Dict[str, Any]) -> Fallback:
+    """Template onboarding plan built from the gathered documents and contacts."""
+    joining = f"the {res['team']} team" + (f" as a {res['role']}" if res["role"] else "")
+    lines = [DEGRADED_NOTE, "", f"Onboarding plan for joining {joining}", "", "1. Reading list"]
+    lines += [f"- {d['title']}" for d in res["relevant_docs"][:10]]
+    lines += ["", "2. Who to contact"]
+    lines += [f"- {c['person_name']} ({c['person_role'] or 'N/A'}): {c['contact_reason'] or 'General contact'}" for c in res["key_contacts"][:5]]
+    lines += [
+        "",
+        "3. Milestones",
+        "- First week: meet your contacts and read the first documents above",
+        "- First month: finish the reading list and take on a first task with a contact's help",
+        "- First quarter: own a topic from the reading list end to end",
+    ]
+    return Fallback(label=f"onboarding:{res['team']}:{res['role'] or 'any'}", text="\n".join(lines))
+
+
+async def apersonalized_onboarding(db: Session, team_name: str, role_name: str = None) -> Dict[str, Any]:
+    """Generate personalized onboarding materials based on team and role."""
+    res, prompt = await run_in_threadpool(prepare_personalized_onboarding, db, team_name, role_name)
+    if prompt is not None:
+        res["plan"], degraded = await acall_claude_with_fallback(prompt, personalized_onboarding_fallback(res), budget=LLM_INTERACTIVE_BUDGET)
+        if degraded:
+            res["degraded"] = degraded
+    return res
+
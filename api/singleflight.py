@@ -0,0 +1,41 @@
+"""Coalesce concurrent identical async calls into a single upstream call."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Share one in-flight call between all concurrent callers with the same key.
+
+    The first caller for a key (the leader) starts the work as a task; callers
+    arriving while it runs await the same task and receive its result or
+    exception. The task is shielded so a cancelled caller does not cancel the
+    call for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.deduplicated = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.deduplicated += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.leaders,
+            "deduplicated": self.deduplicated,
+        }
@@ -0,0 +1,223 @@
+"""Keep `/api/chat` requests within a token budget.
+
+Before a completion is requested the history is compacted:
+
+1. Tool outputs outside the newest `CHAT_KEEP_RECENT_TURNS` turns that are
+   larger than `CHAT_TOOL_OUTPUT_TOKENS` are replaced by a short structural
+   summary (scalars kept, long lists cut, deep objects elided). Summaries are
+   cached by content, so a long conversation does not re-summarize the same
+   output on every turn.
+2. If the request is still over `CHAT_CONTEXT_BUDGET` tokens, whole turns are
+   dropped oldest first (a turn is a user message and everything after it, so
+   tool calls stay paired with their results) and a system note says how many
+   messages were left out. Leading system messages are always kept.
+3. As a last resort the same happens to the older of the recent turns; the
+   newest turn is always sent intact.
+
+Tokens are estimated locally: with `tiktoken` when it is installed, otherwise
+~4 characters per token, like the Claude limiter's estimate. tiktoken counts
+are cached by a digest of the text, so the large strings compaction targets
+are not kept alive, and callers run `compact_messages` off the event loop
+when `uses_tokenizer()` says counting is that expensive.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # optional, for exact counts
+    tiktoken = None
+
+CHAT_CONTEXT_BUDGET = int(os.getenv("CHAT_CONTEXT_BUDGET", "24000"))
+CHAT_KEEP_RECENT_TURNS = int(os.getenv("CHAT_KEEP_RECENT_TURNS", "4"))
+CHAT_TOOL_OUTPUT_TOKENS = int(os.getenv("CHAT_TOOL_OUTPUT_TOKENS", "200"))
+
+# Per-message framing overhead in the chat format, and a flat cost per image.
+MESSAGE_OVERHEAD_TOKENS = 4
+IMAGE_TOKENS = 765
+SUMMARY_CACHE_SIZE = 1024
+TOKEN_CACHE_SIZE = 4096
+# Lists longer than this are cut in summaries; objects deeper than this are elided.
+SUMMARY_LIST_ITEMS = 3
+SUMMARY_MAX_DEPTH = 3
+
+_encoding = None
+if tiktoken is not None:
+    try:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:  # encoding files unavailable offline
+        _encoding = None
+
+_summaries: "OrderedDict[str, str]" = OrderedDict()
+# Text digest -> tiktoken count.
+_token_counts: "OrderedDict[bytes, int]" = OrderedDict()
+# Compaction may run in worker threads; guards both caches.
+_lock = threading.Lock()
+_counters: Dict[str, int] = {
+    "requests": 0,
+    "compacted": 0,
+    "tool_outputs_summarized": 0,
+    "summary_cache_hits": 0,
+    "messages_dropped": 0,
+    "tokens_saved": 0,
+}
+
+
+def uses_tokenizer() -> bool:
+    """Whether counts come from tiktoken rather than the length of the text."""
+    return _encoding is not None
+
+
+def estimate_text_tokens(text: str) -> int:
+    if _encoding is None:
+        return len(text) // 4 + 1
+    key = hashlib.sha1(text.encode("utf-8")).digest()
+    with _lock:
+        tokens = _token_counts.get(key)
+        if tokens is not None:
+            _token_counts.move_to_end(key)
+            return tokens
+    tokens = len(_encoding.encode(text, disallowed_special=()))
+    with _lock:
+        _token_counts[key] = tokens
+        while len(_token_counts) > TOKEN_CACHE_SIZE:
+            _token_counts.popitem(last=False)
+    return tokens
+
+
+def estimate_message_tokens(message: Dict[str, Any]) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS
+    content = message.get("content")
+    if isinstance(content, str):
+        tokens += estimate_text_tokens(content)
+    elif isinstance(content, list):
+        for part in content:
+            if part.get("type") == "text":
+                tokens += estimate_text_tokens(part.get("text") or "")
+            else:
+                tokens += IMAGE_TOKENS
+    for call in message.get("tool_calls") or ():
+        function = call.get("function") or {}
+        tokens += estimate_text_tokens(function.get("name") or "") + estimate_text_tokens(function.get("arguments") or "")
+    return tokens
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    return sum(estimate_message_tokens(message) for message in messages)
+
+
+def _brief(value: Any, depth: int = 0) -> Any:
+    """A smaller copy of a JSON value that keeps its shape and scalar fields."""
+    if isinstance(value, dict):
+        if depth >= SUMMARY_MAX_DEPTH:
+            return f"{{{len(value)} fields}}"
+        return {key: _brief(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [_brief(item, depth + 1) for item in value[:SUMMARY_LIST_ITEMS]]
+        if len(value) > SUMMARY_LIST_ITEMS:
+            items.append(f"... {len(value) - SUMMARY_LIST_ITEMS} more")
+        return items
+    if isinstance(value, str) and len(value) > 200:
+        return value[:200] + "..."
+    return value
+
+
+def summarize_tool_output(content: str, max_tokens: int = CHAT_TOOL_OUTPUT_TOKENS) -> str:
+    """Short stand-in for a large tool result, cached by content."""
+    key = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    with _lock:
+        summary = _summaries.get(key)
+        if summary is not None:
+            _counters["summary_cache_hits"] += 1
+            _summaries.move_to_end(key)
+            return summary
+    try:
+        brief = json.dumps(_brief(json.loads(content)), separators=(",", ":"))
+    except ValueError:
+        brief = content
+    limit = max_tokens * 4
+    if len(brief) > limit:
+        brief = brief[:limit] + "..."
+    summary = f"[summary of an earlier tool result] {brief}"
+    with _lock:
+        _summaries[key] = summary
+        while len(_summaries) > SUMMARY_CACHE_SIZE:
+            _summaries.popitem(last=False)
+    return summary
+
+
+def _summarize_tool_outputs(turn: List[Dict[str, Any]], max_tokens: int) -> List[Dict[str, Any]]:
+    out = []
+    for message in turn:
+        content = message.get("content")
+        if message.get("role") == "tool" and isinstance(content, str) and estimate_text_tokens(content) > max_tokens:
+            message = {**message, "content": summarize_tool_output(content, max_tokens)}
+            _counters["tool_outputs_summarized"] += 1
+        out.append(message)
+    return out
+
+
+def compact_messages(
+    messages: List[Dict[str, Any]],
+    budget: Optional[int] = None,
+    keep_turns: Optional[int] = None,
+    tool_output_tokens: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Return `messages` shrunk to fit `budget` tokens; the input list and its messages are not modified."""
+    budget = CHAT_CONTEXT_BUDGET if budget is None else budget
+    keep_turns = max(1, CHAT_KEEP_RECENT_TURNS if keep_turns is None else keep_turns)
+    tool_output_tokens = CHAT_TOOL_OUTPUT_TOKENS if tool_output_tokens is None else tool_output_tokens
+    _counters["requests"] += 1
+
+    head: List[Dict[str, Any]] = []
+    turns: List[List[Dict[str, Any]]] = []
+    for message in messages:
+        if not turns and message.get("role") == "system":
+            head.append(message)
+            continue
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+
+    old, recent = turns[:-keep_turns], turns[-keep_turns:]
+    old = [_summarize_tool_outputs(turn, tool_output_tokens) for turn in old]
+    sizes = [estimate_tokens(turn) for turn in old + recent]
+    total = estimate_tokens(head) + sum(sizes)
+    original = estimate_tokens(messages)
+
+    dropped = 0
+    while old and total > budget:
+        dropped += len(old.pop(0))
+        total -= sizes.pop(0)
+    if total > budget and len(recent) > 1:
+        recent = [_summarize_tool_outputs(turn, tool_output_tokens) for turn in recent[:-1]] + recent[-1:]
+        sizes = [estimate_tokens(turn) for turn in recent]
+        total = estimate_tokens(head) + sum(sizes)
+        while len(recent) > 1 and total > budget:
+            dropped += len(recent.pop(0))
+            total -= sizes.pop(0)
+
+    if dropped:
+        head = head + [{"role": "system", "content": f"{dropped} earlier messages of this conversation were omitted to fit the context window."}]
+        _counters["messages_dropped"] += dropped
+    compacted = head + [message for turn in old + recent for message in turn]
+    saved = original - estimate_tokens(compacted)
+    if saved > 0:
+        _counters["compacted"] += 1
+        _counters["tokens_saved"] += saved
+    return compacted
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        **_counters,
+        "cached_summaries": len(_summaries),
+        "cached_token_counts": len(_token_counts),
+        "tokenizer": "tiktoken" if uses_tokenizer() else "chars/4",
+        "budget": CHAT_CONTEXT_BUDGET,
+    }
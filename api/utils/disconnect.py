@@ -0,0 +1,115 @@
+"""Stop streaming work as soon as the client goes away.
+
+Starlette notices a disconnect either only on its next write (ASGI spec 2.4)
+or by cancelling the response from a task group, which leaves the body
+generator suspended and re-cancels every `await` in its cleanup (spec 2.3).
+Either way a closed tab could keep an upstream completion and its tools
+running, or skip closing them properly.
+
+`cancel_on_disconnect` watches the ASGI receive channel itself and runs each
+step of the stream in a task; on `http.disconnect` that task is cancelled, so
+the stream's own cleanup runs normally: the upstream response is closed,
+pending tool calls are cancelled and the call is recorded in `llm_metrics`.
+
+Streams report how they ended with `record_finished` / `record_cancelled`.
+`stats()` counts cancelled streams and estimates the output tokens they did
+not generate from the mean output of finished streams of the same kind.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from starlette.requests import Request
+from starlette.types import Receive
+
+# Cleanup of cancelled streams still running; referenced so it is not collected.
+_cleanup: Set[asyncio.Future] = set()
+_counters: Dict[str, int] = {"disconnects": 0}
+# Per stream kind: finished, finished_tokens, cancelled, tokens_before_cancel, estimated_tokens_saved.
+_kinds: Dict[str, Dict[str, int]] = {}
+
+
+def _kind(kind: str) -> Dict[str, int]:
+    counts = _kinds.get(kind)
+    if counts is None:
+        counts = _kinds[kind] = dict.fromkeys(
+            ("finished", "finished_tokens", "cancelled", "tokens_before_cancel", "estimated_tokens_saved"), 0
+        )
+    return counts
+
+
+def record_finished(kind: str, output_tokens: int) -> None:
+    counts = _kind(kind)
+    counts["finished"] += 1
+    counts["finished_tokens"] += output_tokens
+
+
+def record_cancelled(kind: str, output_tokens: int) -> None:
+    """Record a stream stopped after generating `output_tokens`."""
+    counts = _kind(kind)
+    counts["cancelled"] += 1
+    counts["tokens_before_cancel"] += output_tokens
+    if counts["finished"]:
+        expected = counts["finished_tokens"] / counts["finished"]
+        counts["estimated_tokens_saved"] += max(0, round(expected - output_tokens))
+
+
+async def _wait_for_disconnect(receive: Receive) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+def _finish_in_background(future: asyncio.Future) -> None:
+    _cleanup.add(future)
+    future.add_done_callback(_cleanup.discard)
+
+
+async def cancel_on_disconnect(request: Request, frames: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Pass `frames` through until the client disconnects, then cancel the stream.
+
+    The request body must already have been read.
+    """
+    iterator = frames.__aiter__()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(request.receive))
+    next_frame: Optional[asyncio.Future] = None
+    try:
+        while True:
+            next_frame = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({next_frame, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_frame.done():
+                return
+            frame_task, next_frame = next_frame, None
+            try:
+                frame = frame_task.result()
+            except StopAsyncIteration:
+                return
+            yield frame
+    finally:
+        disconnected.cancel()
+        # No awaiting here: the server may be cancelling this generator too.
+        if next_frame is not None:
+            # Disconnect seen here or by the server, mid-step.
+            _counters["disconnects"] += 1
+            next_frame.cancel()
+            _finish_in_background(next_frame)
+        else:
+            _finish_in_background(asyncio.ensure_future(iterator.aclose()))
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        **_counters,
+        "cleaning_up": len(_cleanup),
+        "streams": {
+            kind: {
+                "finished": counts["finished"],
+                "cancelled": counts["cancelled"],
+                "mean_output_tokens": round(counts["finished_tokens"] / counts["finished"], 1) if counts["finished"] else None,
+                "tokens_before_cancel": counts["tokens_before_cancel"],
+                "estimated_tokens_saved": counts["estimated_tokens_saved"],
+            }
+            for kind, counts in _kinds.items()
+        },
+    }
@@ -0,0 +1,202 @@
+"""Resumable `/api/chat` streams.
+
+The frames of each chat turn are kept in memory under the turn's `messageId`,
+each with an SSE `id:`, so a client whose connection dropped can reconnect to
+`GET /api/chat/{messageId}/stream` with `Last-Event-ID` and receive the frames
+it missed followed by the rest of the answer, instead of paying for a new
+completion. Without `Last-Event-ID` the whole turn is replayed.
+
+A turn is produced by a background task writing into its `ReplayLog`;
+responses only follow the log. When the last follower disconnects the turn
+keeps generating for `REPLAY_RESUME_GRACE` seconds, then it is cancelled
+like any abandoned stream (see `disconnect`). A cancelled turn ends its log
+with an `error` part, so a later resume cannot mistake it for a complete
+answer.
+
+Memory is bounded three ways: a log keeps only its newest
+`REPLAY_MAX_MESSAGE_BYTES` of frames (a ring; resuming from before them fails
+with 410), logs of finished turns expire `REPLAY_TTL` seconds after they end,
+and at most `REPLAY_MAX_MESSAGES` logs are kept, least recently used first out.
+"""
+
+import asyncio
+import itertools
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from .sse import DONE_FRAME, format_sse
+
+REPLAY_ENABLED = os.getenv("REPLAY_ENABLED", "1") != "0"
+REPLAY_TTL = float(os.getenv("REPLAY_TTL", "300"))
+REPLAY_MAX_MESSAGES = int(os.getenv("REPLAY_MAX_MESSAGES", "256"))
+REPLAY_MAX_MESSAGE_BYTES = int(os.getenv("REPLAY_MAX_MESSAGE_BYTES", str(512 * 1024)))
+REPLAY_RESUME_GRACE = float(os.getenv("REPLAY_RESUME_GRACE", "10"))
+
+
+class ReplayLog:
+    """Numbered SSE frames of one streamed message and the task producing them.
+
+    Event loop only.
+    """
+
+    def __init__(self, message_id: str, max_bytes: int = REPLAY_MAX_MESSAGE_BYTES, grace: float = REPLAY_RESUME_GRACE):
+        self.message_id = message_id
+        self.max_bytes = max_bytes
+        self.grace = grace
+        self.frames: Deque[str] = deque()
+        # Event ID of frames[0] and of the newest frame; IDs start at 1.
+        self.first_id = 1
+        self.last_id = 0
+        self.bytes = 0
+        self.finished_at: Optional[float] = None
+        self.error: Optional[Exception] = None
+        self.cancelled = False
+        self.followers = 0
+        self.task: Optional[asyncio.Future] = None
+        self._changed = asyncio.Event()
+        self._grace_timer: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def append(self, chunk: str) -> None:
+        """Add the frames of a written chunk, dropping the oldest ones beyond `max_bytes`."""
+        # Frames never contain a blank line: payloads are single-line JSON.
+        for frame in chunk.split("\n\n")[:-1]:
+            self.last_id += 1
+            frame = f"id: {self.last_id}\n{frame}\n\n"
+            self.frames.append(frame)
+            self.bytes += len(frame)
+        while self.bytes > self.max_bytes and len(self.frames) > 1:
+            self.bytes -= len(self.frames.popleft())
+            self.first_id += 1
+        self._wake()
+
+    def _wake(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _finish(self, error: Optional[Exception] = None) -> None:
+        self.finished_at = time.monotonic()
+        self.error = error
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+        self._wake()
+
+    async def produce(self, frames: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in frames:
+                self.append(chunk)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            self.append(format_sse({"type": "error", "errorText": "Stream cancelled before it finished"}) + DONE_FRAME)
+            self._finish()
+            raise
+        except Exception as error:
+            # Already logged by the stream; followers re-raise it.
+            self._finish(error)
+        else:
+            self._finish()
+
+    def retains(self, after: int) -> bool:
+        """Whether every frame after event ID `after` is still in the log."""
+        return after >= self.first_id - 1
+
+    def since(self, after: int) -> List[str]:
+        return list(itertools.islice(self.frames, max(0, after - self.first_id + 1), None))
+
+    async def follow(self, after: int = 0) -> AsyncIterator[str]:
+        """Yield the frames after event ID `after`, then new ones as they are produced."""
+        self._attach()
+        try:
+            while True:
+                changed = self._changed
+                if not self.retains(after):
+                    raise RuntimeError(f"replay of {self.message_id} fell behind its buffer")
+                frames = self.since(after)
+                if frames:
+                    after = self.last_id
+                    yield "".join(frames)
+                elif self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await changed.wait()
+        finally:
+            self._detach()
+
+    def _attach(self) -> None:
+        self.followers += 1
+        if self._grace_timer is not None:
+            self._grace_timer.cancel()
+            self._grace_timer = None
+
+    def _detach(self) -> None:
+        self.followers -= 1
+        if self.followers == 0 and not self.finished and self.task is not None:
+            self._grace_timer = asyncio.get_running_loop().call_later(self.grace, self._cancel_unattended)
+
+    def _cancel_unattended(self) -> None:
+        self._grace_timer = None
+        if self.followers == 0 and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+class ReplayBuffer:
+    """Replay logs by message ID, with a TTL for finished turns and LRU eviction."""
+
+    def __init__(self, max_messages: int = REPLAY_MAX_MESSAGES, ttl: float = REPLAY_TTL):
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self._logs: "OrderedDict[str, ReplayLog]" = OrderedDict()
+        self._counters: Dict[str, int] = {"started": 0, "resumed": 0, "resume_misses": 0, "expired": 0, "evicted": 0}
+
+    def start(self, message_id: str, frames: AsyncIterator[str]) -> ReplayLog:
+        """Produce `frames` into a new log in the background and return the log."""
+        self._expire()
+        log = ReplayLog(message_id)
+        log.task = asyncio.ensure_future(log.produce(frames))
+        self._logs[message_id] = log
+        self._counters["started"] += 1
+        while len(self._logs) > self.max_messages:
+            # Prefer finished turns; a live one keeps streaming to its followers.
+            victim = next((key for key, other in self._logs.items() if other.finished), None)
+            if victim is None:
+                victim = next(iter(self._logs))
+            del self._logs[victim]
+            self._counters["evicted"] += 1
+        return log
+
+    def get(self, message_id: str) -> Optional[ReplayLog]:
+        self._expire()
+        log = self._logs.get(message_id)
+        if log is None:
+            self._counters["resume_misses"] += 1
+            return None
+        self._counters["resumed"] += 1
+        self._logs.move_to_end(message_id)
+        return log
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl
+        expired = [key for key, log in self._logs.items() if log.finished and log.finished_at < cutoff]
+        for key in expired:
+            del self._logs[key]
+        self._counters["expired"] += len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._counters,
+            "messages": len(self._logs),
+            "live": sum(1 for log in self._logs.values() if not log.finished),
+            "cancelled": sum(1 for log in self._logs.values() if log.cancelled),
+            "bytes": sum(log.bytes for log in self._logs.values()),
+        }
+
+
+replay_buffer = ReplayBuffer()
@@ -0,0 +1,255 @@
+"""Coalescing Server-Sent Events writer for the UI message stream protocol.
+
+Writing one `data:` frame per token makes per-frame work (JSON encoding, a
+send per frame) dominate once many streams run at once. `SSEWriter` buffers
+frames and hands them out in one write when `SSE_COALESCE_BYTES` are pending
+or the oldest pending frame is `SSE_COALESCE_MS` old. Consecutive deltas for
+the same text or tool input are merged into a single delta frame, which the
+AI SDK client treats the same as the individual ones. `SSE_COALESCE_MS=0`
+writes every frame on its own, as before.
+
+JSON is encoded with orjson when it is installed, and delta frames are built
+from pre-encoded prefixes so only the delta text itself is serialized.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple, TypeVar
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "16"))
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "4096"))
+# Seconds of history kept for the frames/sec and bytes/sec rates.
+SSE_STATS_WINDOW = 60
+
+DONE_FRAME = "data: [DONE]\n\n"
+
+T = TypeVar("T")
+
+
+def dumps(payload: Any) -> str:
+    """Compact JSON for an SSE frame."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; let json handle or reject it
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def format_sse(payload: dict) -> str:
+    return f"data: {dumps(payload)}\n\n"
+
+
+# Delta frame types and the names of their id and text fields.
+_DELTA_FIELDS = {
+    "text-delta": ("id", "delta"),
+    "tool-input-delta": ("toolCallId", "inputTextDelta"),
+}
+
+
+class SSEStats:
+    """Frame, write and byte counts for all streams, with per-second rates.
+
+    Not thread-safe: writers are only used from the event loop.
+    """
+
+    def __init__(self, window: int = SSE_STATS_WINDOW):
+        self.window = window
+        self.streams = 0
+        self.active = 0
+        self.deltas = 0
+        self.delta_frames = 0
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+        # (second, frames, writes, bytes) per second with traffic.
+        self._seconds: Deque[List[int]] = deque()
+
+    def record_write(self, frames: int, deltas: int, delta_frames: int, size: int) -> None:
+        self.frames += frames
+        self.deltas += deltas
+        self.delta_frames += delta_frames
+        self.writes += 1
+        self.bytes += size
+        now = int(time.monotonic())
+        if not self._seconds or self._seconds[-1][0] != now:
+            self._seconds.append([now, 0, 0, 0])
+            while self._seconds[0][0] <= now - self.window:
+                self._seconds.popleft()
+        second = self._seconds[-1]
+        second[1] += frames
+        second[2] += 1
+        second[3] += size
+
+    def summary(self) -> Dict[str, Any]:
+        oldest = int(time.monotonic()) - self.window
+        recent = [s for s in self._seconds if s[0] > oldest]
+        return {
+            "streams": self.streams,
+            "active": self.active,
+            "frames": self.frames,
+            "writes": self.writes,
+            "bytes": self.bytes,
+            # Deltas received per delta frame sent.
+            "coalescing_ratio": round(self.deltas / self.delta_frames, 2) if self.delta_frames else None,
+            "frames_per_sec": round(sum(s[1] for s in recent) / self.window, 1),
+            "writes_per_sec": round(sum(s[2] for s in recent) / self.window, 1),
+            "bytes_per_sec": round(sum(s[3] for s in recent) / self.window, 1),
+        }
+
+
+sse_stats = SSEStats()
+
+
+class SSEWriter:
+    """Buffers the frames of one stream; `flush()` returns them as one chunk.
+
+    Callers add frames with `event`/`delta` and write `flush()` whenever
+    `ready()` is true, on the ticks from `with_flush_ticks`, and at the end.
+    """
+
+    def __init__(self, max_delay_ms: float = SSE_COALESCE_MS, max_bytes: int = SSE_COALESCE_BYTES, stats: SSEStats = sse_stats):
+        self.max_delay = max_delay_ms / 1000
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self._frames: List[str] = []
+        self._size = 0
+        self._since: Optional[float] = None
+        # Delta being merged: (type, id), its pre-encoded prefix and the text parts.
+        self._delta_key: Optional[Tuple[str, str]] = None
+        self._delta_prefix = ""
+        self._delta_parts: List[str] = []
+        self._prefixes: Dict[Tuple[str, str], str] = {}
+        self._frame_count = 0
+        self._delta_count = 0
+        self._delta_frames = 0
+        self._closed = False
+        stats.streams += 1
+        stats.active += 1
+
+    @property
+    def pending(self) -> bool:
+        return self._since is not None
+
+    def _touch(self, size: int) -> None:
+        self._size += size
+        if self._since is None:
+            self._since = time.monotonic()
+
+    def _end_delta(self) -> None:
+        if self._delta_key is None:
+            return
+        self._frames.append(f"{self._delta_prefix}{dumps(''.join(self._delta_parts))}}}\n\n")
+        self._frame_count += 1
+        self._delta_frames += 1
+        self._delta_key = None
+        self._delta_parts = []
+
+    def delta(self, type_: str, id_: str, text: str) -> None:
+        """Add a `text-delta` or `tool-input-delta`, merged with the previous one if it continues it."""
+        key = (type_, id_)
+        if key != self._delta_key:
+            self._end_delta()
+            prefix = self._prefixes.get(key)
+            if prefix is None:
+                id_field, text_field = _DELTA_FIELDS[type_]
+                prefix = self._prefixes[key] = f'data: {{"type":"{type_}","{id_field}":{dumps(id_)},"{text_field}":'
+            self._delta_key = key
+            self._delta_prefix = prefix
+        self._delta_parts.append(text)
+        self._delta_count += 1
+        self._touch(len(text))
+
+    def event(self, payload: Dict[str, Any]) -> None:
+        """Add any other frame; delta payloads are routed to `delta`."""
+        fields = _DELTA_FIELDS.get(payload.get("type"))
+        if fields is not None and len(payload) == 3:
+            self.delta(payload["type"], payload[fields[0]], payload[fields[1]])
+            return
+        self._end_delta()
+        frame = format_sse(payload)
+        self._frames.append(frame)
+        self._frame_count += 1
+        self._touch(len(frame))
+
+    def done(self) -> None:
+        self._end_delta()
+        self._frames.append(DONE_FRAME)
+        self._frame_count += 1
+        self._touch(len(DONE_FRAME))
+
+    def due(self) -> Optional[float]:
+        """Seconds until pending frames must be written, or None if nothing is pending."""
+        if self._since is None:
+            return None
+        return max(0.0, self._since + self.max_delay - time.monotonic())
+
+    def ready(self) -> bool:
+        return self._since is not None and (self._size >= self.max_bytes or self.due() == 0.0)
+
+    def flush(self) -> str:
+        self._end_delta()
+        chunk = "".join(self._frames)
+        if chunk:
+            self.stats.record_write(self._frame_count, self._delta_count, self._delta_frames, len(chunk))
+        self._frames = []
+        self._size = 0
+        self._since = None
+        self._frame_count = 0
+        self._delta_count = 0
+        self._delta_frames = 0
+        return chunk
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.stats.active -= 1
+
+
+async def with_flush_ticks(source: AsyncIterator[T], writer: SSEWriter) -> AsyncIterator[Optional[T]]:
+    """Iterate `source`, yielding None whenever `writer` has frames due while it waits.
+
+    The pending `__anext__` is not cancelled on a tick, so no upstream data
+    is lost while the caller writes.
+    """
+    iterator = source.__aiter__()
+    next_item: Optional[asyncio.Future] = None
+    try:
+        while True:
+            wait = writer.due()
+            if next_item is None and wait is None:
+                # Nothing to flush: no need to wait on the item in a task.
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                yield item
+                continue
+            if next_item is None:
+                next_item = asyncio.ensure_future(iterator.__anext__())
+            if wait is not None and not next_item.done():
+                done, _ = await asyncio.wait({next_item}, timeout=wait)
+                if not done:
+                    yield None
+                    continue
+            try:
+                item = await next_item
+            except StopAsyncIteration:
+                return
+            finally:
+                if next_item.done():
+                    next_item = None
+            yield item
+    finally:
+        if next_item is not None:
+            next_item.cancel()
+            # Let the cancellation finish before the source is closed.
+            await asyncio.wait({next_item})
@@ -1,46 +1,211 @@
+import asyncio
+import inspect
 import json
+import os
+import time
 import traceback
 import uuid
-from typing import Any, Callable, Dict, Mapping, Sequence
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Mapping, Optional, Sequence, Tuple
 
 from fastapi.responses import StreamingResponse
-from openai import OpenAI
+from openai import AsyncOpenAI
+from starlette.concurrency import run_in_threadpool
 from openai.types.chat.chat_completion_message_param import ChatCompletionMessageParam
 
+from ..llm_metrics import metrics
+from . import disconnect
+from .sse import SSEWriter, with_flush_ticks
 
-def stream_text(
-    client: OpenAI,
+# Seconds a tool call may take; a tool function can override it with a
+# `timeout` attribute.
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "15"))
+
+
+async def run_tool(name: str, tool_function: Callable[..., Any], arguments: Dict[str, Any]) -> Any:
+    """Run one tool call with its timeout.
+
+    Coroutine functions are awaited on the event loop; plain functions run in
+    the threadpool. A timed-out threadpool call is abandoned, not stopped.
+    """
+    timeout = getattr(tool_function, "timeout", TOOL_TIMEOUT)
+    if inspect.iscoroutinefunction(tool_function):
+        call = tool_function(**arguments)
+    else:
+        call = run_in_threadpool(tool_function, **arguments)
+    try:
+        return await asyncio.wait_for(call, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Tool '{name}' timed out after {timeout:g}s.") from None
+
+
+class _Step:
+    """What one completion in a `stream_text` turn produced."""
+
+    def __init__(self):
+        self.finish_reason: Optional[str] = None
+        self.usage: Any = None
+        self.text: List[str] = []
+        # (id, name, raw arguments) of the tool calls, in index order.
+        self.tool_calls: List[Tuple[str, str, str]] = []
+        # Tool call id -> result (or error) text to send back to the model.
+        self.tool_results: Dict[str, str] = {}
+
+    def follow_up_messages(self) -> List[Dict[str, Any]]:
+        """The assistant tool-call message and tool results for the next completion."""
+        assistant = {
+            "role": "assistant",
+            "content": "".join(self.text) or None,
+            "tool_calls": [
+                {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+                for call_id, name, arguments in self.tool_calls
+            ],
+        }
+        results = [
+            {"role": "tool", "tool_call_id": call_id, "content": self.tool_results.get(call_id, "")}
+            for call_id, _, _ in self.tool_calls
+        ]
+        return [assistant, *results]
+
+    def messages(self) -> List[Dict[str, Any]]:
+        """This step's output as OpenAI chat messages, for the conversation history."""
+        if self.tool_calls:
+            return self.follow_up_messages()
+        return [{"role": "assistant", "content": "".join(self.text)}]
+
+    def output_tokens(self) -> int:
+        if self.usage is not None:
+            return self.usage.completion_tokens
+        # Usage arrives last; estimate what was generated so far.
+        return (sum(map(len, self.text)) + sum(len(arguments) for _, _, arguments in self.tool_calls)) // 4
+
+
+async def stream_text(
+    client: AsyncOpenAI,
     messages: Sequence[ChatCompletionMessageParam],
     tool_definitions: Sequence[Dict[str, Any]],
     available_tools: Mapping[str, Callable[..., Any]],
     protocol: str = "data",
-):
-    """Yield Server-Sent Events for a streaming chat completion."""
+    max_steps: int = 1,
+    on_finish: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+    message_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Yield Server-Sent Events for a streaming chat completion.
+
+    Runs on the event loop; only blocking tool functions are moved to the
+    threadpool.
+
+    With `max_steps` > 1, tool results are fed straight back to the model and
+    its follow-up is streamed in the same response (each completion framed by
+    `start-step`/`finish-step`), until it answers without tools or the step
+    limit is reached.
+
+    Each completion is recorded in `llm_metrics` (time to first chunk, time
+    until the upstream stream ends, token usage); tool execution is not
+    counted as LLM time.
+
+    `on_finish`, if given, is awaited with the messages the turn added (assistant
+    replies and tool results) once the whole turn has streamed successfully.
+    A cancelled turn (client gone) calls nothing and is counted in `disconnect`.
+
+    `message_id` is sent in the `start` part; a new one is generated if omitted.
+    """
+    writer = SSEWriter()
+    messages = list(messages)
+    steps: List[_Step] = []
     try:
-        def format_sse(payload: dict) -> str:
-            return f"data: {json.dumps(payload, separators=(',', ':'))}\n\n"
+        writer.event({"type": "start", "messageId": message_id or f"msg-{uuid.uuid4().hex}"})
+        yield writer.flush()
+
+        for number in range(1, max_steps + 1):
+            step = _Step()
+            steps.append(step)
+            if max_steps > 1:
+                writer.event({"type": "start-step"})
+            async for frames in _stream_step(client, messages, tool_definitions, available_tools, writer, step, f"text-{number}"):
+                yield frames
+            if max_steps > 1:
+                writer.event({"type": "finish-step"})
+            if step.finish_reason != "tool_calls" or not step.tool_calls:
+                break
+            messages.extend(step.follow_up_messages())
+
+        finish_metadata: Dict[str, Any] = {}
+        finish_reason = steps[-1].finish_reason
+        if finish_reason is not None:
+            finish_metadata["finishReason"] = finish_reason.replace("_", "-")
+
+        usages = [step.usage for step in steps if step.usage is not None]
+        if usages:
+            usage_payload = {
+                "promptTokens": sum(usage.prompt_tokens for usage in usages),
+                "completionTokens": sum(usage.completion_tokens for usage in usages),
+            }
+            total_tokens = [getattr(usage, "total_tokens", None) for usage in usages]
+            if None not in total_tokens:
+                usage_payload["totalTokens"] = sum(total_tokens)
+            finish_metadata["usage"] = usage_payload
+
+        if finish_metadata:
+            writer.event({"type": "finish", "messageMetadata": finish_metadata})
+        else:
+            writer.event({"type": "finish"})
+
+        if on_finish is not None:
+            await on_finish([message for step in steps for message in step.messages()])
+        disconnect.record_finished("chat", sum(step.output_tokens() for step in steps))
+        writer.done()
+        yield writer.flush()
+    except (asyncio.CancelledError, GeneratorExit):
+        # Client went away (see `disconnect.cancel_on_disconnect`).
+        disconnect.record_cancelled("chat", sum(step.output_tokens() for step in steps))
+        raise
+    except Exception:
+        traceback.print_exc()
+        if writer.pending:
+            yield writer.flush()
+        raise
+    finally:
+        writer.close()
+
 
-        message_id = f"msg-{uuid.uuid4().hex}"
-        text_stream_id = "text-1"
+async def _stream_step(
+    client: AsyncOpenAI,
+    messages: Sequence[ChatCompletionMessageParam],
+    tool_definitions: Sequence[Dict[str, Any]],
+    available_tools: Mapping[str, Callable[..., Any]],
+    writer: SSEWriter,
+    step: _Step,
+    text_stream_id: str,
+) -> AsyncIterator[str]:
+    """Stream one completion into `writer` and run the tools it calls, filling in `step`."""
+    model = "gpt-4o"
+    started = time.monotonic()
+    ttfb = None
+    latency = None
+    stream = None
+    ok = False
+    try:
         text_started = False
         text_finished = False
-        finish_reason = None
-        usage_data = None
         tool_calls_state: Dict[int, Dict[str, Any]] = {}
 
-        yield format_sse({"type": "start", "messageId": message_id})
-
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             messages=messages,
-            model="gpt-4o",
+            model=model,
             stream=True,
+            stream_options={"include_usage": True},
             tools=tool_definitions,
         )
 
-        for chunk in stream:
+        async for chunk in with_flush_ticks(stream, writer):
+            if chunk is None:
+                yield writer.flush()
+                continue
+            if ttfb is None:
+                ttfb = time.monotonic() - started
             for choice in chunk.choices:
                 if choice.finish_reason is not None:
-                    finish_reason = choice.finish_reason
+                    step.finish_reason = choice.finish_reason
 
                 delta = choice.delta
                 if delta is None:
@@ -48,12 +213,10 @@ def stream_text(
 
                 if delta.content is not None:
                     if not text_started:
-                        yield format_sse({"type": "text-start", "id": text_stream_id})
+                        writer.event({"type": "text-start", "id": text_stream_id})
                         text_started = True
-                    yield format_sse(
-                        {"type": "text-delta", "id": text_stream_id, "delta": delta.content}
-                    )
-
+                    writer.delta("text-delta", text_stream_id, delta.content)
+                    step.text.append(delta.content)
                 if delta.tool_calls:
                     for tool_call_delta in delta.tool_calls:
                         index = tool_call_delta.index
@@ -74,7 +237,7 @@ def stream_text(
                                 and state["name"] is not None
                                 and not state["started"]
                             ):
-                                yield format_sse(
+                                writer.event(
                                     {
                                         "type": "tool-input-start",
                                         "toolCallId": state["id"],
@@ -92,7 +255,7 @@ def stream_text(
                                     and state["name"] is not None
                                     and not state["started"]
                                 ):
-                                    yield format_sse(
+                                    writer.event(
                                         {
                                             "type": "tool-input-start",
                                             "toolCallId": state["id"],
@@ -107,7 +270,7 @@ def stream_text(
                                     and state["name"] is not None
                                     and not state["started"]
                                 ):
-                                    yield format_sse(
+                                    writer.event(
                                         {
                                             "type": "tool-input-start",
                                             "toolCallId": state["id"],
@@ -118,7 +281,7 @@ def stream_text(
 
                                 state["arguments"] += function_call.arguments
                                 if state["id"] is not None:
-                                    yield format_sse(
+                                    writer.event(
                                         {
                                             "type": "tool-input-delta",
                                             "toolCallId": state["id"],
@@ -127,13 +290,20 @@ def stream_text(
                                     )
 
             if not chunk.choices and chunk.usage is not None:
-                usage_data = chunk.usage
+                step.usage = chunk.usage
+
+            if writer.ready():
+                yield writer.flush()
 
-        if finish_reason == "stop" and text_started and not text_finished:
-            yield format_sse({"type": "text-end", "id": text_stream_id})
+        latency = time.monotonic() - started
+        ok = True
+
+        if step.finish_reason == "stop" and text_started and not text_finished:
+            writer.event({"type": "text-end", "id": text_stream_id})
             text_finished = True
 
-        if finish_reason == "tool_calls":
+        if step.finish_reason == "tool_calls":
+            pending_tools: Dict[asyncio.Future, str] = {}
             for index in sorted(tool_calls_state.keys()):
                 state = tool_calls_state[index]
                 tool_call_id = state.get("id")
@@ -141,9 +311,10 @@ def stream_text(
 
                 if tool_call_id is None or tool_name is None:
                     continue
+                step.tool_calls.append((tool_call_id, tool_name, state["arguments"]))
 
                 if not state["started"]:
-                    yield format_sse(
+                    writer.event(
                         {
                             "type": "tool-input-start",
                             "toolCallId": tool_call_id,
@@ -156,7 +327,8 @@ def stream_text(
                 try:
                     parsed_arguments = json.loads(raw_arguments) if raw_arguments else {}
                 except Exception as error:
-                    yield format_sse(
+                    step.tool_results[tool_call_id] = f"Invalid tool arguments: {error}"
+                    writer.event(
                         {
                             "type": "tool-input-error",
                             "toolCallId": tool_call_id,
@@ -167,7 +339,7 @@ def stream_text(
                     )
                     continue
 
-                yield format_sse(
+                writer.event(
                     {
                         "type": "tool-input-available",
                         "toolCallId": tool_call_id,
@@ -178,7 +350,8 @@ def stream_text(
 
                 tool_function = available_tools.get(tool_name)
                 if tool_function is None:
-                    yield format_sse(
+                    step.tool_results[tool_call_id] = f"Tool '{tool_name}' not found."
+                    writer.event(
                         {
                             "type": "tool-output-error",
                             "toolCallId": tool_call_id,
@@ -187,52 +360,103 @@ def stream_text(
                     )
                     continue
 
-                try:
-                    tool_result = tool_function(**parsed_arguments)
-                except Exception as error:
-                    yield format_sse(
-                        {
-                            "type": "tool-output-error",
-                            "toolCallId": tool_call_id,
-                            "errorText": str(error),
-                        }
-                    )
-                else:
-                    yield format_sse(
-                        {
-                            "type": "tool-output-available",
-                            "toolCallId": tool_call_id,
-                            "output": tool_result,
-                        }
-                    )
+                task = asyncio.ensure_future(run_tool(tool_name, tool_function, parsed_arguments))
+                pending_tools[task] = tool_call_id
+
+            # Tools run concurrently; outputs are sent as each one finishes.
+            if writer.pending:
+                yield writer.flush()
+            try:
+                while pending_tools:
+                    done, _ = await asyncio.wait(pending_tools, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        tool_call_id = pending_tools.pop(task)
+                        try:
+                            tool_result = task.result()
+                        except Exception as error:
+                            error_text = str(error) or type(error).__name__
+                            step.tool_results[tool_call_id] = f"Error: {error_text}"
+                            writer.event(
+                                {
+                                    "type": "tool-output-error",
+                                    "toolCallId": tool_call_id,
+                                    "errorText": error_text,
+                                }
+                            )
+                        else:
+                            step.tool_results[tool_call_id] = json.dumps(tool_result, default=str)
+                            writer.event(
+                                {
+                                    "type": "tool-output-available",
+                                    "toolCallId": tool_call_id,
+                                    "output": tool_result,
+                                }
+                            )
+                    yield writer.flush()
+            finally:
+                for task in pending_tools:
+                    task.cancel()
 
         if text_started and not text_finished:
-            yield format_sse({"type": "text-end", "id": text_stream_id})
+            writer.event({"type": "text-end", "id": text_stream_id})
             text_finished = True
 
-        finish_metadata: Dict[str, Any] = {}
-        if finish_reason is not None:
-            finish_metadata["finishReason"] = finish_reason.replace("_", "-")
+    finally:
+        if stream is not None:
+            await stream.close()
+        usage = None
+        if step.usage is not None:
+            usage = {"input_tokens": step.usage.prompt_tokens, "output_tokens": step.usage.completion_tokens}
+        metrics.record_call(model, latency or time.monotonic() - started, ttfb, usage=usage, ok=ok)
 
-        if usage_data is not None:
-            usage_payload = {
-                "promptTokens": usage_data.prompt_tokens,
-                "completionTokens": usage_data.completion_tokens,
-            }
-            total_tokens = getattr(usage_data, "total_tokens", None)
-            if total_tokens is not None:
-                usage_payload["totalTokens"] = total_tokens
-            finish_metadata["usage"] = usage_payload
 
+async def stream_llm_result(result: Dict[str, Any], claude_stream) -> AsyncIterator[str]:
+    """Yield Server-Sent Events for an LLM-backed endpoint.
+
+    The structural part of the response is sent first as a `data-result` part,
+    followed by Claude's text deltas as they arrive, using the same UI message
+    protocol as `/api/chat`.
+    """
+    text_stream_id = "text-1"
+    writer = SSEWriter()
+    try:
+        writer.event({"type": "start", "messageId": f"msg-{uuid.uuid4().hex}"})
+        writer.event({"type": "data-result", "data": result})
+        writer.event({"type": "text-start", "id": text_stream_id})
+        yield writer.flush()
+        try:
+            async for delta in with_flush_ticks(claude_stream, writer):
+                if delta is not None:
+                    writer.delta("text-delta", text_stream_id, delta)
+                if delta is None or writer.ready():
+                    yield writer.flush()
+        except Exception as error:
+            traceback.print_exc()
+            writer.event({"type": "error", "errorText": str(error)})
+        writer.event({"type": "text-end", "id": text_stream_id})
+
+        finish_metadata: Dict[str, Any] = {}
+        if claude_stream.stop_reason is not None:
+            finish_metadata["finishReason"] = claude_stream.stop_reason.replace("_", "-")
+        if claude_stream.degraded is not None:
+            finish_metadata["degraded"] = claude_stream.degraded
+        if claude_stream.usage:
+            finish_metadata["usage"] = {
+                "promptTokens": claude_stream.usage.get("input_tokens"),
+                "completionTokens": claude_stream.usage.get("output_tokens"),
+            }
         if finish_metadata:
-            yield format_sse({"type": "finish", "messageMetadata": finish_metadata})
+            writer.event({"type": "finish", "messageMetadata": finish_metadata})
         else:
-            yield format_sse({"type": "finish"})
-
-        yield "data: [DONE]\n\n"
-    except Exception:
-        traceback.print_exc()
+            writer.event({"type": "finish"})
+        disconnect.record_finished("llm", claude_stream.usage.get("output_tokens") or len(claude_stream.text) // 4)
+        writer.done()
+        yield writer.flush()
+    except (asyncio.CancelledError, GeneratorExit):
+        disconnect.record_cancelled("llm", len(claude_stream.text) // 4)
         raise
+    finally:
+        writer.close()
 
 
 def patch_response_with_headers(
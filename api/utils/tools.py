@@ -1,49 +1,255 @@
-import requests
-
-
-def get_current_weather(latitude, longitude):
-    # Format the URL with proper parameter substitution
-    url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m&hourly=temperature_2m&daily=sunrise,sunset&timezone=auto"
-
-    try:
-        # Make the API call
-        response = requests.get(url)
-
-        # Raise an exception for bad status codes
-        response.raise_for_status()
-
-        # Return the JSON response
-        return response.json()
-
-    except requests.RequestException as e:
-        # Handle any errors that occur during the request
-        print(f"Error fetching weather data: {e}")
-        return None
-
-
-TOOL_DEFINITIONS = [{
-    "type": "function",
-    "function": {
-        "name": "get_current_weather",
-        "description": "Get the current weather at a location",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "latitude": {
-                    "type": "number",
-                    "description": "The latitude of the location",
-                },
-                "longitude": {
-                    "type": "number",
-                    "description": "The longitude of the location",
-                },
+import inspect
+import json
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models, services
+from ..db import SessionLocal
+from .weather import get_forecast
+
+
+class Tool(NamedTuple):
+    name: str
+    function: Callable[..., Any]
+    definition: Dict[str, Any]
+    # Called with a SQLAlchemy session as its first argument.
+    uses_db: bool
+
+
+class ToolContext:
+    """Per-request state for chat tools: one lazily opened DB session and a result cache.
+
+    Database tools take turns on the session (a Session is not thread-safe and
+    tool calls run concurrently); identical calls within the request are
+    answered from the cache.
+    """
+
+    def __init__(self):
+        self.cache: Dict[str, Any] = {}
+        self.cache_hits = 0
+        self._db: Optional[Session] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def run_db(self, function: Callable[..., Any], **kwargs) -> Any:
+        with self._lock:
+            if self._db is None:
+                self._db = SessionLocal()
+            try:
+                return function(self._db, **kwargs)
+            finally:
+                if self._closed:
+                    self._close_session()
+
+    def _close_session(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def close(self) -> None:
+        """Release the session; if a tool is still using it, it is closed when that tool returns."""
+        self._closed = True
+        if self._lock.acquire(blocking=False):
+            try:
+                self._close_session()
+            finally:
+                self._lock.release()
+
+
+class ToolRegistry:
+    """Chat tools with their OpenAI function definitions."""
+
+    def __init__(self):
+        self._tools: Dict[str, Tool] = {}
+
+    def register(self, name: str, description: str, parameters: Dict[str, Any], uses_db: bool = False):
+        def decorator(function: Callable[..., Any]) -> Callable[..., Any]:
+            definition = {
+                "type": "function",
+                "function": {"name": name, "description": description, "parameters": parameters},
+            }
+            self._tools[name] = Tool(name, function, definition, uses_db)
+            return function
+
+        return decorator
+
+    def definitions(self) -> List[Dict[str, Any]]:
+        return [tool.definition for tool in self._tools.values()]
+
+    def bind(self, context: Optional[ToolContext] = None) -> Dict[str, Callable[..., Any]]:
+        """Callables for `stream_text`, sharing `context`'s session and cache.
+
+        Without a context every database tool call opens and closes its own
+        session and nothing is cached.
+        """
+        return {name: self._bind(tool, context) for name, tool in self._tools.items()}
+
+    def _bind(self, tool: Tool, context: Optional[ToolContext]) -> Callable[..., Any]:
+        function = tool.function
+
+        def cache_key(kwargs: Dict[str, Any]) -> str:
+            return json.dumps([tool.name, kwargs], sort_keys=True, default=str)
+
+        if inspect.iscoroutinefunction(function):
+            async def call(**kwargs):
+                if context is None:
+                    return await function(**kwargs)
+                key = cache_key(kwargs)
+                if key in context.cache:
+                    context.cache_hits += 1
+                    return context.cache[key]
+                result = context.cache[key] = await function(**kwargs)
+                return result
+        else:
+            def call(**kwargs):
+                if context is not None:
+                    key = cache_key(kwargs)
+                    if key in context.cache:
+                        context.cache_hits += 1
+                        return context.cache[key]
+                if not tool.uses_db:
+                    result = function(**kwargs)
+                elif context is not None:
+                    result = context.run_db(function, **kwargs)
+                else:
+                    with SessionLocal() as db:
+                        result = function(db, **kwargs)
+                if context is not None:
+                    context.cache[key] = result
+                return result
+
+        call.__name__ = tool.name
+        if hasattr(function, "timeout"):
+            call.timeout = function.timeout
+        return call
+
+
+registry = ToolRegistry()
+
+
+@registry.register(
+    "get_current_weather",
+    "Get the current weather at a location",
+    {
+        "type": "object",
+        "properties": {
+            "latitude": {
+                "type": "number",
+                "description": "The latitude of the location",
             },
-            "required": ["latitude", "longitude"],
+            "longitude": {
+                "type": "number",
+                "description": "The longitude of the location",
+            },
+        },
+        "required": ["latitude", "longitude"],
+    },
+)
+async def get_current_weather(latitude, longitude):
+    # Pooled, time-bounded and cached per grid cell; None if the forecast is unavailable
+    return await get_forecast(latitude, longitude)
+
+
+@registry.register(
+    "search_documents",
+    "Find the organization's internal documents most relevant to a question",
+    {
+        "type": "object",
+        "properties": {
+            "question": {"type": "string", "description": "What the user wants to know"},
+            "k": {"type": "integer", "description": "How many documents to return (default 3)"},
+        },
+        "required": ["question"],
+    },
+    uses_db=True,
+)
+def search_documents(db: Session, question: str, k: int = 3):
+    docs = services.select_relevant_docs(db, question, k=max(1, min(int(k), 10)))
+    return [
+        {
+            "id": d.id,
+            "title": d.title,
+            "summary": d.summary,
+            "content": (d.content or "")[:1000],
+            "owner": d.owner.name if d.owner else None,
+            "last_updated": d.last_updated.isoformat() if d.last_updated else None,
+        }
+        for d in docs
+    ]
+
+
+@registry.register(
+    "documents_at_risk",
+    "List documents at risk of losing their knowledge (low bus factor, stale or critical), highest risk first",
+    {
+        "type": "object",
+        "properties": {
+            "threshold": {"type": "integer", "description": "Minimum risk score from 0 to 100 (default 60)"},
+            "limit": {"type": "integer", "description": "Maximum number of documents (default 10)"},
         },
     },
-}]
+    uses_db=True,
+)
+def documents_at_risk(db: Session, threshold: int = 60, limit: int = 10):
+    return services.documents_risky(db, threshold=int(threshold), limit=max(1, min(int(limit), 50)))
+
+
+@registry.register(
+    "simulate_departure",
+    "Show what knowledge would be orphaned if a person left: their sole-owned documents, topics and systems",
+    {
+        "type": "object",
+        "properties": {
+            "person": {"type": "string", "description": "The person's name, email or numeric id"},
+        },
+        "required": ["person"],
+    },
+    uses_db=True,
+)
+def simulate_departure(db: Session, person: str):
+    query = db.query(models.Person)
+    person_row = None
+    if str(person).isdigit():
+        person_row = query.filter(models.Person.id == int(person)).first()
+    if person_row is None:
+        person_row = query.filter((models.Person.email == person) | (models.Person.name.ilike(f"%{person}%"))).first()
+    if person_row is None:
+        return {"error": "person not found"}
+    # The structural impact only; the chat model writes the handoff itself.
+    res, _ = services.prepare_simulate_departure(db, person_row.id)
+    res.pop("claude_handoff", None)
+    return res
+
+
+@registry.register(
+    "team_contacts",
+    "Get the key contact people for a team and why to contact them",
+    {
+        "type": "object",
+        "properties": {
+            "team_name": {"type": "string", "description": "The team's name; use list_teams to see them"},
+        },
+        "required": ["team_name"],
+    },
+    uses_db=True,
+)
+def team_contacts(db: Session, team_name: str):
+    return services.get_team_contacts(db, team_name)
+
+
+@registry.register(
+    "list_teams",
+    "List the organization's teams",
+    {"type": "object", "properties": {}},
+    uses_db=True,
+)
+def list_teams(db: Session):
+    return [{"id": team.id, "name": team.name} for team in services.get_all_teams(db)]
+
 
+TOOL_DEFINITIONS = registry.definitions()
 
-AVAILABLE_TOOLS = {
-    "get_current_weather": get_current_weather,
-}
+# Context-free callables, e.g. for scripts; /api/chat binds a ToolContext per request.
+AVAILABLE_TOOLS = registry.bind()
@@ -0,0 +1,134 @@
+"""Forecast lookups for the chat weather tool.
+
+Requests go through one pooled `httpx.AsyncClient` with strict timeouts, so a
+hung open-meteo call fails within `WEATHER_TIMEOUT` instead of blocking the
+chat stream. Coordinates are snapped to a `WEATHER_GRID`-degree grid and the
+forecast for each grid cell is cached for `WEATHER_CACHE_TTL` seconds; nearby
+lookups share one entry. For a further `WEATHER_STALE_TTL` seconds an expired
+entry is still returned immediately while a single background request
+refreshes it (stale-while-revalidate). Concurrent misses for the same cell
+share one request.
+
+Set `WEATHER_API_URL` to the `/v1/forecast` stand-in in `api/mock_llm.py` to
+run without network access.
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+import httpx
+
+from ..singleflight import SingleFlight
+
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "5"))
+WEATHER_GRID = float(os.getenv("WEATHER_GRID", "0.05"))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", "1800"))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", "1024"))
+
+Cell = Tuple[float, float]
+
+# Bound to the loop it was created on (see `anthropic_client.get_client`).
+_client: Optional[httpx.AsyncClient] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# Grid cell -> (fetched at, forecast), least recently used first.
+_cache: "OrderedDict[Cell, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_inflight = SingleFlight()
+_refreshing: Set[asyncio.Task] = set()
+_counters: Dict[str, int] = {"hits": 0, "stale_hits": 0, "misses": 0, "errors": 0}
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client, _loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(WEATHER_TIMEOUT, connect=min(2.0, WEATHER_TIMEOUT)),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        _loop = loop
+    return _client
+
+
+async def close_client() -> None:
+    global _client, _loop
+    client, _client, _loop = _client, None, None
+    if client is not None:
+        await client.aclose()
+
+
+def grid_cell(latitude: float, longitude: float) -> Cell:
+    """Centre of the `WEATHER_GRID` cell containing the point."""
+    return (
+        round(round(float(latitude) / WEATHER_GRID) * WEATHER_GRID, 4),
+        round(round(float(longitude) / WEATHER_GRID) * WEATHER_GRID, 4),
+    )
+
+
+async def _fetch(cell: Cell) -> Optional[Dict[str, Any]]:
+    params = {
+        "latitude": cell[0],
+        "longitude": cell[1],
+        "current": "temperature_2m",
+        "hourly": "temperature_2m",
+        "daily": "sunrise,sunset",
+        "timezone": "auto",
+    }
+    try:
+        response = await _get_client().get(WEATHER_API_URL, params=params)
+        response.raise_for_status()
+        forecast = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        _counters["errors"] += 1
+        print(f"Error fetching weather data: {e!r}")
+        return None
+    _cache[cell] = (time.monotonic(), forecast)
+    _cache.move_to_end(cell)
+    while len(_cache) > WEATHER_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return forecast
+
+
+def _refresh(cell: Cell) -> None:
+    task = asyncio.ensure_future(_inflight.do(str(cell), lambda: _fetch(cell)))
+    _refreshing.add(task)
+    task.add_done_callback(_refreshing.discard)
+
+
+async def get_forecast(latitude: float, longitude: float) -> Optional[Dict[str, Any]]:
+    """Return the forecast for the grid cell around the point, or None if it cannot be fetched."""
+    cell = grid_cell(latitude, longitude)
+    entry = _cache.get(cell)
+    if entry is not None:
+        fetched_at, forecast = entry
+        age = time.monotonic() - fetched_at
+        if age < WEATHER_CACHE_TTL:
+            _counters["hits"] += 1
+            _cache.move_to_end(cell)
+            return forecast
+        if age < WEATHER_CACHE_TTL + WEATHER_STALE_TTL:
+            _counters["stale_hits"] += 1
+            _cache.move_to_end(cell)
+            _refresh(cell)
+            return forecast
+    _counters["misses"] += 1
+    return await _inflight.do(str(cell), lambda: _fetch(cell))
+
+
+def clear_cache() -> None:
+    _cache.clear()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        **_counters,
+        "cached_cells": len(_cache),
+        "refreshing": len(_refreshing),
+        "upstream_calls": _inflight.leaders,
+        "deduplicated": _inflight.deduplicated,
+    }
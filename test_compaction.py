@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Tests for `/api/chat` history compaction (`api/utils/compaction.py`).
+
+Run with pytest or directly.
+"""
+
+import json
+import sys
+
+from api.utils import compaction
+
+
+def _turn(n: int, tool_output_size: int = 0):
+    """A user message, an assistant tool call, its result and the answer."""
+    call_id = f"call_{n}"
+    return [
+        {"role": "user", "content": f"question {n}"},
+        {"role": "assistant", "content": "", "tool_calls": [
+            {"id": call_id, "type": "function", "function": {"name": "search_documents", "arguments": "{}"}},
+        ]},
+        {"role": "tool", "tool_call_id": call_id, "content": json.dumps({"results": ["x" * 50] * tool_output_size})},
+        {"role": "assistant", "content": f"answer {n}"},
+    ]
+
+
+def _assert_tool_calls_paired(messages):
+    calls = [call["id"] for message in messages for call in message.get("tool_calls") or ()]
+    results = [message["tool_call_id"] for message in messages if message.get("role") == "tool"]
+    assert calls == results
+
+
+def test_dropped_turns_keep_tool_calls_paired():
+    system = {"role": "system", "content": "You are helpful."}
+    messages = [system] + [message for n in range(10) for message in _turn(n, tool_output_size=20)]
+    budget = compaction.estimate_tokens(messages) // 3
+
+    compacted = compaction.compact_messages(messages, budget=budget, keep_turns=2)
+
+    assert compacted[0] == system
+    assert compacted[1]["role"] == "system" and "omitted" in compacted[1]["content"]
+    assert compaction.estimate_tokens(compacted) <= budget
+    # Whole turns were dropped, newest kept intact.
+    assert compacted[2]["role"] == "user"
+    assert compacted[-4:] == messages[-4:]
+    _assert_tool_calls_paired(compacted)
+
+
+def test_old_tool_outputs_summarized_not_dropped():
+    messages = [message for n in range(4) for message in _turn(n, tool_output_size=40)]
+    compacted = compaction.compact_messages(messages, budget=10 ** 6, keep_turns=1, tool_output_tokens=50)
+
+    assert len(compacted) == len(messages)
+    old_results = [m for m in compacted[:-4] if m["role"] == "tool"]
+    assert old_results and all(m["content"].startswith("[summary of an earlier tool result]") for m in old_results)
+    assert compacted[-4:] == messages[-4:]
+    _assert_tool_calls_paired(compacted)
+    # Messages are copied, never modified.
+    assert not messages[2]["content"].startswith("[summary")
+
+
+def test_token_counts_cached_by_digest():
+    class CountingEncoding:
+        calls = 0
+
+        def encode(self, text, disallowed_special=()):
+            self.calls += 1
+            return text.split()
+
+    encoding = CountingEncoding()
+    saved = compaction._encoding
+    compaction._encoding = encoding
+    compaction._token_counts.clear()
+    try:
+        text = "word " * 1000
+        assert compaction.estimate_text_tokens(text) == 1000
+        assert compaction.estimate_text_tokens(text) == 1000
+        assert encoding.calls == 1
+        # Only a fixed-size digest is kept, not the text itself.
+        assert all(isinstance(key, bytes) and len(key) == 20 for key in compaction._token_counts)
+        assert compaction.uses_tokenizer()
+    finally:
+        compaction._encoding = saved
+        compaction._token_counts.clear()
+
+
+def main():
+    tests = [
+        test_dropped_turns_keep_tool_calls_paired,
+        test_old_tool_outputs_summarized_not_dropped,
+        test_token_counts_cached_by_digest,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
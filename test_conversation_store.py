@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Tests for server-side chat history (`api/conversation_store.py`).
+
+Each test uses its own SQLite file in a temporary directory. Run with pytest
+or directly.
+"""
+
+import os
+import sys
+import tempfile
+
+from api.conversation_store import ConversationStore
+
+USER = {"role": "user", "content": "hello"}
+ASSISTANT = {"role": "assistant", "content": "hi there"}
+
+
+def _store(directory: str, **kwargs) -> ConversationStore:
+    return ConversationStore(path=os.path.join(directory, "conversations.db"), **kwargs)
+
+
+def test_unknown_ids_rejected_not_created():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        # /api/chat answers 404 for these.
+        assert store.get("made-up") is None
+        assert store.append("made-up", [USER]) is False
+        assert store.replace("made-up", [USER]) is False
+        assert store.get("made-up") is None
+        assert store.stats()["conversations"] == 0
+
+
+def test_issued_ids_are_unique_and_empty():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory)
+        ids = {store.create() for _ in range(20)}
+        assert len(ids) == 20
+        assert all(len(conversation_id) >= 32 for conversation_id in ids)
+        assert all(store.get(conversation_id) == [] for conversation_id in ids)
+
+
+def test_append_and_replace_persist():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory, cache_size=1)
+        conversation_id = store.create()
+        assert store.append(conversation_id, [USER, ASSISTANT]) is True
+        assert store.append(conversation_id, [USER]) is True
+        assert store.get(conversation_id) == [USER, ASSISTANT, USER]
+
+        # Another conversation pushes this one out of the in-memory cache.
+        store.create()
+        reopened = _store(directory)
+        assert reopened.get(conversation_id) == [USER, ASSISTANT, USER]
+
+        assert store.replace(conversation_id, [ASSISTANT]) is True
+        assert store.get(conversation_id) == [ASSISTANT]
+        assert _store(directory).get(conversation_id) == [ASSISTANT]
+        # Copies are returned: callers cannot change the stored history.
+        store.get(conversation_id).append(USER)
+        assert store.get(conversation_id) == [ASSISTANT]
+
+
+def test_idle_conversations_evicted():
+    with tempfile.TemporaryDirectory() as directory:
+        store = _store(directory, max_age=0)
+        conversation_id = store.create()
+        assert store.evict() == 1
+        assert store.get(conversation_id) is None
+        assert store.append(conversation_id, [USER]) is False
+
+
+def main():
+    tests = [
+        test_unknown_ids_rejected_not_created,
+        test_issued_ids_are_unique_and_empty,
+        test_append_and_replace_persist,
+        test_idle_conversations_evicted,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
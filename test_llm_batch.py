@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Tests for the Message Batches pipeline (`api/llm_batch.py`).
+
+Batches go to the mock `/v1/messages/batches` in-process through Starlette's
+test client; jobs live in a temporary SQLite database and results in a
+temporary response cache. Run with pytest or directly.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from starlette.testclient import TestClient
+
+from api import llm_batch, mock_llm, models
+from api.db import Base
+from api.llm_cache import LLMCache, cache_key
+
+PROMPTS = [("handoff-1", "Summarize the handoff for Alice"), ("handoff-2", "Summarize the handoff for Bob")]
+
+
+class _Env:
+    """Temporary database, cache and mock batch endpoint, restored on exit."""
+
+    def __enter__(self):
+        self.directory = tempfile.TemporaryDirectory()
+        engine = create_engine(f"sqlite:///{os.path.join(self.directory.name, 'jobs.db')}")
+        Base.metadata.create_all(bind=engine)
+        self.Session = sessionmaker(bind=engine)
+        self.cache = LLMCache(path=os.path.join(self.directory.name, "llm_cache.db"))
+        self.saved = (llm_batch.ANTHROPIC_BATCH_URL, llm_batch.get_cache, llm_batch.POLL_INITIAL, mock_llm.config["batch_delay"])
+        llm_batch.ANTHROPIC_BATCH_URL = "http://testserver/v1/messages/batches"
+        llm_batch.get_cache = lambda: self.cache
+        llm_batch.POLL_INITIAL = 0.05
+        mock_llm.config["batch_delay"] = 0.1
+        self.client = TestClient(mock_llm.app)
+        return self
+
+    def __exit__(self, *exc):
+        self.client.close()
+        llm_batch.ANTHROPIC_BATCH_URL, llm_batch.get_cache, llm_batch.POLL_INITIAL, mock_llm.config["batch_delay"] = self.saved
+        self.directory.cleanup()
+
+
+def _key(prompt: str) -> str:
+    return cache_key(llm_batch.DEFAULT_MODEL, 1024, 0.2, prompt)
+
+
+def test_submit_poll_and_cache_results():
+    with _Env() as env:
+        db = env.Session()
+        job = llm_batch.create_job(db, "handoffs", PROMPTS)
+        assert job.request_count == 2 and job.status == "pending"
+
+        llm_batch.submit_job(db, job, env.client)
+        assert job.status == "submitted" and job.provider_batch_id
+        assert llm_batch.poll_job(db, job, env.client) is False
+
+        time.sleep(0.15)
+        assert llm_batch.poll_job(db, job, env.client) is True
+        assert job.status == "completed" and job.succeeded_count == 2 and job.poll_count == 2
+        assert all(item.status == "succeeded" for item in job.items)
+        for _, prompt in PROMPTS:
+            assert env.cache.get(_key(prompt))
+        db.close()
+
+
+def test_cached_prompts_skipped():
+    with _Env() as env:
+        db = env.Session()
+        env.cache.put(_key(PROMPTS[0][1]), "already generated")
+        job = llm_batch.create_job(db, "handoffs", PROMPTS)
+        assert [item.custom_id for item in job.items] == ["handoff-2"]
+
+        env.cache.put(_key(PROMPTS[1][1]), "already generated")
+        assert llm_batch.create_job(db, "handoffs", PROMPTS[1:]) is None
+        db.close()
+
+
+def test_resume_finishes_interrupted_jobs():
+    with _Env() as env:
+        # One run stopped before submitting, another before its results came back.
+        db = env.Session()
+        pending = llm_batch.create_job(db, "handoffs", PROMPTS[:1])
+        submitted = llm_batch.create_job(db, "handoffs", PROMPTS[1:])
+        llm_batch.submit_job(db, submitted, env.client)
+        pending_id, submitted_id = pending.id, submitted.id
+        db.close()
+
+        saved = (llm_batch.init_db, llm_batch.SessionLocal, llm_batch._client)
+        llm_batch.init_db = lambda: None
+        llm_batch.SessionLocal = env.Session
+        llm_batch._client = lambda: env.client
+        try:
+            llm_batch.resume()
+        finally:
+            llm_batch.init_db, llm_batch.SessionLocal, llm_batch._client = saved
+
+        db = env.Session()
+        jobs = {job.id: job for job in db.query(models.LLMBatchJob).all()}
+        assert jobs[pending_id].status == "completed" and jobs[pending_id].provider_batch_id
+        assert jobs[submitted_id].status == "completed"
+        assert all(env.cache.get(_key(prompt)) for _, prompt in PROMPTS)
+        db.close()
+
+
+def main():
+    tests = [
+        test_submit_poll_and_cache_results,
+        test_cached_prompts_skipped,
+        test_resume_finishes_interrupted_jobs,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Tests for the persistent Claude response cache (`api/llm_cache.py`).
+
+Each test uses its own SQLite file in a temporary directory. Run with pytest
+or directly.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from api.llm_cache import LLMCache
+
+DAY = 24 * 3600
+
+
+def _cache(directory: str, **kwargs) -> LLMCache:
+    return LLMCache(path=os.path.join(directory, "llm_cache.db"), max_age=DAY, fallback_max_age=30 * DAY, **kwargs)
+
+
+def _age(cache: LLMCache, key: str, seconds: float) -> None:
+    then = time.time() - seconds
+    cache._conn.execute("UPDATE llm_cache SET created_at = ?, last_access = ? WHERE key = ?", (then, then, key))
+
+
+def _labels(cache: LLMCache):
+    return dict(cache._conn.execute("SELECT label, key FROM llm_cache_labels").fetchall())
+
+
+def test_expired_labelled_entry_kept_as_fallback():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = _cache(directory)
+        cache.put("plain", "plain answer")
+        cache.put("labelled", "labelled answer")
+        cache.remember("handoff:1", "labelled")
+        _age(cache, "plain", 2 * DAY)
+        _age(cache, "labelled", 2 * DAY)
+
+        assert cache.evict() == 1
+        # Expired for normal lookups, still served as the label's fallback.
+        assert cache.get("labelled") is None
+        assert cache.latest("handoff:1") == "labelled answer"
+        assert cache.get("plain") is None and cache.stats()["entries"] == 1
+
+
+def test_labelled_entry_expires_after_fallback_age():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = _cache(directory)
+        cache.put("labelled", "labelled answer")
+        cache.remember("handoff:1", "labelled")
+        _age(cache, "labelled", 31 * DAY)
+
+        assert cache.evict() == 1
+        assert cache.latest("handoff:1") is None
+        # The label row went with its entry.
+        assert _labels(cache) == {}
+
+
+def test_size_cap_evicts_least_recently_used():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = _cache(directory)
+        cache.put("old", "old answer")
+        cache.put("new", "new answer")
+        cache.remember("onboarding:1", "old")
+        _age(cache, "old", 60)
+        cache.max_bytes = cache.stats()["bytes"] - 1
+
+        assert cache.evict() == 1
+        assert cache.get("new") == "new answer"
+        assert cache.latest("onboarding:1") is None
+        assert _labels(cache) == {}
+
+
+def main():
+    tests = [
+        test_expired_labelled_entry_kept_as_fallback,
+        test_labelled_entry_expires_after_fallback_age,
+        test_size_cap_evicts_least_recently_used,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Tests for the Claude client's failure handling against the mock `/v1/messages`.
+
+The mock app is called in-process through httpx's ASGI transport with fixed,
+zero latency, so no API key, network or running mock server is needed. Run
+with pytest or directly.
+"""
+
+import asyncio
+import os
+import sys
+
+import httpx
+
+from api import anthropic_client, mock_llm
+from api.anthropic_client import Fallback
+from api.circuit_breaker import CircuitBreaker
+from api.llm_limiter import LLMLimiter
+
+FALLBACK = Fallback(label=None, text="template answer")
+
+
+async def _use_mock(**settings) -> None:
+    """Point the Claude client at the mock app with a fresh limiter and breaker."""
+    os.environ["ANTHROPIC_API_KEY"] = "test"
+    anthropic_client.ANTHROPIC_API_URL = "http://mock/v1/messages"
+    anthropic_client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_llm.app))
+    anthropic_client._loop = asyncio.get_running_loop()
+    anthropic_client._limiter = LLMLimiter()
+    anthropic_client._breaker = CircuitBreaker()
+    mock_llm.config.update(
+        ttfb_dist="fixed", ttfb_ms=0, tokens_per_sec=0, output_tokens=5, rate_429=0, rate_5xx=0, retry_after=1
+    )
+    mock_llm.config.update(settings)
+    mock_llm.stats.clear()
+
+
+def test_breaker_opens_while_limiter_cools_down():
+    async def run():
+        # Every call is rate limited and asked to wait longer than its budget.
+        await _use_mock(rate_429=1.0, retry_after=5)
+        breaker = anthropic_client._breaker
+        try:
+            for _ in range(breaker.failure_threshold):
+                text, degraded = await anthropic_client.acall_claude_with_fallback(
+                    "hello", FALLBACK, use_cache=False, budget=2
+                )
+                assert (text, degraded) == ("template answer", "template")
+            # Only the first call reached the upstream; the others were refused
+            # by the limiter's cool-down, and still count as failures.
+            assert mock_llm.stats["anthropic_requests"] == 1
+            assert anthropic_client._limiter.rejected_past_deadline == breaker.failure_threshold
+            assert breaker.state == "open"
+            assert breaker.trips == 1
+
+            text, degraded = await anthropic_client.acall_claude_with_fallback(
+                "hello", FALLBACK, use_cache=False, budget=2
+            )
+            assert degraded == "template"
+            assert breaker.rejected == 1
+            assert anthropic_client._limiter.rejected_past_deadline == breaker.failure_threshold
+        finally:
+            await anthropic_client.close_client()
+
+    asyncio.run(run())
+
+
+def test_successful_call_keeps_breaker_closed():
+    async def run():
+        await _use_mock()
+        try:
+            text, degraded = await anthropic_client.acall_claude_with_fallback(
+                "hello", FALLBACK, use_cache=False, budget=2
+            )
+            assert degraded is None
+            assert text.startswith("hello")
+            assert anthropic_client._breaker.stats()["state"] == "closed"
+            assert anthropic_client._breaker.consecutive_failures == 0
+        finally:
+            await anthropic_client.close_client()
+
+    asyncio.run(run())
+
+
+def _post(prompt: str):
+    request = anthropic_client._build_request("test", prompt, 16, anthropic_client.DEFAULT_MODEL, 0.2)
+    return anthropic_client._post_with_retries(request, cost=100)
+
+
+def _assert_limiter_untouched(limit: float) -> None:
+    limiter = anthropic_client._limiter
+    assert limiter.in_flight == 0
+    assert limiter.limit == limit
+    assert limiter.consecutive_failures == 0
+    assert limiter.stats()["cooldown_remaining"] == 0
+
+
+def test_programming_error_not_retried():
+    async def run():
+        await _use_mock()
+        limit = anthropic_client._limiter.limit
+        record_usage = anthropic_client._record_usage
+
+        def broken(usage):
+            raise KeyError("input_tokens")
+
+        anthropic_client._record_usage = broken
+        try:
+            try:
+                await _post("hello")
+            except KeyError:
+                pass
+            else:
+                raise AssertionError("expected the KeyError to propagate")
+            assert mock_llm.stats["anthropic_requests"] == 1
+            _assert_limiter_untouched(limit)
+        finally:
+            anthropic_client._record_usage = record_usage
+            await anthropic_client.close_client()
+
+    asyncio.run(run())
+
+
+def test_cancelled_attempt_releases_permit():
+    async def run():
+        await _use_mock(ttfb_ms=1000)
+        limit = anthropic_client._limiter.limit
+        try:
+            task = asyncio.ensure_future(_post("hello"))
+            await asyncio.sleep(0.1)
+            assert anthropic_client._limiter.in_flight == 1
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            _assert_limiter_untouched(limit)
+        finally:
+            await anthropic_client.close_client()
+
+    asyncio.run(run())
+
+
+def main():
+    tests = [
+        test_breaker_opens_while_limiter_cools_down,
+        test_successful_call_keeps_breaker_closed,
+        test_programming_error_not_retried,
+        test_cancelled_attempt_releases_permit,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Tests for the shared Claude admission control (`api/llm_limiter.py`).
+
+The 429 path runs against the mock `/v1/messages` in-process through httpx's
+ASGI transport; the scheduling tests drive an `LLMLimiter` directly. Run with
+pytest or directly.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+from api import anthropic_client, mock_llm
+from api.circuit_breaker import CircuitBreaker
+from api.llm_limiter import LLMLimiter
+from api.llm_router import BACKGROUND, INTERACTIVE
+
+COST = 100
+
+
+async def _use_mock(**settings) -> None:
+    """Point the Claude client at the mock app with a fresh limiter and breaker."""
+    os.environ["ANTHROPIC_API_KEY"] = "test"
+    anthropic_client.ANTHROPIC_API_URL = "http://mock/v1/messages"
+    anthropic_client._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_llm.app))
+    anthropic_client._loop = asyncio.get_running_loop()
+    anthropic_client._limiter = LLMLimiter()
+    anthropic_client._breaker = CircuitBreaker()
+    mock_llm.config.update(
+        ttfb_dist="fixed", ttfb_ms=0, tokens_per_sec=0, output_tokens=5, rate_429=0, rate_5xx=0, retry_after=1
+    )
+    mock_llm.config.update(settings)
+    mock_llm.stats.clear()
+
+
+def test_429_halves_limit_and_honours_retry_after():
+    async def run():
+        await _use_mock(rate_429=1.0, retry_after=0.3)
+        limiter = anthropic_client._limiter
+        limit = limiter.limit
+        request = anthropic_client._build_request("test", "hello", 16, anthropic_client.DEFAULT_MODEL, 0.2)
+        try:
+            started = time.monotonic()
+            try:
+                await anthropic_client._post_with_retries(request, COST)
+            except httpx.HTTPStatusError as error:
+                assert error.response.status_code == 429
+            else:
+                raise AssertionError("expected the last 429 to be raised")
+            # Three attempts, each retry held back by the upstream's retry-after.
+            assert mock_llm.stats["anthropic_429"] == 3
+            assert time.monotonic() - started >= 2 * 0.3
+            assert limiter.limit == max(limiter.min_concurrency, limit / 8)
+            assert limiter.in_flight == 0
+        finally:
+            await anthropic_client.close_client()
+
+    asyncio.run(run())
+
+
+def test_success_grows_limit_again():
+    async def run():
+        limiter = LLMLimiter(initial_concurrency=4)
+        await limiter.acquire(COST)
+        limiter.release(COST, ok=False, overloaded=True, retry_after=0)
+        assert limiter.limit == 2
+        for _ in range(4):
+            await limiter.acquire(COST)
+            limiter.release(COST, ok=True)
+        assert 2 < limiter.limit <= 4
+        assert limiter.consecutive_failures == 0
+
+    asyncio.run(run())
+
+
+def test_request_bucket_throttles():
+    async def run():
+        # 600/minute refills one request every 0.1s.
+        limiter = LLMLimiter(rpm=600)
+        limiter.requests.tokens = 0
+        started = time.monotonic()
+        await limiter.acquire(COST)
+        assert time.monotonic() - started >= 0.09
+        assert limiter.throttled == 1
+
+    asyncio.run(run())
+
+
+def test_background_capped_below_limit():
+    async def run():
+        limiter = LLMLimiter(initial_concurrency=4)
+        cap = limiter.classes[BACKGROUND].cap(limiter.limit)
+        assert cap == 2
+        for _ in range(cap):
+            await limiter.acquire(COST, priority=BACKGROUND)
+        queued = asyncio.ensure_future(limiter.acquire(COST, priority=BACKGROUND))
+        await asyncio.sleep(0.01)
+        assert not queued.done()
+        # Interactive traffic still gets the remaining slots.
+        await asyncio.wait_for(limiter.acquire(COST, priority=INTERACTIVE), 0.1)
+        limiter.release(COST, ok=True, priority=BACKGROUND)
+        await asyncio.wait_for(queued, 0.1)
+        assert limiter.classes[BACKGROUND].in_flight == cap
+
+    asyncio.run(run())
+
+
+def test_interactive_overtakes_queued_background():
+    async def run():
+        limiter = LLMLimiter(initial_concurrency=1)
+        await limiter.acquire(COST, priority=INTERACTIVE)
+        order = []
+
+        async def wait(name, priority):
+            await limiter.acquire(COST, priority=priority)
+            order.append(name)
+            limiter.release(COST, ok=True, priority=priority)
+
+        waiters = [asyncio.ensure_future(wait(f"background-{n}", BACKGROUND)) for n in range(3)]
+        await asyncio.sleep(0.01)
+        waiters.append(asyncio.ensure_future(wait("interactive", INTERACTIVE)))
+        await asyncio.sleep(0.01)
+        limiter.release(COST, ok=True, priority=INTERACTIVE)
+        await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        assert order[0] == "interactive"
+        assert order[1:] == ["background-0", "background-1", "background-2"]
+
+    asyncio.run(run())
+
+
+def main():
+    tests = [
+        test_429_halves_limit_and_honours_retry_after,
+        test_success_grows_limit_again,
+        test_request_bucket_throttles,
+        test_background_capped_below_limit,
+        test_interactive_overtakes_queued_background,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
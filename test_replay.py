@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Tests for resumable `/api/chat` streams (`api/utils/replay.py`).
+
+The replay logs are driven in-process by small frame generators, so no
+gateway, database or server is needed. Run with pytest or directly.
+"""
+
+import asyncio
+import json
+import sys
+from typing import AsyncIterator, List
+
+from api.utils.replay import ReplayBuffer, ReplayLog
+
+
+def _frame(text: str) -> str:
+    return f"data: {json.dumps({'type': 'text-delta', 'delta': text})}\n\n"
+
+
+async def _frames(texts: List[str], delay: float = 0.0) -> AsyncIterator[str]:
+    for text in texts:
+        if delay:
+            await asyncio.sleep(delay)
+        yield _frame(text)
+
+
+async def _collect(frames: AsyncIterator[str]) -> str:
+    return "".join([chunk async for chunk in frames])
+
+
+def _event_ids(body: str) -> List[int]:
+    return [int(line[4:]) for line in body.split("\n") if line.startswith("id: ")]
+
+
+def test_resume_after_last_event_id():
+    async def run():
+        buffer = ReplayBuffer()
+        log = buffer.start("msg-1", _frames(["a", "b", "c", "d"], delay=0.01))
+        # A reconnect that already saw event 2 gets the rest, live.
+        await asyncio.sleep(0.025)
+        assert not log.finished
+        resumed = await _collect(buffer.get("msg-1").follow(2))
+        assert _event_ids(resumed) == [3, 4]
+        assert '"delta": "c"' in resumed and '"delta": "a"' not in resumed
+        # Without Last-Event-ID the whole turn is replayed.
+        assert _event_ids(await _collect(log.follow())) == [1, 2, 3, 4]
+        assert buffer.stats()["resumed"] == 1
+
+    asyncio.run(run())
+
+
+def test_ring_eviction_drops_old_frames():
+    async def run():
+        log = ReplayLog("msg-2", max_bytes=3 * len(_frame("x")) + 30)
+        await log.produce(_frames(["a", "b", "c", "d", "e", "f"]))
+        assert log.first_id > 1 and log.last_id == 6
+        # The endpoint answers 410 for these.
+        assert not log.retains(0)
+        assert not log.retains(log.first_id - 2)
+        assert log.retains(log.first_id - 1)
+        assert _event_ids(await _collect(log.follow(log.first_id - 1)))[-1] == 6
+        try:
+            await _collect(log.follow(0))
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("expected a replay from evicted frames to fail")
+
+    asyncio.run(run())
+
+
+def test_cancelled_turn_ends_with_error_part():
+    async def run():
+        buffer = ReplayBuffer()
+        log = buffer.start("msg-3", _frames(["a"] + ["b"] * 100, delay=0.01))
+        log.grace = 0.05
+        # The original client reads one chunk, then goes away.
+        follower = log.follow()
+        await follower.__anext__()
+        await follower.aclose()
+        await asyncio.sleep(0.2)
+
+        assert log.finished and log.cancelled
+        assert buffer.stats()["cancelled"] == 1
+        resumed = await _collect(log.follow(1))
+        assert '"type":"error"' in resumed
+        assert resumed.endswith("data: [DONE]\n\n")
+
+    asyncio.run(run())
+
+
+def test_finished_turns_expire():
+    async def run():
+        buffer = ReplayBuffer(ttl=0.05)
+        log = buffer.start("msg-4", _frames(["a"]))
+        await log.task
+        assert buffer.get("msg-4") is log
+        await asyncio.sleep(0.1)
+        assert buffer.get("msg-4") is None
+        assert buffer.stats()["expired"] == 1
+
+    asyncio.run(run())
+
+
+def main():
+    tests = [
+        test_resume_after_last_event_id,
+        test_ring_eviction_drops_old_frames,
+        test_cancelled_turn_ends_with_error_part,
+        test_finished_turns_expire,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Tests for request coalescing (`api/singleflight.py`).
+
+Run with pytest or directly.
+"""
+
+import asyncio
+import sys
+
+from api.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        assert results == ["answer"] * 5
+        assert calls == 1
+        assert flight.stats() == {"in_flight": 0, "upstream_calls": 1, "deduplicated": 4}
+
+    asyncio.run(run())
+
+
+def test_error_propagates_to_every_follower():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fail():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(*(flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+        assert calls == 1
+        assert all(isinstance(result, ValueError) and str(result) == "upstream failed" for result in results)
+        # A failed call is not remembered: the next caller tries again.
+        assert flight.stats()["in_flight"] == 0
+
+        async def succeed():
+            return "answer"
+
+        assert await flight.do("key", succeed) == "answer"
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_others():
+    async def run():
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        leader = asyncio.ensure_future(flight.do("key", fetch))
+        follower = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "answer"
+        assert leader.cancelled()
+
+    asyncio.run(run())
+
+
+def main():
+    tests = [
+        test_concurrent_callers_share_one_call,
+        test_error_propagates_to_every_follower,
+        test_cancelled_caller_does_not_cancel_others,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
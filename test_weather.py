@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Tests for the weather tool's forecast cache against the mock `/v1/forecast`.
+
+The mock app is called in-process through httpx's ASGI transport, so neither
+open-meteo nor a running mock server is needed. Run with pytest or directly.
+"""
+
+import asyncio
+import sys
+import time
+
+import httpx
+
+from api import mock_llm
+from api.utils import weather
+
+LATITUDE, LONGITUDE = 37.76, -122.42
+
+
+async def _use_mock() -> None:
+    """Point the weather client at the mock app and start from an empty cache."""
+    weather.clear_cache()
+    weather.WEATHER_API_URL = "http://mock/v1/forecast"
+    weather._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=mock_llm.app))
+    weather._loop = asyncio.get_running_loop()
+    mock_llm.config["weather_ms"] = 50
+    mock_llm.stats["weather_requests"] = 0
+
+
+def _age_entry(seconds: float) -> None:
+    """Make the cached entry for the test location `seconds` old."""
+    cell = weather.grid_cell(LATITUDE, LONGITUDE)
+    _, forecast = weather._cache[cell]
+    weather._cache[cell] = (time.monotonic() - seconds, forecast)
+
+
+def test_fresh_entry_served_from_cache():
+    async def run():
+        await _use_mock()
+        try:
+            first = await weather.get_forecast(LATITUDE, LONGITUDE)
+            # A nearby point in the same grid cell shares the entry.
+            second = await weather.get_forecast(LATITUDE + 0.01, LONGITUDE)
+            assert first is not None and second == first
+            assert mock_llm.stats["weather_requests"] == 1
+        finally:
+            await weather.close_client()
+
+    asyncio.run(run())
+
+
+def test_stale_entry_served_while_revalidating():
+    async def run():
+        await _use_mock()
+        try:
+            first = await weather.get_forecast(LATITUDE, LONGITUDE)
+            _age_entry(weather.WEATHER_CACHE_TTL + 1)
+            stale_hits = weather.stats()["stale_hits"]
+
+            started = time.monotonic()
+            stale = await weather.get_forecast(LATITUDE, LONGITUDE)
+            assert stale == first
+            # Returned without waiting for the mock's latency.
+            assert time.monotonic() - started < mock_llm.config["weather_ms"] / 1000.0
+            assert weather.stats()["stale_hits"] == stale_hits + 1
+            assert weather.stats()["refreshing"] == 1
+
+            await asyncio.gather(*weather._refreshing)
+            assert mock_llm.stats["weather_requests"] == 2
+            fetched_at, _ = weather._cache[weather.grid_cell(LATITUDE, LONGITUDE)]
+            assert time.monotonic() - fetched_at < weather.WEATHER_CACHE_TTL
+        finally:
+            await weather.close_client()
+
+    asyncio.run(run())
+
+
+def test_expired_entry_refetched():
+    async def run():
+        await _use_mock()
+        try:
+            await weather.get_forecast(LATITUDE, LONGITUDE)
+            _age_entry(weather.WEATHER_CACHE_TTL + weather.WEATHER_STALE_TTL + 1)
+            assert await weather.get_forecast(LATITUDE, LONGITUDE) is not None
+            assert mock_llm.stats["weather_requests"] == 2
+            assert weather.stats()["refreshing"] == 0
+        finally:
+            await weather.close_client()
+
+    asyncio.run(run())
+
+
+def test_concurrent_misses_share_one_fetch():
+    async def run():
+        await _use_mock()
+        try:
+            forecasts = await asyncio.gather(*(weather.get_forecast(LATITUDE, LONGITUDE) for _ in range(10)))
+            assert forecasts[0] is not None
+            assert all(forecast == forecasts[0] for forecast in forecasts)
+            assert mock_llm.stats["weather_requests"] == 1
+        finally:
+            await weather.close_client()
+
+    asyncio.run(run())
+
+
+def main():
+    tests = [
+        test_fresh_entry_served_from_cache,
+        test_stale_entry_served_while_revalidating,
+        test_expired_entry_refetched,
+        test_concurrent_misses_share_one_fetch,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ FAIL: {test.__name__} {e}")
+        else:
+            print(f"✅ PASS: {test.__name__}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())